@@ -0,0 +1,442 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Local HTTP stand-ins for the Asana and Google Sheets endpoints hydra uses.
+Each service runs on its own port as a keep-alive HTTP/1.1 server, keeps its
+state in memory, and counts the requests and bytes it sees in each direction.
+
+Asana honours opt_fields, limit and offset, and Sheets honours fields masks,
+so the byte counts track the trimming the API wrappers ask for.
+"""
+
+import json
+import time
+import base64
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+# Lifetime of the JWTs handed out by the fake JWT store task
+JWT_LIFETIME_SEC = 60 * 60
+
+# Ids of the fake Asana objects
+WORKSPACE_GID = '1000'
+BREW_PROJECT_GID = '2000'
+SANDBOX_TASK_GID = '3000'
+JWT_TASK_GID = '3001'
+EXCEPTION_LOG_TASK_GID = '3002'
+BATCH_TASK_GID = '3100'
+BATCH_SUBTASK_GID = '3101'
+BATCH_TASK_NAME = 'Hazy IPA'
+
+# Ids of the fake spreadsheets
+TEMPLATE_SHEET_ID = 'template'
+DEFAULT_SHEET_ID = 'sandbox'
+
+# Subsheet the trackers upload profiler diagnostics to
+DIAGNOSTICS_SHEET_NAME = 'Diagnostics'
+
+
+def _project(obj, paths):
+    """
+    Keep only the given dotted paths of obj, descending into lists, plus gid
+    """
+    if isinstance(obj, list):
+        return [_project(o, paths) for o in obj]
+    if not isinstance(obj, dict):
+        return obj
+    out = {}
+    if 'gid' in obj:
+        out['gid'] = obj['gid']
+    nested = {}
+    for path in paths:
+        head, _, rest = path.partition('.')
+        if head not in obj:
+            continue
+        if rest:
+            nested.setdefault(head, []).append(rest)
+        else:
+            out[head] = obj[head]
+    for head, rests in nested.items():
+        if obj[head] is None:
+            out[head] = None
+        else:
+            out[head] = _project(obj[head], rests)
+    return out
+
+
+def _expand_mask(mask):
+    """
+    Expand a Google fields mask like 'a.b(c,d),e' into dotted paths
+    """
+    paths = []
+    prefix = ''
+    token = ''
+    stack = []
+    for ch in mask + ',':
+        if ch == '(':
+            stack.append(prefix)
+            prefix = prefix + token + '.'
+            token = ''
+        elif ch in ',)':
+            if token:
+                paths.append(prefix + token)
+            token = ''
+            if ch == ')':
+                prefix = stack.pop()
+        else:
+            token += ch
+    return paths
+
+
+def _fake_jwt(exp):
+    def encode(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b'=').decode()
+    return f"{encode({'alg': 'RS256', 'typ': 'JWT'})}.{encode({'exp': exp})}.c2lnbmF0dXJl"
+
+
+class Counters:
+    """
+    Request and byte counts for one service, overall and per route
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.routes = {}
+
+    def add(self, route, request_bytes, response_bytes):
+        with self.lock:
+            self.requests += 1
+            self.request_bytes += request_bytes
+            self.response_bytes += response_bytes
+            counts = self.routes.setdefault(route, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += request_bytes
+            counts[2] += response_bytes
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        n_body = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(n_body) if n_body else b''
+        request_bytes = len(self.raw_requestline) + len(bytes(self.headers)) + n_body
+
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        payload = json.loads(body) if body.strip() else None
+        service = self.server.service
+        try:
+            route, status, response = service.handle(self.command, unquote(url.path), query, payload)
+        except (KeyError, IndexError, StopIteration):
+            route, status, response = 'not found', 404, {'errors': [{'message': 'Not found'}]}
+
+        data = json.dumps(response).encode() if not isinstance(response, bytes) else response
+        head = (
+            f'HTTP/1.1 {status} {"OK" if status < 400 else "Error"}\r\n'
+            f'Content-Type: application/json; charset=UTF-8\r\n'
+            f'Content-Length: {len(data)}\r\n\r\n'
+        ).encode()
+        self.wfile.write(head + data)
+        service.counters.add(f'{self.command} {route}', request_bytes, len(head) + len(data))
+
+    do_GET = _handle
+    do_PUT = _handle
+    do_POST = _handle
+
+
+class _Service:
+    """
+    A fake service served from its own local port
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.counters = Counters()
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def handle(self, method, path, query, payload):
+        with self.lock:
+            return self._route(method, path.strip('/').split('/'), query, payload)
+
+
+class Fake_asana(_Service):
+    """
+    Asana with one brew project, its housekeeping tasks, and one batch whose
+    subtask is assigned to the device in the 'In Primary' section
+    """
+    def __init__(self, clock, section='In Primary'):
+        super().__init__(clock)
+        self.comments = {}
+        self.workspaces = [
+            {'gid': '1001', 'name': 'Work', 'resource_type': 'workspace'},
+            {'gid': WORKSPACE_GID, 'name': 'Personal Projects', 'resource_type': 'workspace'},
+        ]
+        self.projects = [
+            {'gid': str(2100 + i), 'name': f'Side project {i}', 'resource_type': 'project'} for i in range(25)
+        ] + [{'gid': BREW_PROJECT_GID, 'name': 'Closet Brewing', 'resource_type': 'project'}]
+
+        membership = {
+            'project': {'gid': BREW_PROJECT_GID, 'name': 'Closet Brewing', 'resource_type': 'project'},
+            'section': {'gid': '4000', 'name': section, 'resource_type': 'section'},
+        }
+        batch = self._task(BATCH_TASK_GID, BATCH_TASK_NAME, memberships=[membership])
+        self.tasks = {t['gid']: t for t in [
+            self._task(SANDBOX_TASK_GID, 'Hydra sandbox'),
+            self._task(JWT_TASK_GID, 'Hydra Gsheets JWT Store'),
+            self._task(EXCEPTION_LOG_TASK_GID, 'Hydra exception log'),
+            batch,
+            self._task(BATCH_SUBTASK_GID, 'Track fermentation', parent=batch, assignee='me'),
+        ]}
+
+    def _task(self, gid, name, memberships=None, parent=None, assignee=None):
+        return {
+            'gid': gid,
+            'name': name,
+            'resource_type': 'task',
+            'completed': False,
+            'notes': '',
+            'assignee': {'gid': '1', 'resource_type': 'user'} if assignee else None,
+            'memberships': memberships or [],
+            'parent': parent,
+            'created_at': '2022-11-01T00:00:00.000Z',
+            'modified_at': '2022-11-01T00:00:00.000Z',
+            'permalink_url': f'https://app.asana.com/0/{BREW_PROJECT_GID}/{gid}',
+        }
+
+    def _get_task(self, gid):
+        task = self.tasks[gid]
+        if gid == JWT_TASK_GID:
+            # The refresher keeps a fresh token in the JWT store
+            task['notes'] = _fake_jwt(int(self.clock()) + JWT_LIFETIME_SEC)
+        return task
+
+    def _page(self, records, query):
+        """
+        Wrap records in a page response honouring limit, offset and opt_fields
+        """
+        limit = int(query.get('limit', 100))
+        offset = int(query.get('offset', 0))
+        page = records[offset:offset + limit]
+        next_page = None
+        if offset + limit < len(records):
+            next_page = {'offset': str(offset + limit), 'path': '', 'uri': ''}
+        return {'data': self._fields(page, query), 'next_page': next_page}
+
+    def _fields(self, data, query):
+        if 'opt_fields' in query:
+            return _project(data, query['opt_fields'].split(','))
+        return data
+
+    def _route(self, method, parts, query, payload):
+        parts = parts[2:]
+        if parts == ['users', 'me']:
+            me = {'gid': '1', 'name': 'Hydra', 'email': 'hydra@example.com', 'workspaces': self.workspaces}
+            return 'users/me', 200, {'data': self._fields(me, query)}
+        if parts[0] == 'workspaces' and parts[2] == 'projects':
+            return 'workspaces/*/projects', 200, self._page(self.projects, query)
+        if parts[0] == 'projects' and parts[2] == 'tasks':
+            tasks = [t for t in self.tasks.values() if t['parent'] is None]
+            return 'projects/*/tasks', 200, self._page(tasks, query)
+        if parts == ['tasks']:
+            tasks = [self._get_task(t['gid']) for t in self.tasks.values() if t['assignee'] and not t['completed']]
+            return 'tasks?assignee', 200, self._page(tasks, query)
+        if parts[0] == 'tasks' and len(parts) == 2:
+            task = self._get_task(parts[1])
+            if method == 'PUT':
+                task.update(payload['data'])
+            return 'tasks/*', 200, {'data': self._fields(task, query)}
+        if parts[0] == 'tasks' and parts[2] == 'stories':
+            self._get_task(parts[1])
+            comments = self.comments.setdefault(parts[1], [])
+            comments.append(payload['data']['text'])
+            story = {'gid': str(5000 + len(comments)), 'resource_type': 'story', 'type': 'comment', **payload['data']}
+            return 'tasks/*/stories', 201, {'data': self._fields(story, query)}
+        raise KeyError(parts)
+
+
+class Fake_sheets(_Service):
+    """
+    Google Sheets with a template spreadsheet to copy tabs from,
+    plus the permission updater endpoint
+    """
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.n_created = 0
+        self.spreadsheets = {
+            TEMPLATE_SHEET_ID: self._spreadsheet(TEMPLATE_SHEET_ID, ['Primary', 'Secondary', 'Coldcrash']),
+            DEFAULT_SHEET_ID: self._spreadsheet(DEFAULT_SHEET_ID, ['Primary', 'Secondary', 'Coldcrash']),
+        }
+
+    def _spreadsheet(self, id, titles):
+        return {
+            'spreadsheetId': id,
+            'sheets': [{'properties': {'sheetId': i, 'title': t, 'index': i}} for i, t in enumerate(titles)],
+            'values': {t: [] for t in titles},
+        }
+
+    def rows_appended(self):
+        """
+        Rows of samples appended so far, leaving out diagnostics
+        """
+        return sum(len(rows) for s in self.spreadsheets.values()
+            for title, rows in s['values'].items() if title != DIAGNOSTICS_SHEET_NAME)
+
+    def _fields(self, data, query):
+        if 'fields' in query:
+            return _project(data, _expand_mask(query['fields']))
+        return data
+
+    def _route(self, method, parts, query, payload):
+        if parts == ['permissions']:
+            return 'permissions', 200, b'OK'
+        parts = parts[2:]
+        if not parts:
+            self.n_created += 1
+            id = f'sheet{self.n_created}'
+            self.spreadsheets[id] = self._spreadsheet(id, ['Sheet1'])
+            body = {'spreadsheetId': id, 'properties': payload['properties'], 'sheets': self.spreadsheets[id]['sheets']}
+            return 'spreadsheets', 200, self._fields(body, query)
+
+        id, _, action = parts[0].partition(':')
+        spreadsheet = self.spreadsheets[id]
+        if len(parts) == 1 and action == 'batchUpdate':
+            for request in payload['requests']:
+                self._batch_request(spreadsheet, request)
+            return 'spreadsheets/*:batchUpdate', 200, self._fields({'spreadsheetId': id, 'replies': [{}]}, query)
+        if len(parts) == 1:
+            body = {'spreadsheetId': id, 'sheets': spreadsheet['sheets']}
+            return 'spreadsheets/*', 200, self._fields(body, query)
+        if parts[1] == 'sheets':
+            gid, _, _ = parts[2].partition(':')
+            dest = self.spreadsheets[payload['destinationSpreadsheetId']]
+            title = next(s['properties']['title'] for s in spreadsheet['sheets'] if s['properties']['sheetId'] == int(gid))
+            properties = {'sheetId': 100 + len(dest['sheets']), 'title': f'Copy of {title}', 'index': len(dest['sheets'])}
+            dest['sheets'].append({'properties': properties})
+            dest['values'][properties['title']] = []
+            return 'spreadsheets/*/sheets/*:copyTo', 200, self._fields(properties, query)
+        if parts[1] == 'values':
+            cell_range = parts[2]
+            if cell_range.endswith(':append'):
+                cell_range = cell_range[:-len(':append')]
+            sheet_name = cell_range.split('!')[0]
+            rows = spreadsheet['values'][sheet_name]
+            values = payload['values']
+            updates = {
+                'spreadsheetId': id,
+                'updatedRange': cell_range,
+                'updatedRows': len(values),
+                'updatedColumns': max((len(r) for r in values), default=0),
+                'updatedCells': sum(len(r) for r in values),
+            }
+            if method == 'POST':
+                rows.extend(values)
+                body = {'spreadsheetId': id, 'tableRange': f'{sheet_name}!A1:F{len(rows)}', 'updates': updates}
+                return 'values:append', 200, self._fields(body, query)
+            return 'values', 200, self._fields(updates, query)
+        raise KeyError(parts)
+
+    def _batch_request(self, spreadsheet, request):
+        sheets = spreadsheet['sheets']
+        if 'addSheet' in request:
+            title = request['addSheet']['properties']['title']
+            if title in spreadsheet['values']:
+                raise KeyError(title)
+            gid = 100 + len(sheets)
+            sheets.append({'properties': {'sheetId': gid, 'title': title, 'index': len(sheets)}})
+            spreadsheet['values'][title] = []
+        elif 'deleteSheet' in request:
+            gid = request['deleteSheet']['sheetId']
+            spreadsheet['sheets'] = [s for s in sheets if s['properties']['sheetId'] != gid]
+        elif 'updateSheetProperties' in request:
+            properties = request['updateSheetProperties']['properties']
+            for s in sheets:
+                if s['properties']['sheetId'] == properties['sheetId']:
+                    old = s['properties']['title']
+                    s['properties']['title'] = properties['title']
+                    spreadsheet['values'][properties['title']] = spreadsheet['values'].pop(old, [])
+
+
+class Fake_cloud:
+    """
+    Both services, started together. clock is the time source for things
+    like JWT expiry, so it follows the benchmark's virtual clock.
+    """
+    def __init__(self, clock=time.time, section='In Primary'):
+        self.asana = Fake_asana(clock, section)
+        self.sheets = Fake_sheets(clock)
+
+    def __enter__(self):
+        self.asana.start()
+        self.sheets.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.asana.stop()
+        self.sheets.stop()
+
+    def reset_counters(self):
+        self.asana.counters.reset()
+        self.sheets.counters.reset()
+
+    def totals(self):
+        """
+        Combined request and byte counts across both services
+        """
+        services = (self.asana.counters, self.sheets.counters)
+        return {
+            'requests': sum(c.requests for c in services),
+            'request_bytes': sum(c.request_bytes for c in services),
+            'response_bytes': sum(c.response_bytes for c in services),
+        }
+
+    def routes(self):
+        """
+        Per-route [requests, request bytes, response bytes], prefixed by service
+        """
+        routes = {}
+        for name, c in (('asana', self.asana.counters), ('sheets', self.sheets.counters)):
+            for route, counts in c.routes.items():
+                routes[f'{name} {route}'] = counts
+        return routes
+
+    def secrets(self, device_name):
+        """
+        Secrets that point the device at these services
+        """
+        return {
+            'ssid': 'bench',
+            'password': 'bench',
+            f'asana_personal_access_token_{device_name}': 'bench-token',
+            'hydra_permission_updater_url': f'{self.sheets.url}/permissions',
+            'gsheet_id_hydra_template': TEMPLATE_SHEET_ID,
+            'gsheet_id_default': DEFAULT_SHEET_ID,
+        }
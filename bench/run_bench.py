@@ -0,0 +1,342 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host-side benchmark of what a boot or a day of tracking costs on the network.
+
+Runs mpy.main, Fermentation_tracker and Coldcrash_tracker on linux with the
+mock sensor drivers, against local stand-ins for Asana and Google Sheets
+(fake_cloud.py). Shims in shims/ stand in for micropython, machine, network,
+ntptime and picosleep. Time is virtual: sleeps advance the clock instantly,
+so a day of tracking runs in seconds.
+
+Each scenario reports the requests, request and response bytes seen by the
+stand-ins, and the wall time it took to run. Any of those exceeding the
+committed budget in budgets.json fails the run.
+
+Usage, from the repo root:
+    python bench/run_bench.py [scenario ...] [--verbose] [--write-budgets]
+
+--write-budgets records the current numbers, with some slack, as the new budget.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Shims shadow nothing on CPython, but go first anyway so they always win
+sys.path[:0] = [os.path.join(BENCH_DIR, 'shims'), REPO_DIR, BENCH_DIR]
+
+import fake_cloud
+
+BUDGETS_FILE = os.path.join(BENCH_DIR, 'budgets.json')
+
+# Virtual clock start, fixed so every run sends the same timestamps
+VIRTUAL_EPOCH = 1_700_000_000
+
+# Slack applied by --write-budgets. Request counts get none, since any
+# extra request is a regression. Byte counts vary a little with the port numbers.
+BYTES_SLACK = 1.05
+WALL_SLACK = 3
+MIN_WALL_BUDGET_SEC = 2.0
+
+BUDGET_KEYS = ('requests', 'request_bytes', 'response_bytes', 'wall_sec')
+
+DAY_SEC = 24 * 60 * 60
+HOUR_SEC = 60 * 60
+
+
+class Scenario_done(BaseException):
+    """
+    Raised by the virtual clock once a scenario has run its length.
+    A BaseException, so the trackers' own exception handling doesn't swallow it.
+    """
+    pass
+
+
+class Virtual_clock:
+    """
+    Replaces time.time, time.monotonic and time.sleep. Sleeping advances the
+    clock immediately, and raises Scenario_done once it passes the deadline.
+    """
+    def __init__(self, start=VIRTUAL_EPOCH):
+        self.now = start
+        self.deadline = None
+        self._originals = None
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, sec):
+        self.now += sec
+        if sec > 0 and self.deadline is not None and self.now >= self.deadline:
+            raise Scenario_done()
+
+    def install(self):
+        self._originals = (time.time, time.monotonic, time.sleep)
+        time.time = self.time
+        time.monotonic = self.monotonic
+        time.sleep = self.sleep
+
+    def uninstall(self):
+        time.time, time.monotonic, time.sleep = self._originals
+
+
+def boot_modules(cloud):
+    """
+    Forget every hydra module, as a reset would, then point the fresh
+    ones at the stand-ins. State on flash (the working dir) is kept.
+    """
+    for name in [n for n in sys.modules if n == 'mpy' or n.startswith('mpy.')]:
+        del sys.modules[name]
+
+    import mpy.secrets
+    import mpy.hal.config as cfg
+    import mpy.util.simple_asana_api as asana_api
+    import mpy.util.simple_google_sheets_api as sheets_api
+
+    # Only the in-memory copy is touched, never secrets.py
+    mpy.secrets.secrets.clear()
+    mpy.secrets.secrets.update(cloud.secrets(cfg.NAME))
+    asana_api.ENDPOINT_BASE = f'{cloud.asana.url}/api/1.0'
+    asana_api.ENDPOINT_ME = f'{asana_api.ENDPOINT_BASE}/users/me'
+    sheets_api.ENDPOINT_BASE = f'{cloud.sheets.url}/v4/spreadsheets'
+
+
+def run_for(clock, func, duration_sec):
+    """
+    Run func until it returns or sleeps past duration_sec of virtual time
+    """
+    clock.deadline = clock.now + duration_sec
+    try:
+        func()
+    except Scenario_done:
+        pass
+
+
+def measure(cloud, clock, func, duration_sec=0):
+    """
+    Run func as in run_for, counting only the traffic it causes
+    """
+    import mpy.util.simple_http_session as session
+    import mpy.networking.radio as radio
+
+    cloud.reset_counters()
+    rows_before = cloud.sheets.rows_appended()
+    virtual_start = clock.now
+    t_start = time.perf_counter()
+    run_for(clock, func, duration_sec)
+    wall_sec = time.perf_counter() - t_start
+    session.close_all()
+
+    result = cloud.totals()
+    result['wall_sec'] = round(wall_sec, 3)
+    result['virtual_sec'] = clock.now - virtual_start
+    result['rows'] = cloud.sheets.rows_appended() - rows_before
+    result['radio_connects'] = radio.get_shared().n_connects
+    result['routes'] = cloud.routes()
+    return result
+
+
+def scenario_boot_cold(cloud, clock):
+    """
+    First boot: app discovery, sheet setup and the first sample, up to the first sleep
+    """
+    boot_modules(cloud)
+    import mpy.main as main
+    return measure(cloud, clock, main.main)
+
+
+def scenario_boot_warm(cloud, clock):
+    """
+    Reboot after a first boot, resuming from the checkpoint and caches on flash
+    """
+    boot_modules(cloud)
+    import mpy.main as main
+    run_for(clock, main.main, 0)
+
+    boot_modules(cloud)
+    import mpy.main as main
+    return measure(cloud, clock, main.main)
+
+
+def scenario_fermentation_day(cloud, clock):
+    """
+    A day of fermentation tracking, with the settings main runs it with
+    """
+    boot_modules(cloud)
+    import mpy.app.fermentation_tracker as fermentation_tracker
+
+    def run():
+        ft = fermentation_tracker.Fermentation_tracker(
+            mode='Primary',
+            active_task_gid=fake_cloud.BATCH_TASK_GID,
+            active_subtask_gid=fake_cloud.BATCH_SUBTASK_GID,
+            active_parent_task_name=fake_cloud.BATCH_TASK_NAME,
+            warning_thresh_lux=50.0,
+            warning_thresh_temp=26.0,
+            sample_period_sec=3000,
+            min_sample_period_sec=300,
+            max_sample_period_sec=3000,
+            upload_buf_quota=1
+        )
+        ft.run_blocking()
+
+    return measure(cloud, clock, run, DAY_SEC)
+
+
+def scenario_coldcrash_hour(cloud, clock):
+    """
+    An hour of coldcrash tracking, with the settings main runs it with.
+    Driven by run_blocking, since asyncio's loop can't run on the virtual clock.
+    The network traffic is the same.
+    """
+    boot_modules(cloud)
+    import mpy.app.coldcrash_tracker as coldcrash_tracker
+
+    def run():
+        ct = coldcrash_tracker.Coldcrash_tracker(
+            active_task_gid=fake_cloud.BATCH_TASK_GID,
+            active_subtask_gid=fake_cloud.BATCH_SUBTASK_GID,
+            active_parent_task_name=fake_cloud.BATCH_TASK_NAME,
+            sample_period_sec=1,
+            max_sample_period_sec=10,
+            target_temp=20,
+            rollup_window_sec=60
+        )
+        ct.run_blocking()
+
+    return measure(cloud, clock, run, HOUR_SEC)
+
+
+SCENARIOS = {
+    'boot_cold': scenario_boot_cold,
+    'boot_warm': scenario_boot_warm,
+    'fermentation_day': scenario_fermentation_day,
+    'coldcrash_hour': scenario_coldcrash_hour,
+}
+
+
+def run_scenario(name, verbose=False):
+    """
+    Run one scenario in a fresh working dir, standing in for flash,
+    against fresh stand-ins. Returns its result and working dir.
+    """
+    workdir = tempfile.mkdtemp(prefix=f'hydra_bench_{name}_')
+    cwd = os.getcwd()
+    clock = Virtual_clock()
+    random.seed(name)
+
+    with open(os.path.join(workdir, 'output.log'), 'w') as log:
+        out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(log)
+        err = contextlib.nullcontext() if verbose else contextlib.redirect_stderr(log)
+        clock.install()
+        try:
+            os.chdir(workdir)
+            with fake_cloud.Fake_cloud(clock.time) as cloud, out, err:
+                result = SCENARIOS[name](cloud, clock)
+        finally:
+            clock.uninstall()
+            os.chdir(cwd)
+    return result, workdir
+
+
+def check(name, result, budget):
+    """
+    Returns a list of reasons the result fails its budget
+    """
+    failures = []
+    if not result['rows']:
+        failures.append("no rows reached the sheet, the run is broken")
+    if budget is None:
+        failures.append("no budget, run with --write-budgets to record one")
+        return failures
+    for key in BUDGET_KEYS:
+        if key in budget and result[key] > budget[key]:
+            failures.append(f"{key} {result[key]} exceeds budget {budget[key]}")
+    return failures
+
+
+def make_budget(result):
+    return {
+        'requests': result['requests'],
+        'request_bytes': math.ceil(result['request_bytes'] * BYTES_SLACK),
+        'response_bytes': math.ceil(result['response_bytes'] * BYTES_SLACK),
+        'wall_sec': round(max(MIN_WALL_BUDGET_SEC, result['wall_sec'] * WALL_SLACK), 1),
+    }
+
+
+def load_budgets():
+    try:
+        with open(BUDGETS_FILE, 'r') as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+
+def print_routes(result):
+    for route, (n, sent, received) in sorted(result['routes'].items()):
+        print(f"    {route:<44} {n:>5} requests {sent:>9} B sent {received:>9} B received")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', choices=[[]] + list(SCENARIOS), help='scenarios to run, default all')
+    parser.add_argument('--verbose', action='store_true', help="show hydra's output and the per-route breakdown")
+    parser.add_argument('--write-budgets', action='store_true', help='record the results as the new budgets')
+    args = parser.parse_args()
+
+    budgets = load_budgets()
+    names = args.scenarios or list(SCENARIOS)
+    n_failed = 0
+
+    print(f"{'scenario':<18} {'requests':>8} {'sent B':>9} {'recv B':>9} {'wall s':>7} {'virtual s':>9} {'rows':>5} {'radio':>5}")
+    for name in names:
+        result, workdir = run_scenario(name, args.verbose)
+        print(f"{name:<18} {result['requests']:>8} {result['request_bytes']:>9} {result['response_bytes']:>9} "
+              f"{result['wall_sec']:>7} {result['virtual_sec']:>9} {result['rows']:>5} {result['radio_connects']:>5}")
+
+        if args.write_budgets:
+            budgets[name] = make_budget(result)
+            failures = [] if result['rows'] else ["no rows reached the sheet, the run is broken"]
+        else:
+            failures = check(name, result, budgets.get(name))
+
+        if args.verbose or failures:
+            print_routes(result)
+        if failures:
+            n_failed += 1
+            for failure in failures:
+                print(f"  FAIL: {failure}")
+            print(f"  Output and flash contents kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.write_budgets and not n_failed:
+        with open(BUDGETS_FILE, 'w') as f:
+            json.dump(budgets, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f"Budgets written to {BUDGETS_FILE}")
+
+    if n_failed:
+        print(f"{n_failed} of {len(names)} scenarios failed")
+        sys.exit(1)
+    print("All scenarios within budget")
+
+
+if __name__ == '__main__':
+    main()
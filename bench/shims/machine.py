@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for micropython's machine module, for the benchmark.
+Pins and the RTC keep their state in memory. There are no I2C devices,
+so the benchmark runs with the mock sensor drivers.
+"""
+
+import time
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode=OUT, value=0):
+        self.id = id
+        self.mode = mode
+        self._value = value
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def toggle(self):
+        self._value = 0 if self._value else 1
+
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400_000):
+        self.id = id
+        self.freq = freq
+
+    def scan(self):
+        return []
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        raise OSError(19, 'no I2C device')
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        raise OSError(19, 'no I2C device')
+
+    def writeto_mem(self, addr, memaddr, buf):
+        raise OSError(19, 'no I2C device')
+
+
+class RTC:
+    def datetime(self, dt=None):
+        if dt is None:
+            tm = time.gmtime(time.time())
+            return (tm[0], tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], 0)
+
+
+class _Mem:
+    def __getitem__(self, addr):
+        return 0
+
+    def __setitem__(self, addr, value):
+        pass
+
+
+mem32 = _Mem()
+
+
+def freq(hz=None):
+    return 125_000_000
+
+def unique_id():
+    return b'\x00' * 8
+
+def reset():
+    raise SystemExit('machine.reset()')
@@ -0,0 +1,28 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for micropython's micropython module, for the benchmark
+"""
+
+def const(x):
+    return x
+
+def native(f):
+    return f
+
+def viper(f):
+    return f
+
+def opt_level(level=None):
+    return 0
+
+def mem_info(verbose=None):
+    return None
+
+def qstr_info(verbose=None):
+    return None
+
+def alloc_emergency_exception_buf(size):
+    pass
@@ -0,0 +1,9 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for micropython's network module, for the benchmark
+"""
+
+from mpy.networking.fake_network import *
@@ -0,0 +1,19 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for micropython's ntptime module, for the benchmark.
+Reads the host clock, which the benchmark may have replaced with a virtual one.
+"""
+
+import time as _time
+
+host = 'pool.ntp.org'
+timeout = 1
+
+def time():
+    return int(_time.time())
+
+def settime():
+    pass
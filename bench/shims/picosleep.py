@@ -0,0 +1,13 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host stand-in for the picosleep module, for the benchmark.
+Deep sleep is a plain sleep.
+"""
+
+import time
+
+def seconds(n):
+    time.sleep(n)
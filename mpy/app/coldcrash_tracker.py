@@ -11,44 +11,116 @@ import time
 import gc
 
 import mpy.hal.adapter.temp_sensor
+import mpy.hal.sensor_burst as sensor_burst
+import mpy.hal.i2c_bus as i2c_bus
 
 import mpy.util.simple_asana_handler
 import mpy.util.simple_google_sheets_handler
+import mpy.util.simple_http_session as session
+import mpy.util.async_runtime as async_runtime
+import mpy.util.sample_store as sample_store
+import mpy.util.adaptive_period as adaptive_period
+import mpy.util.flush_policy as flush_policy
+import mpy.util.checkpoint as checkpoint
+import mpy.util.profiler as profiler
+import mpy.util.diag_log as diag_log
+import mpy.util.outbox as outbox
+import mpy.util.tracker_outbox as tracker_outbox
+import mpy.util.tracker_samples as tracker_samples
 import mpy.util.util as util
+import mpy.networking.radio as radio
+import mpy.networking.time_service as time_service
 
 IS_LINUX = (sys.platform == 'linux')
 
 if not IS_LINUX:
     from machine import Pin
-    import mpy.networking.wifi as wifi
 
-class Coldcrash_tracker:
+class Coldcrash_tracker(tracker_outbox.Tracker_outbox, tracker_samples.Tracker_samples):
     """
     App for tracking coldcrash temperature, and reporting as soon as it's complete
     """
     # Tracked variables. Initialize to below start thresh
     temp = 0.0
+    n = 0
     target_temp = 0.0
     start_thresh_temp = 40
     start_thresh_met = False
 
+    # Column layout of a logged sample: timestamp, temp (fixed-point), sample period
+    SAMPLE_COLUMNS = (
+        sample_store.COLUMN_TIMESTAMP,
+        sample_store.COLUMN_TEMP,
+        sample_store.COLUMN_FLOAT,
+    )
+
+    # Sheet column labels of a logged sample, in SAMPLE_COLUMNS order
+    SAMPLE_HEADER = ('POSIX Time', 'Temp (C)', 'Sample period (s)')
+
+    # Changes smaller than this are treated as sensor noise by the adaptive period
+    NOISE_FLOOR_TEMP = 0.0625
+
     def __init__(self,
         active_task_gid=None,
         active_subtask_gid=None,
         active_parent_task_name=None,
         sample_period_sec=1,
-        target_temp=30
+        min_sample_period_sec=None,
+        max_sample_period_sec=None,
+        slope_thresh_temp=0.5,
+        target_temp=30,
+        upload_buf_quota=60,
+        max_upload_age_sec=5 * 60,
+        max_upload_bytes=None,
+        max_ram_rows=64,
+        rollup_window_sec=None,
+        burst_len=3,
+        resume=None
         ):
         # Store user specified settings
         self.sample_period_sec = sample_period_sec
         self.target_temp = target_temp
+        self.burst_len = burst_len
+        self.max_ram_rows = max_ram_rows
 
-        # Sensor value logging buffer
-        self.buf = []
+        # Batch uploads rather than sending a request per sample
+        self.flush_policy = flush_policy.Flush_policy(upload_buf_quota, max_upload_age_sec, max_upload_bytes)
+
+        # Adapt the sample period to how fast temp is moving (degrees per minute),
+        # if given a range to adapt within
+        self.adaptive_period = None
+        if min_sample_period_sec is not None or max_sample_period_sec is not None:
+            self.adaptive_period = adaptive_period.Adaptive_period(
+                sample_period_sec,
+                min_sample_period_sec or sample_period_sec,
+                max_sample_period_sec or sample_period_sec,
+                (slope_thresh_temp,),
+                (self.NOISE_FLOOR_TEMP,)
+            )
+            self.sample_period_sec = self.adaptive_period.period_sec
+
+        # Unsent samples, kept on flash until uploaded, and optionally rolled up
+        self.init_samples('coldcrash', rollup_window_sec)
 
         # TODO: Grab timezone dynamically from secrets instead
         self.UTC_OFFSET = -8 * 60 * 60
 
+        # Wi-Fi only comes up when there's network work to do
+        self.radio = radio.get_shared()
+
+        # Drift-corrected clock for sample timestamps, so we don't need NTP on every wake
+        self.clock = time_service.get_shared()
+
+        # Phase timings and allocations, uploaded periodically as a diagnostics row
+        self.profiler = profiler.get_shared()
+
+        # Exceptions and events, logged to flash for later inspection
+        self.diag = diag_log.get_shared()
+
+        # Outgoing Asana and Sheets operations, sent in priority order within a budget per wake,
+        # and the exception digest
+        self.init_outbox()
+
         # Grab resources
         if not IS_LINUX:
             self.pin = Pin("LED", Pin.OUT)
@@ -56,38 +128,74 @@ class Coldcrash_tracker:
         while True:
             print("Trying to connect and init")
             try:
-                # Connect to wifi if running on mpy hardware, and turn on LED to indicate trying to connect
+                # Connect to wifi, and turn on LED to indicate trying to connect
                 if not IS_LINUX:
                     self.pin.on()
-                    wifi.connect_with_retry()
+                if not self.radio.acquire():
+                    raise RuntimeError("Couldn't connect to wifi")
 
                 # Grab resources
                 self.temp_sensor = mpy.hal.adapter.temp_sensor.Temp_sensor()
+
+                # Median of a short burst per sample. Kept short, since at 1 Hz it
+                # takes up a good part of each sample period.
+                self.sensor_burst = sensor_burst.Sensor_burst((self.temp_sensor,), self.burst_len)
                 self.asana_handler = mpy.util.simple_asana_handler.Simple_asana_handler(active_task=active_task_gid, active_subtask=active_subtask_gid)
 
-                active_task_description = self.asana_handler.get_active_task_description()
-                self.gsheets_handler = mpy.util.simple_google_sheets_handler.Simple_google_handler(
-                    new_sheet_name=active_parent_task_name,
-                    existing_sheet_name=active_task_description,
-                    subsheet='Coldcrash'
-                )
+                if resume is not None:
+                    # The sheet was set up and linked from the task before the reset
+                    self.gsheets_handler = mpy.util.simple_google_sheets_handler.Simple_google_handler(
+                        existing_sheet_id=resume['sheet_id'],
+                        subsheet='Coldcrash',
+                        header=self.sheet_header
+                    )
+                else:
+                    active_task_description = self.asana_handler.get_active_task_description()
+                    self.gsheets_handler = mpy.util.simple_google_sheets_handler.Simple_google_handler(
+                        new_sheet_name=active_parent_task_name,
+                        existing_sheet_name=active_task_description,
+                        subsheet='Coldcrash',
+                        header=self.sheet_header
+                    )
 
-                # Update the active Asana task with the new Google Sheet URL
-                self.asana_handler.update_active_task_description(
-                    self.gsheets_handler.get_active_sheet_url()
-                )
+                    # Update the active Asana task with the new Google Sheet URL
+                    self.outbox.enqueue('description', outbox.PRIORITY_HOUSEKEEPING,
+                        {'task_gid': active_task_gid, 'desc': self.gsheets_handler.get_active_sheet_url()},
+                        key='description')
+                    self.outbox.enqueue('header', outbox.PRIORITY_HOUSEKEEPING, key='header')
 
                 # Turn off LED to indicate connection and init success
                 if not IS_LINUX:
                     self.pin.off()
+                self.radio.release()
                 break
 
-            except:
+            except BaseException as e:
+                self.radio.release()
+                self.log_exception(e)
                 n_init_retries += 1
                 print(f"Init retry #{n_init_retries}")
                 print("Sleeping for 1 sample period before next retry")
                 util.prepare_and_sleep(duration=self.sample_period_sec)
 
+        # Pick up where we left off, or checkpoint the setup so a reset can
+        if resume is not None:
+            self.n = resume.get('n_samples', 0)
+            self.start_thresh_met = resume.get('app_state', {}).get('start_thresh_met', False)
+        elif active_subtask_gid:
+            # Let whoever assigned the subtask know we've picked it up
+            self.outbox.enqueue('comment', outbox.PRIORITY_HOUSEKEEPING, {'task_gid': active_subtask_gid, 'text': 'On it!'})
+            checkpoint.save({
+                'app': 'coldcrash_tracker',
+                'mode': 'Planned',
+                'task_gid': active_task_gid,
+                'subtask_gid': active_subtask_gid,
+                'task_name': active_parent_task_name,
+                'sheet_id': self.gsheets_handler.sheet_id,
+                'n_samples': self.n,
+                'app_state': {'start_thresh_met': self.start_thresh_met},
+            })
+
     def fetch_target_temp(self):
         """
         Fetch the desired final temperature from Asana
@@ -104,59 +212,131 @@ class Coldcrash_tracker:
             self.step()
             time.sleep(self.sample_period_sec)
 
+        self.flush()
+        checkpoint.clear()
+        self.diag.event("coldcrash done")
+        self.diag.flush()
         print("All done! Target temperature met. Exiting.")
 
-    def step(self):
+    def run_async(self, duration_sec=None):
+        """
+        Run with sampling and uploads as separate asyncio tasks, so slow
+        network calls never delay a sample. Stops once the target temp is met,
+        or after duration_sec if given.
+        """
+        print("Starting coldcrash tracker (async)")
+        runtime = async_runtime.Tracker_runtime(self, self.sample_period_sec)
+        stats = runtime.run(duration_sec)
+        if self.is_done():
+            self.flush()
+            checkpoint.clear()
+            self.diag.event("coldcrash done")
+            self.diag.flush()
+            print("All done! Target temperature met. Exiting.")
+        return stats
+
+    def is_done(self):
+        """
+        Returns True once we've crossed the start threshold and come back down to target temp
+        """
+        return self.start_thresh_met and self.temp <= self.target_temp
+
+    def report_warning(self, snapshot):
+        """
+        Coldcrash has no warnings. Present for the async runtime.
+        """
+        pass
+
+    def sample(self):
         """
-        Toggle the LED and grab and log a sensor sample
+        Toggle the LED and grab and log a sensor sample.
+        Coldcrash has no warnings, so always returns None.
         """
         # Toggle LED
         if not IS_LINUX:
             self.pin.toggle()
 
-        # Force garbage collection just in case
-        gc.collect()
-
         # Read sensor
-        self.temp = self.temp_sensor.read()
+        with self.profiler.span('sensor'):
+            self.temp = self.sensor_burst.read()[0]
+        return self.log_reading()
+
+    async def sample_async(self):
+        """
+        Like sample(), but yields to the event loop while the burst waits between reads.
+        Used by the async runtime.
+        """
+        if not IS_LINUX:
+            self.pin.toggle()
+        with self.profiler.span('sensor'):
+            values = await self.sensor_burst.read_async()
+        self.temp = values[0]
+        return self.log_reading()
+
+    def log_reading(self):
+        """
+        Log the temp just read, and update the start threshold and sample period
+        """
+        self.n += 1
 
         # Flip start_thresh_met the first time we exceed it
         if not self.start_thresh_met:
             if self.temp > self.start_thresh_temp:
                 self.start_thresh_met = True
+                # Report the start of the crash right away
+                self.flush_policy.mark_urgent()
+                self.save_checkpoint()
+
+        # Pick the next sample period. It's logged with every sample, so changes show up in the sheet.
+        timestamp = self.clock.now() + self.UTC_OFFSET
+        if self.adaptive_period is not None:
+            self.sample_period_sec = self.adaptive_period.update(timestamp, (self.temp,))
+            if self.adaptive_period.changed:
+                print(f'Sample period changed to {self.sample_period_sec} sec')
 
         # Log this sample
-        timestamp = time.time() + self.UTC_OFFSET
-        self.buf.append([timestamp, self.temp])
-
-        # Upload it
-        self.upload_and_clear_log()
-
-    def upload_and_clear_log(self):
-        """
-        Upload buffer log to gsheets, then clear local buffer
-        """
-        print("Uploading")
-        try:
-
-            # a = random.randint(0,1)
-            # if a == 1:
-            #     raise RuntimeError("Is this your card?")
-
-            upload_success = self.gsheets_handler.upload_list(self.buf)
-            # upload_success = self.asana_handler.update_exception_log(str(self.buf[0]))
-            # if upload_success:
-            if upload_success != False:
-                self.buf = []
-                print("Done uploading")
-            else:
-                print("Upload returned false. Will keep buffer intact and try again next sample.")
-        # except:
-        #     print("Upload threw exception. Will keep buffer intact and try again next sample.")
-        #     util.blink(n_periods=4, n_blinks_per_period=5, period=0.2, blink_interval=0.1)
-
-        except BaseException as e:
-            #     # TODO: blink pattern
-            #     self.pin.on()
-                print("Hit exception in step. Continuing.")
-                sys.print_exception(e)
\ No newline at end of file
+        self.record_sample([timestamp, self.temp, self.sample_period_sec])
+        return None
+
+    def step(self):
+        """
+        Grab and log a sensor sample, and upload if the flush policy says it's worth it
+        """
+        # Force garbage collection just in case
+        with self.profiler.span('gc'):
+            gc.collect()
+
+        self.sample()
+
+        # Queue an upload if the flush policy says it's worth it. The rows are already on flash.
+        if self.should_upload():
+            self.outbox.enqueue('upload', outbox.PRIORITY_DATA, key='upload', durable=False)
+        self.queue_housekeeping()
+        self.send_outbox()
+
+        # Report how much network time keep-alive saved us this step, and sensor bus time.
+        # Between uploads the radio powers down once it's been idle for a while.
+        session.report_stats(reset=True)
+        i2c_bus.report_stats(reset=True)
+        self.radio.idle()
+
+    def save_checkpoint(self):
+        """
+        Update the sample count and start threshold state in the resume checkpoint.
+        Only called when the threshold state changes, to spare the flash, so the
+        checkpointed sample count lags. Unsent samples are tracked by the WAL.
+        """
+        checkpoint.update(n_samples=self.n, app_state={'start_thresh_met': self.start_thresh_met})
+
+    def flush(self):
+        """
+        Log the partial rollup window if any, and upload everything buffered, e.g. once we're done.
+        Tries even if earlier uploads failed and are backing off, since this is the last chance.
+        """
+        if self.rollup is not None:
+            closed = self.rollup.flush()
+            if closed is not None:
+                self.log_sample(closed)
+        self.outbox.enqueue('upload', outbox.PRIORITY_DATA, key='upload', durable=False)
+        self.outbox.retry_now('upload')
+        self.send_outbox()
@@ -8,25 +8,37 @@ App for tracking and reporting fermentation stats, including warnings
 
 import sys
 import time
-import io
 import gc
-import random
-import micropython
 
 import mpy.hal.adapter.temp_sensor
 import mpy.hal.adapter.ambient_light_sensor
+import mpy.hal.sensor_burst as sensor_burst
+import mpy.hal.i2c_bus as i2c_bus
 
 import mpy.util.simple_asana_handler
 import mpy.util.simple_google_sheets_handler
+import mpy.util.simple_http_session as session
+import mpy.util.async_runtime as async_runtime
+import mpy.util.sample_store as sample_store
+import mpy.util.rollup as rollup
+import mpy.util.adaptive_period as adaptive_period
+import mpy.util.flush_policy as flush_policy
+import mpy.util.checkpoint as checkpoint
+import mpy.util.profiler as profiler
+import mpy.util.diag_log as diag_log
+import mpy.util.outbox as outbox
+import mpy.util.tracker_outbox as tracker_outbox
+import mpy.util.tracker_samples as tracker_samples
 import mpy.util.util as util
+import mpy.networking.radio as radio
+import mpy.networking.time_service as time_service
 
 IS_LINUX = (sys.platform == 'linux')
 
 if not IS_LINUX:
     from machine import Pin
-    import mpy.networking.wifi as wifi
 
-class Fermentation_tracker:
+class Fermentation_tracker(tracker_outbox.Tracker_outbox, tracker_samples.Tracker_samples):
     """
     App for tracking and reporting fermentation stats, including warnings
     """
@@ -39,11 +51,23 @@ class Fermentation_tracker:
     warning_state_is_active_temp = False
     warning_state_is_active_lux = False
 
-    # Save exceptions thrown from within step, so we can report them in asana
-    step_exception_msg = None
+    # Column layout of a logged sample:
+    # timestamp, temp (fixed-point), lux, mem_free_before_gc, mem_free_after_gc, sample period
+    SAMPLE_COLUMNS = (
+        sample_store.COLUMN_TIMESTAMP,
+        sample_store.COLUMN_TEMP,
+        sample_store.COLUMN_FLOAT,
+        sample_store.COLUMN_INT,
+        sample_store.COLUMN_INT,
+        sample_store.COLUMN_FLOAT,
+    )
 
-    # Error log file name
-    ERROR_LOG_FILE_NAME = 'ferm_track_error_log.txt'
+    # Sheet column labels of a logged sample, in SAMPLE_COLUMNS order
+    SAMPLE_HEADER = ('POSIX Time', 'Temp (C)', 'Light (Lux)', 'Mem free before gc (B)', 'Mem free after gc (B)', 'Sample period (s)')
+
+    # Changes smaller than these are treated as sensor noise by the adaptive period
+    NOISE_FLOOR_TEMP = 0.0625
+    NOISE_FLOOR_LUX = 0.5
 
     def __init__(self,
         mode='Primary',
@@ -51,16 +75,43 @@ class Fermentation_tracker:
         active_subtask_gid=None,
         active_parent_task_name=None,
         sample_period_sec=10,
+        min_sample_period_sec=None,
+        max_sample_period_sec=None,
+        slope_thresh_temp=0.5,
+        slope_thresh_lux=5.0,
         upload_buf_quota=10,
+        max_upload_age_sec=None,
+        max_upload_bytes=None,
+        max_ram_rows=64,
+        rollup_window_sec=None,
+        raw_history_rows=rollup.RAW_HISTORY_ROWS,
         warning_thresh_temp=25.0,
-        warning_thresh_lux=15.0
+        warning_thresh_lux=15.0,
+        burst_len=sensor_burst.BURST_LEN,
+        resume=None
         ):
         # Store user specified settings
         self.sample_period_sec = sample_period_sec
+        self.burst_len = burst_len
         self.upload_buf_quota = upload_buf_quota
+        self.flush_policy = flush_policy.Flush_policy(upload_buf_quota, max_upload_age_sec, max_upload_bytes)
+        self.max_ram_rows = max_ram_rows
         self.warning_thresh_temp = warning_thresh_temp
         self.warning_thresh_lux = warning_thresh_lux
 
+        # Adapt the sample period to how fast temp and lux are moving (slopes per minute),
+        # if given a range to adapt within
+        self.adaptive_period = None
+        if min_sample_period_sec is not None or max_sample_period_sec is not None:
+            self.adaptive_period = adaptive_period.Adaptive_period(
+                sample_period_sec,
+                min_sample_period_sec or sample_period_sec,
+                max_sample_period_sec or sample_period_sec,
+                (slope_thresh_temp, slope_thresh_lux),
+                (self.NOISE_FLOOR_TEMP, self.NOISE_FLOOR_LUX)
+            )
+            self.sample_period_sec = self.adaptive_period.period_sec
+
         # TODO: Grab timezone dynamically from secrets instead
         self.UTC_OFFSET = -8 * 60 * 60
 
@@ -68,58 +119,110 @@ class Fermentation_tracker:
         if not IS_LINUX:
             self.pin = Pin("LED", Pin.OUT)
 
+        # Wi-Fi only comes up when there's network work to do
+        self.radio = radio.get_shared()
+
+        # Drift-corrected clock for sample timestamps, so we don't need NTP on every wake
+        self.clock = time_service.get_shared()
+
+        # Phase timings and allocations, uploaded periodically as a diagnostics row
+        self.profiler = profiler.get_shared()
+
+        # Memory, exceptions and events, logged to flash for later inspection
+        self.diag = diag_log.get_shared()
+
+        # Outgoing Asana and Sheets operations, sent in priority order within a budget per wake,
+        # and the exception digest. Queued warnings are kept on flash until sent, like housekeeping.
+        self.init_outbox()
+        self.outbox.register('warning', self.send_warning)
+
+        # Unsent samples, kept on flash until uploaded, and optionally rolled up
+        self.init_samples('ferm', rollup_window_sec, raw_history_rows)
+
         # Connect to wifi and init resources.
         # If anything fails, just sleep and try again.
         n_init_retries = 0
         while True:
             print("Trying to connect and init")
             try:
-                # Connect to wifi if running on mpy hardware, and turn on LED to indicate trying to connect
+                # Connect to wifi, and turn on LED to indicate trying to connect
                 if not IS_LINUX:
                     self.pin.on()
-                    wifi.connect_with_retry()
+                if not self.radio.acquire():
+                    raise RuntimeError("Couldn't connect to wifi")
 
                 # Grab resources
                 print("Initing temp sensor")
                 self.temp_sensor = mpy.hal.adapter.temp_sensor.Temp_sensor()
                 print("Temp sensor initialized")
                 self.ambient_light_sensor = mpy.hal.adapter.ambient_light_sensor.Ambient_light_sensor()
+
+                # Each sample is the median of a burst of reads. The temp sensor is read
+                # within the light sensor's integration window.
+                self.sensor_burst = sensor_burst.Sensor_burst((self.temp_sensor, self.ambient_light_sensor), self.burst_len)
                 print("Sensors initialized. Initing Asana")
                 self.asana_handler = mpy.util.simple_asana_handler.Simple_asana_handler(active_task=active_task_gid, active_subtask=active_subtask_gid)
-                print("Asana initialized. Getting active task")
-                active_task_description = self.asana_handler.get_active_task_description()
-
-                print("Initing Google")
-                self.gsheets_handler = mpy.util.simple_google_sheets_handler.Simple_google_handler(
-                    new_sheet_name=active_parent_task_name,
-                    existing_sheet_name=active_task_description,
-                    subsheet=mode
-                )
-                print("Google initialized. Writing sheet URL to Asana task desc")
-
-                # Update the active Asana task with the new Google Sheet URL
-                self.asana_handler.update_active_task_description(
-                    self.gsheets_handler.get_active_sheet_url()
-                )
-                print("URL written")
+
+                if resume is not None:
+                    # The sheet was set up and linked from the task before the reset
+                    print("Asana initialized. Resuming Google from checkpoint")
+                    self.gsheets_handler = mpy.util.simple_google_sheets_handler.Simple_google_handler(
+                        existing_sheet_id=resume['sheet_id'],
+                        subsheet=mode,
+                        header=self.sheet_header
+                    )
+                else:
+                    print("Asana initialized. Getting active task")
+                    active_task_description = self.asana_handler.get_active_task_description()
+
+                    print("Initing Google")
+                    self.gsheets_handler = mpy.util.simple_google_sheets_handler.Simple_google_handler(
+                        new_sheet_name=active_parent_task_name,
+                        existing_sheet_name=active_task_description,
+                        subsheet=mode,
+                        header=self.sheet_header
+                    )
+                    print("Google initialized. Queueing sheet URL for Asana task desc")
+
+                    # Update the active Asana task with the new Google Sheet URL
+                    self.outbox.enqueue('description', outbox.PRIORITY_HOUSEKEEPING,
+                        {'task_gid': active_task_gid, 'desc': self.gsheets_handler.get_active_sheet_url()},
+                        key='description')
+                    self.outbox.enqueue('header', outbox.PRIORITY_HOUSEKEEPING, key='header')
 
                 # Turn off LED to indicate connection and init success
                 if not IS_LINUX:
                     self.pin.off()
+                self.radio.release()
                 break
 
-            except:
+            except BaseException as e:
+                self.radio.release()
+                self.log_exception(e)
                 n_init_retries += 1
                 print(f"Init retry #{n_init_retries}")
                 print("Sleeping for 1 sample period before next retry")
                 util.prepare_and_sleep(duration=self.sample_period_sec)
 
-        # Sensor value logging buffer
-        self.buf = []
-
-        # Init mem tracking
-        gc.collect()
-        self.mem_free_after_gc_prev = gc.mem_free()
+        # Pick up where we left off, or checkpoint the setup so a reset can
+        if resume is not None:
+            self.n = resume.get('n_samples', 0)
+            app_state = resume.get('app_state', {})
+            self.warning_state_is_active_temp = app_state.get('warning_temp', False)
+            self.warning_state_is_active_lux = app_state.get('warning_lux', False)
+        elif active_subtask_gid:
+            # Let whoever assigned the subtask know we've picked it up
+            self.outbox.enqueue('comment', outbox.PRIORITY_HOUSEKEEPING, {'task_gid': active_subtask_gid, 'text': 'On it!'})
+            checkpoint.save({
+                'app': 'fermentation_tracker',
+                'mode': mode,
+                'task_gid': active_task_gid,
+                'subtask_gid': active_subtask_gid,
+                'task_name': active_parent_task_name,
+                'sheet_id': self.gsheets_handler.sheet_id,
+                'n_samples': self.n,
+                'app_state': self.checkpoint_app_state(),
+            })
 
     def run_blocking(self):
         """
@@ -135,25 +238,19 @@ class Fermentation_tracker:
             # Do work
             try:
                 self.step()
-            # except BaseException as e:
-            #     # Capture exception message and traceback so we can report it later, but don't re-raise.
-            #     with io.StringIO() as buf:
-            #         sys.print_exception(e, buf)
-            #         self.step_exception_msg = buf.getvalue()
-                
-            #     # Print the exception
-            #     print(f"\nWARNING: Ignoring exception in step. Details:")
-            #     print(self.step_exception_msg)
-
-            #     # Log the exception
-            #     with open(self.ERROR_LOG_FILE_NAME, 'w') as f:
-            #         f.write(self.step_exception_msg)
-            # except:
             except BaseException as e:
             #     # TODO: blink pattern
             #     self.pin.on()
                 print("Hit exception in step. Continuing.")
-                sys.print_exception(e)
+                self.log_exception(e)
+
+                # The step didn't get to its network work. Still send what's queued,
+                # so a step that keeps failing still gets its exceptions reported.
+                try:
+                    self.queue_housekeeping()
+                    self.send_outbox()
+                except BaseException as e:
+                    self.log_exception(e)
 
             # Sleep till next step
             if not IS_LINUX:
@@ -163,129 +260,228 @@ class Fermentation_tracker:
         # Upload final log
         # TODO Figure out condition for when fermentation tracking ends
 
-    def step(self):
+    def run_async(self, duration_sec=None):
         """
-        Toggle the LED and grab and log a sample from each sensor.
-        Warn if necessary.
+        Run with sampling, warnings and uploads as separate asyncio tasks,
+        so slow network calls never delay a sample. Stays awake between samples.
+        Runs forever unless duration_sec is given.
         """
-        mem_free_before_gc = gc.mem_free()
-        mem_info = f'free: {mem_free_before_gc}\nused: {gc.mem_alloc()}'
-        print(mem_info)
-        with open('mem_info_before_gc.txt', 'w') as f:
-            f.write(mem_info)
-
-        gc.collect()
-        mem_free_after_gc = gc.mem_free()
-        mem_info = f'free: {mem_free_after_gc}\nused: {gc.mem_alloc()}'
-        print(mem_info)
-        with open('mem_info_after_gc.txt', 'w') as f:
-            f.write(mem_info)
-
-        if not IS_LINUX:
+        print("Starting fermentation tracker (async)")
+        runtime = async_runtime.Tracker_runtime(self, self.sample_period_sec)
+        return runtime.run(duration_sec)
 
-            wifi.disconnect()
-            for i in range(8):
-                time.sleep(2)
-                self.pin.toggle()
-            if not wifi.connect_with_retry():
-                print("Couldn't connect_with_retry to wifi. Skipping this step")
-                return
+    def sample(self, mem_free_before_gc=None, mem_free_after_gc=None):
+        """
+        Read each sensor and log a sample.
+        Returns a (temp, lux, raw) snapshot for report_warning, raw being the
+        recent raw samples if rolling up and a threshold is exceeded.
+        """
+        if mem_free_before_gc is None:
+            mem_free_before_gc = util.mem_free()
+            with self.profiler.span('gc'):
+                gc.collect()
+            mem_free_after_gc = util.mem_free()
 
         # Read sensors
-        self.temp = self.temp_sensor.read()
-        self.lux = self.ambient_light_sensor.read_lux()
+        with self.profiler.span('sensor'):
+            temp, lux = self.sensor_burst.read()
+        return self.log_reading(temp, lux, mem_free_before_gc, mem_free_after_gc)
 
-        # Log this sample
-        timestamp = time.time() + self.UTC_OFFSET
-        self.buf.append([timestamp, self.temp, self.lux, mem_free_before_gc, mem_free_after_gc])
+    async def sample_async(self):
+        """
+        Like sample(), but yields to the event loop while the burst waits between reads.
+        Used by the async runtime.
+        """
+        mem_free_before_gc = util.mem_free()
+        with self.profiler.span('gc'):
+            gc.collect()
+        mem_free_after_gc = util.mem_free()
 
-        # Warn if necessary
-        isconnected = True
-        if not IS_LINUX:
-            isconnected = wifi.WLAN.isconnected()
-        if isconnected:
-            util.blink(n_periods=5, n_blinks_per_period=2, period=0.5, blink_interval=0.2)
-            self.report_warning()
-        else:
-            util.blink(n_periods=5, n_blinks_per_period=3, period=0.5, blink_interval=0.2)
+        with self.profiler.span('sensor'):
+            temp, lux = await self.sensor_burst.read_async()
+        return self.log_reading(temp, lux, mem_free_before_gc, mem_free_after_gc)
+
+    def log_reading(self, temp, lux, mem_free_before_gc, mem_free_after_gc):
+        """
+        Log the values just read, and update the sample period.
+        Returns the warning snapshot, as sample() does.
+        """
+        self.temp = temp
+        self.lux = lux
+
+        # Pick the next sample period. It's logged with every sample, so changes show up in the sheet.
+        timestamp = self.clock.now() + self.UTC_OFFSET
+        if self.adaptive_period is not None:
+            self.sample_period_sec = self.adaptive_period.update(timestamp, (temp, lux))
+            if self.adaptive_period.changed:
+                print(f'Sample period changed to {self.sample_period_sec} sec')
+
+        # Log this sample
+        self.record_sample([timestamp, temp, lux, mem_free_before_gc, mem_free_after_gc, self.sample_period_sec])
 
         self.n += 1
         print(f'Done {self.n} samples')
 
-        # Upload log if our buffer is full enough
-        # TODO Implement logic for making sure we don't run out of space for buffer!
-        if len(self.buf) >= self.upload_buf_quota:
-            if not IS_LINUX:
-                isconnected = wifi.WLAN.isconnected()
-            if isconnected:
-                util.blink(n_periods=5, n_blinks_per_period=4, period=0.5, blink_interval=0.2)
-                self.upload_and_clear_log()
-            else:
-                util.blink(n_periods=5, n_blinks_per_period=5, period=0.5, blink_interval=0.2)
+        # Only on crossing a threshold, not every sample it stays exceeded. report_warning()
+        # updates the warning state after this, so a crossing still reads as inactive here.
+        raw = None
+        if ((temp > self.warning_thresh_temp and not self.warning_state_is_active_temp)
+                or (lux > self.warning_thresh_lux and not self.warning_state_is_active_lux)):
+            # Get the data behind a warning uploaded right away, closing the rollup window early
+            self.flush_policy.mark_urgent()
+            if self.rollup is not None:
+                # Capture raw context now, since the warning may be sent from another thread
+                raw = self.rollup.recent_raw()
+                closed = self.rollup.flush()
+                if closed is not None:
+                    self.log_sample(closed)
+
+        return (temp, lux, raw)
+
+    def step(self):
+        """
+        Toggle the LED and grab and log a sample from each sensor.
+        Warn if necessary.
+        """
+        t_step_start = util.ticks_ms()
+        session.reset_stats()
+
+        mem_free_before_gc = util.mem_free()
+        with self.profiler.span('gc'):
+            gc.collect()
+        mem_free_after_gc = util.mem_free()
+        print(f'free: {mem_free_before_gc} before gc, {mem_free_after_gc} after')
+        self.diag.memory(mem_free_after_gc)
+
+        # Read sensors and log this sample. This doesn't need the radio.
+        self.sample(mem_free_before_gc, mem_free_after_gc)
+
+        # Queue a warning for each newly exceeded threshold.
+        # Checkpoint warning state as it changes. Queued warnings are on flash too,
+        # so a reset neither re-sends nor loses them.
+        warning_state = self.checkpoint_app_state()
+        self.report_warning()
+        if self.checkpoint_app_state() != warning_state:
+            self.save_checkpoint()
+
+        # Queue an upload if the flush policy says it's worth it. The rows are already
+        # on flash, so the upload itself needn't be. Samples beyond max_ram_rows wait
+        # on flash, so the buffer can't run out of RAM.
+        if self.should_upload():
+            self.outbox.enqueue('upload', outbox.PRIORITY_DATA, key='upload', durable=False)
+
+        self.queue_housekeeping()
+        self.send_outbox()
+
+        # Report how much network time keep-alive saved us this step, radio-on time and sensor bus time
+        session.report_stats()
+        i2c_bus.report_stats(reset=True)
+        self.radio.report()
+        print(f'Step took {util.ticks_diff(util.ticks_ms(), t_step_start)} ms')
+
+    def checkpoint_app_state(self):
+        """
+        Returns the state a resume needs beyond the common checkpoint fields
+        """
+        return {
+            'warning_temp': self.warning_state_is_active_temp,
+            'warning_lux': self.warning_state_is_active_lux,
+        }
+
+    def save_checkpoint(self):
+        """
+        Update the sample count and warning state in the resume checkpoint.
+        Only called when the warning state changes, to spare the flash, so the
+        checkpointed sample count lags. Unsent samples are tracked by the WAL.
+        """
+        checkpoint.update(n_samples=self.n, app_state=self.checkpoint_app_state())
+
+    def network_due(self, now):
+        """
+        Also bring the radio up when a clock sync is due
+        """
+        return tracker_outbox.Tracker_outbox.network_due(self, now) or self.radio.sync_due()
 
+    def connect_failed(self):
+        print("Couldn't connect to wifi. Skipping network work this step")
+        self.diag.event("wifi connect failed")
+        util.blink(n_periods=5, n_blinks_per_period=3, period=0.5, blink_interval=0.2)
 
-    def report_warning(self):
+    def report_warning(self, snapshot=None):
         """
-        Warn if the most recently read values exceed their warning thresholds.
+        Queue a warning if the most recently read values (or the (temp, lux, raw)
+        snapshot if given) exceed their warning thresholds.
         Will only warn once for each violation.
+        If rolling up, the warning includes the recent raw samples.
         TODO: Add hysteresis
         """
+        if snapshot is None:
+            temp, lux = self.temp, self.lux
+            raw = self.rollup.recent_raw() if self.rollup is not None else None
+        else:
+            temp, lux, raw = snapshot
+
         # Temperature warning
-        if (self.temp > self.warning_thresh_temp):
+        if (temp > self.warning_thresh_temp):
             if not self.warning_state_is_active_temp:
-                warn_str = f"WARNING: Temp {self.temp} > thresh {self.warning_thresh_temp}"
+                warn_str = f"WARNING: Temp {temp} > thresh {self.warning_thresh_temp}"
                 print(warn_str)
+                warn_str += self.format_raw(raw)
 
-                try:
-                    # Send warning to Asana
-                    print("Trying to send above warning string to Asana")
-                    self.asana_handler.add_comment_on_active_subtask(warn_str)
-                    self.warning_state_is_active_temp = True
-                    util.blink(n_periods=4, n_blinks_per_period=4, period=0.2, blink_interval=0.1)
-
-                except:
-                    # TODO: Set a flag to warn on the next wake
-                    print("Failed to send warning, warning_state_is_active_temp not set.")
-                    util.blink(n_periods=4, n_blinks_per_period=3, period=0.2, blink_interval=0.1)
+                # Sent ahead of anything else in the outbox, and retried until it goes
+                self.queue_warning('warning_temp', warn_str)
+                self.warning_state_is_active_temp = True
         else:
             # Reset warning state
             self.warning_state_is_active_temp = False
 
         # Ambient light warning
-        if (self.lux > self.warning_thresh_lux):
+        if (lux > self.warning_thresh_lux):
             if not self.warning_state_is_active_lux:
-                warn_str = f"WARNING: Lux {self.lux} > thresh {self.warning_thresh_lux}"
+                warn_str = f"WARNING: Lux {lux} > thresh {self.warning_thresh_lux}"
                 print(warn_str)
+                warn_str += self.format_raw(raw)
 
-                try:
-                    # Send warning to Asana
-                    self.asana_handler.add_comment_on_active_subtask(warn_str)
-                    self.warning_state_is_active_lux = True
-                    util.blink(n_periods=4, n_blinks_per_period=4, period=0.2, blink_interval=0.1)
-                except:
-                    # TODO: Set a flag to warn on the next wake
-                    print("Failed to send warning, warning_state_is_active_lux not set.")
-                    util.blink(n_periods=4, n_blinks_per_period=3, period=0.2, blink_interval=0.1)
+                self.queue_warning('warning_lux', warn_str)
+                self.warning_state_is_active_lux = True
         else:
             # Reset warning state
             self.warning_state_is_active_lux = False
 
-    def upload_and_clear_log(self):
+    def queue_warning(self, key, text):
         """
-        Upload buffer log to gsheets, then clear local buffer
+        Queue a warning comment on the active subtask
         """
-        print("Uploading")
-        try:
-            upload_success = self.gsheets_handler.upload_list(self.buf)
+        self.outbox.enqueue('warning', outbox.PRIORITY_WARNING,
+            {'task_gid': self.asana_handler.active_subtask_gid, 'text': text}, key=key)
 
-            if upload_success != False:
-                self.buf = []
-                print("Done uploading")
-                util.blink(n_periods=4, n_blinks_per_period=6, period=0.2, blink_interval=0.1)
-            else:
-                print("Upload returned false. Will keep buffer intact and try again next sample.")
-                util.blink(n_periods=4, n_blinks_per_period=5, period=0.2, blink_interval=0.1)
-
-        except BaseException as e:
-                print("Hit exception in step. Continuing.")
-                sys.print_exception(e)
\ No newline at end of file
+    def send_warning(self, args):
+        print("Trying to send warning to Asana")
+        try:
+            with self.profiler.span('warning'):
+                self.asana_handler.add_comment_on_task(args['task_gid'], args['text'])
+        except:
+            self.diag.event("warning failed")
+            util.blink(n_periods=4, n_blinks_per_period=3, period=0.2, blink_interval=0.1)
+            raise
+        util.blink(n_periods=4, n_blinks_per_period=4, period=0.2, blink_interval=0.1)
+        return True
+
+    def format_raw(self, raw):
+        """
+        Format raw samples for appending to a warning comment
+        """
+        if not raw:
+            return ''
+        lines = ['', 'Recent raw samples (time, temp, lux):']
+        for row in raw:
+            lines.append(f'{row[0]}, {row[1]}, {row[2]}')
+        return '\n'.join(lines)
+
+    def upload_succeeded(self, batch):
+        tracker_samples.Tracker_samples.upload_succeeded(self, batch)
+        util.blink(n_periods=4, n_blinks_per_period=6, period=0.2, blink_interval=0.1)
+
+    def upload_failed(self, batch):
+        tracker_samples.Tracker_samples.upload_failed(self, batch)
+        util.blink(n_periods=4, n_blinks_per_period=5, period=0.2, blink_interval=0.1)
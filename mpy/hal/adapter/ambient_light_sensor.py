@@ -10,6 +10,9 @@ class Ambient_light_sensor:
     """
     _sensor_driver = None
 
+    # Minimum time between fresh readings, i.e. the integration time. Populated from the driver on init.
+    period_ms = 0
+
     def __init__(self):
         """
         Initialize with driver chosen in config.py
@@ -22,21 +25,35 @@ class Ambient_light_sensor:
             self._sensor_driver = mock_ambient_light_sensor.Ambient_light_sensor_driver()
         else:
             raise Exception("No valid ambient light sensor selected")
+        self.period_ms = self._sensor_driver.period_ms
 
     def read_light(self):
         """
         Read light. Driver is responsible for conversion.
         """
-        if hasattr(self._sensor_driver, 'read_light'):
-            return self._sensor_driver.read_light()
-        else:
-            raise NotImplementedError(f"This method must be implemented by driver for {mpy.hal.config.AMBIENT_LIGHT_SENSOR}")
+        return self._sensor_driver.read_light()
 
     def read_lux(self):
         """
         Read lux. Driver is responsible for conversion.
         """
-        if hasattr(self._sensor_driver, 'read_lux'):
-            return self._sensor_driver.read_lux()
-        else:
-            raise NotImplementedError(f"This method must be implemented by driver for {mpy.hal.config.AMBIENT_LIGHT_SENSOR}")
\ No newline at end of file
+        return self._sensor_driver.read_lux()
+
+    def prepare(self):
+        """
+        Get ready for a burst of reads, e.g. by ranging gain. May change period_ms.
+        """
+        self._sensor_driver.prepare()
+        self.period_ms = self._sensor_driver.period_ms
+
+    def read_raw_into(self, buf, i):
+        """
+        Read one raw light sample into buf[i], without allocating. Convert with convert().
+        """
+        self._sensor_driver.read_raw_into(buf, i)
+
+    def convert(self, raw):
+        """
+        Convert a raw light sample, or a filtered batch of them, to lux
+        """
+        return self._sensor_driver.convert(raw)
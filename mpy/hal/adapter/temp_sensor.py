@@ -11,6 +11,9 @@ class Temp_sensor:
     # Driver object, populated on init
     _sensor_driver = None
 
+    # Minimum time between fresh readings. Populated from the driver on init.
+    period_ms = 0
+
     def __init__(self):
         """
         Initialize with driver chosen in config.py
@@ -23,12 +26,28 @@ class Temp_sensor:
             self._sensor_driver = mock_temperature_sensor.Temperature_sensor_driver()
         else:
             raise Exception("No valid temperature sensor selected")
+        self.period_ms = self._sensor_driver.period_ms
 
     def read(self):
         """
         Read temperature in degrees Celsius. Driver is responsible for conversion.
         """
-        if hasattr(self._sensor_driver, 'read'):
-            return self._sensor_driver.read()
-        else:
-            raise NotImplementedError(f"This method must be implemented by driver for {mpy.hal.config.TEMP_SENSOR}")
+        return self._sensor_driver.read()
+
+    def prepare(self):
+        """
+        Get ready for a burst of reads. Nothing to do for temperature sensors so far.
+        """
+        pass
+
+    def read_raw_into(self, buf, i):
+        """
+        Read one raw sample into buf[i], without allocating. Convert with convert().
+        """
+        self._sensor_driver.read_raw_into(buf, i)
+
+    def convert(self, raw):
+        """
+        Convert a raw sample, or a filtered batch of them, to degrees Celsius
+        """
+        return self._sensor_driver.convert(raw)
@@ -25,7 +25,7 @@ if IS_LINUX:
 else:
     # Determine global unique hydra name based on mac address
     import mpy.networking.wifi as wifi
-    mac = wifi.MAC
+    mac = wifi.get_mac()
     NAME = HYDRA_NAME_MAP[mac]
 
     # Declare hardware configuration per physical hydra instance
@@ -43,6 +43,7 @@ else:
         AMBIENT_LIGHT_SENSOR_I2C_SDA_PIN = 16
         AMBIENT_LIGHT_SENSOR_I2C_SCL_PIN = 17
         AMBIENT_LIGHT_SENSOR_I2C_FREQ = 400_000
+        AMBIENT_LIGHT_SENSOR_AUTO_RANGE = True
 
     elif  NAME == 'Dino Hydra':
         # Temperature sensor hardware config
@@ -69,4 +70,5 @@ else:
         AMBIENT_LIGHT_SENSOR_I2C_ID = 0
         AMBIENT_LIGHT_SENSOR_I2C_SDA_PIN = 16
         AMBIENT_LIGHT_SENSOR_I2C_SCL_PIN = 17
-        AMBIENT_LIGHT_SENSOR_I2C_FREQ = 400_000
\ No newline at end of file
+        AMBIENT_LIGHT_SENSOR_I2C_FREQ = 400_000
+        AMBIENT_LIGHT_SENSOR_AUTO_RANGE = True
\ No newline at end of file
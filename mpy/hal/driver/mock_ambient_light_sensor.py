@@ -12,6 +12,8 @@ import mpy.hal.adapter.ambient_light_sensor
 import mpy.hal.config as cfg
 
 class Ambient_light_sensor_driver(mpy.hal.adapter.ambient_light_sensor.Ambient_light_sensor):
+    period_ms = 0
+
     def __init__(self):
         pass
 
@@ -27,3 +29,15 @@ class Ambient_light_sensor_driver(mpy.hal.adapter.ambient_light_sensor.Ambient_l
         Mock converted lux value
         """
         return 1.0 + random.randrange(16)
+
+    def prepare(self):
+        pass
+
+    def read_raw_into(self, buf, i):
+        """
+        Mock raw light value, in lux
+        """
+        buf[i] = 1 + random.randrange(16)
+
+    def convert(self, raw):
+        return float(raw)
@@ -12,6 +12,11 @@ import mpy.hal.adapter.temp_sensor
 import mpy.hal.config as cfg
 
 class Temperature_sensor_driver(mpy.hal.adapter.temp_sensor.Temp_sensor):
+    # Counts of 1/16 degree, like the tmp102
+    RESOLUTION = 0.0625
+
+    period_ms = 0
+
     def __init__(self):
         pass
 
@@ -21,3 +26,12 @@ class Temperature_sensor_driver(mpy.hal.adapter.temp_sensor.Temp_sensor):
         """
         return 10.0 + random.randrange(17)
 
+    def read_raw_into(self, buf, i):
+        """
+        Mock raw temperature count
+        """
+        buf[i] = (10 + random.randrange(17)) * 16
+
+    def convert(self, raw):
+        return raw * self.RESOLUTION
+
@@ -8,13 +8,13 @@ Micropython driver for Vishay VEML7700 I2C ambient light sensor.
 Some snippets adapted from https://github.com/adafruit/Adafruit_CircuitPython_VEML7700/
 """
 
+import array
 import struct
 import time
 
 import mpy.hal.adapter.ambient_light_sensor
 import mpy.hal.config as cfg
-
-from machine import Pin, I2C
+import mpy.hal.i2c_bus as i2c_bus
 
 class Ambient_light_sensor_driver(mpy.hal.adapter.ambient_light_sensor.Ambient_light_sensor):
     """
@@ -80,60 +80,179 @@ class Ambient_light_sensor_driver(mpy.hal.adapter.ambient_light_sensor.Ambient_l
     ALS_GAIN = ALS_GAIN_2
     ALS_IT = ALS_IT_50MS
 
-    # I2C bus object
+    # Auto-ranging keeps counts within this window, well clear of saturation and
+    # fine enough to resolve. It spans more than the factor of 2 between settings,
+    # so a light level near the edge of one setting's window doesn't flap between two.
+    LOW_COUNT = 5000
+    HIGH_COUNT = 20000
+
+    # A full-scale count, meaning the reading saturated
+    SATURATED_COUNT = 0xFFFF
+
+    # Extra wait after changing settings, on top of one integration time
+    SETTLE_MARGIN_MS = 10
+
+    # Shared I2C bus
     _i2c = None
     
-    def __init__(self, als_gain=ALS_GAIN_2, als_it=ALS_IT_50MS):
+    def __init__(self, als_gain=ALS_GAIN_2, als_it=ALS_IT_50MS, auto_range=None, max_it_ms=None):
         """
-        Initialize driver based on setting in config.py
+        Initialize driver based on setting in config.py.
+        With auto_range, gain and integration time are picked before each burst of reads,
+        starting from als_gain and als_it. Defaults to AMBIENT_LIGHT_SENSOR_AUTO_RANGE in config.py.
+        max_it_ms caps the integration times auto-ranging may pick, since bursts take several.
         """
         # Store user-specified parameters or defaults
         self.ALS_GAIN = als_gain
         self.ALS_IT = als_it
+        if auto_range is None:
+            auto_range = cfg.AMBIENT_LIGHT_SENSOR_AUTO_RANGE
+        self.auto_range = auto_range
 
-        print("Instantiating i2c object")
+        print("Getting i2c bus")
 
-        # Init i2c object, as configured in config.py
-        self._i2c = I2C(
+        # Get the bus configured in config.py, shared with any other sensors on it
+        self._i2c = i2c_bus.get(
             cfg.AMBIENT_LIGHT_SENSOR_I2C_ID,
-            scl=Pin(cfg.AMBIENT_LIGHT_SENSOR_I2C_SCL_PIN),
-            sda=Pin(cfg.AMBIENT_LIGHT_SENSOR_I2C_SDA_PIN),
-            freq=cfg.AMBIENT_LIGHT_SENSOR_I2C_FREQ)
+            cfg.AMBIENT_LIGHT_SENSOR_I2C_SCL_PIN,
+            cfg.AMBIENT_LIGHT_SENSOR_I2C_SDA_PIN,
+            cfg.AMBIENT_LIGHT_SENSOR_I2C_FREQ)
+
+        print("Done getting i2c bus")
+
+        # Auto-ranging settings as (gain, it, resolution), finest resolution first.
+        # Settings with the same resolution are interchangeable, so only the one
+        # with the shortest integration time is kept.
+        settings = {}
+        for gain in self.gain_values:
+            for it in self.it_values:
+                if max_it_ms is not None and self.it_values[it] > max_it_ms:
+                    continue
+                res = self._get_resolution(gain, it)
+                if res not in settings or self.it_values[it] < self.it_values[settings[res][1]]:
+                    settings[res] = (gain, it, res)
+        self._settings = [settings[res] for res in sorted(settings)]
+
+        # Preallocated, so reads don't allocate
+        self._raw = bytearray(2)
+        self._one = array.array('l', [0])
+
+        print("Trying to write cfg to veml7700")
+        self._write_config(self.ALS_GAIN, self.ALS_IT)
+        print("Write success")
 
-        print("Done instantiating i2c object")
+        # Index of the current setting, once auto-ranging has moved off the initial one
+        self._setting = None
+        for j in range(len(self._settings)):
+            if self._settings[j][2] == self._resolution:
+                self._setting = j
+        self.n_range_reads = 0
 
+    def _write_config(self, gain, it):
+        """
+        Write gain and integration time to CONF_0, and precompute what depends on them
+        """
         # Build the value we will write to register CONF_0.
         # The most important thing here is writing 0 to SD, to "disable shutdown" and enable the ALS
         config_cmd_val = (
             self._apply_mask(0,             self.REG_WIDTH_CONF_0_ALS_SD,   self.REG_OFFSET_CONF_0_ALS_SD)    |
             self._apply_mask(0,             self.REG_WIDTH_CONF_0_ALS_INT_N,self.REG_OFFSET_CONF_0_ALS_INT_N) |
             self._apply_mask(0,             self.REG_WIDTH_CONF_0_ALS_PERS, self.REG_OFFSET_CONF_0_ALS_PERS)  |
-            self._apply_mask(self.ALS_IT,   self.REG_WIDTH_CONF_0_ALS_IT,   self.REG_OFFSET_CONF_0_ALS_IT)    |
-            self._apply_mask(self.ALS_GAIN, self.REG_WIDTH_CONF_0_ALS_GAIN, self.REG_OFFSET_CONF_0_ALS_GAIN)
+            self._apply_mask(it,            self.REG_WIDTH_CONF_0_ALS_IT,   self.REG_OFFSET_CONF_0_ALS_IT)    |
+            self._apply_mask(gain,          self.REG_WIDTH_CONF_0_ALS_GAIN, self.REG_OFFSET_CONF_0_ALS_GAIN)
         )
 
-        print("Trying to write cfg to veml7700")
-
         # Write it.
         self._i2c.writeto_mem(self.DEV_ADDR, self.REG_ADDR_CONF_0, config_cmd_val.to_bytes(2, 'big'))
-        print("Write success")
+        self.ALS_GAIN = gain
+        self.ALS_IT = it
+
+        # The ALS register refreshes once per integration time
+        self.period_ms = self.it_values[it]
+        self._resolution = self._get_resolution(gain, it)
+
+    def prepare(self):
+        """
+        Range gain and integration time before a burst of reads, if auto-ranging
+        """
+        if self.auto_range:
+            self.range()
+
+    def range(self):
+        """
+        Move to the finest setting that doesn't saturate at the current light level.
+        Each read's lux estimate picks the next setting directly, rather than stepping
+        through them one at a time. Starting from the last good setting, steady light
+        takes a single read, and even a saturated one takes no more than three.
+        """
+        if self._setting is None:
+            # The initial setting isn't in the table. Start from the coarsest, which can't saturate.
+            self._apply_setting(len(self._settings) - 1)
+        for _ in range(len(self._settings)):
+            count = self.read_light()
+            self.n_range_reads += 1
+            j = self._best_setting(count)
+            if j == self._setting:
+                return
+            self._apply_setting(j)
+
+    def _best_setting(self, count):
+        """
+        Index of the setting to use, given a count read at the current one
+        """
+        last = len(self._settings) - 1
+        if count <= self.HIGH_COUNT and (count >= self.LOW_COUNT or self._setting == 0):
+            return self._setting
+        if count >= self.HIGH_COUNT and self._setting == last:
+            return self._setting
+        if count >= self.SATURATED_COUNT:
+            # The lux estimate is only a lower bound. Go to the coarsest setting for a real one.
+            return last
+        if count == 0:
+            return 0
+
+        # The finest setting whose count at this light level stays within HIGH_COUNT
+        lux = count * self._resolution
+        for j in range(len(self._settings)):
+            if lux <= self.HIGH_COUNT * self._settings[j][2]:
+                return j
+        return last
+
+    def _apply_setting(self, j):
+        gain, it, _ = self._settings[j]
+        self._write_config(gain, it)
+        self._setting = j
+
+        # The ALS register only holds a reading at the new setting after a full integration time
+        time.sleep((self.period_ms + self.SETTLE_MARGIN_MS) / 1000)
 
     def read_light(self):
         """
         Read raw light value from ALS
         """
-        # Get raw light reading from sensor
-        light_raw = self._i2c.readfrom_mem(self.DEV_ADDR, self.REG_ADDR_ALS, 2)
-
-        # Parse bytes as little endian, 2-byte int
-        light_int = struct.unpack('<H', light_raw)[0]
-        return light_int
+        self.read_raw_into(self._one, 0)
+        return self._one[0]
 
     def read_lux(self):
         """
         Read light value from ALS and convert to lux
         """
-        return self._get_resolution() * self.read_light()
+        return self.convert(self.read_light())
+
+    def read_raw_into(self, buf, i):
+        """
+        Read raw light value from ALS into buf[i]
+        """
+        self._i2c.readfrom_mem_into(self.DEV_ADDR, self.REG_ADDR_ALS, self._raw)
+
+        # Parse bytes as little endian, 2-byte int
+        buf[i] = struct.unpack_from('<H', self._raw, 0)[0]
+
+    def convert(self, raw):
+        """
+        Convert a raw light value to lux
+        """
+        return self._resolution * raw
 
     def _apply_mask(self, val, width, offset):
         """
@@ -142,23 +261,23 @@ class Ambient_light_sensor_driver(mpy.hal.adapter.ambient_light_sensor.Ambient_l
         mask = ((1 << width) - 1)
         return (mask & val) << offset
 
-    def _get_resolution(self):
+    def _get_resolution(self, gain, it):
         """
         Adapted from Adafruit driver.
-        Calculates the resolution needed to convert light to lux
+        Calculates the resolution needed to convert light to lux at a gain and integration time
         """
         RES_MAX = 0.0036
         GAIN_MAX = 2
         IT_MAX = 800
 
         if (
-            self.gain_values[self.ALS_GAIN] == GAIN_MAX
-            and self.it_values[self.ALS_IT] == IT_MAX
+            self.gain_values[gain] == GAIN_MAX
+            and self.it_values[it] == IT_MAX
         ):
             return RES_MAX
         else:
             return (
                 RES_MAX
-                * (IT_MAX / self.it_values[self.ALS_IT])
-                * (GAIN_MAX / self.gain_values[self.ALS_GAIN])
+                * (IT_MAX / self.it_values[it])
+                * (GAIN_MAX / self.gain_values[gain])
             )
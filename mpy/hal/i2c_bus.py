@@ -0,0 +1,150 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Registry of shared I2C buses.
+
+Sensors on the same bus share one machine.I2C, rather than each driver
+constructing its own and reinitializing the peripheral under the other.
+Drivers ask for their bus with get(), keyed by (id, scl, sda, freq).
+
+Each transaction holds the bus lock, so a sampler and a worker thread
+never interleave on the wire. Transactions and bytes are counted per bus,
+for profiling how much of a sample is spent on I2C.
+"""
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+import mpy.util.util as util
+
+# Shared buses, keyed by (id, scl, sda, freq)
+_buses = {}
+
+
+class _No_lock:
+    """
+    Stand-in for a lock where there are no threads to guard against
+    """
+    def acquire(self, waitflag=1):
+        return True
+
+    def release(self):
+        pass
+
+
+class I2c_bus:
+    """
+    machine.I2C wrapper that serializes and counts transactions
+    """
+    def __init__(self, id, scl, sda, freq):
+        # Only needed once there's real hardware, so apps with mock sensors can report stats on any port
+        from machine import Pin, I2C
+
+        self.key = (id, scl, sda, freq)
+        self._i2c = I2C(id, scl=Pin(scl), sda=Pin(sda), freq=freq)
+        self._lock = _thread.allocate_lock() if _thread is not None else _No_lock()
+        self.stats = {
+            'transactions': 0,
+            'bytes_read': 0,
+            'bytes_written': 0,
+            'errors': 0,
+            'contended': 0,
+            'busy_us': 0,
+        }
+
+    def _acquire(self):
+        # Count how often a caller had to wait for another, before waiting
+        if not self._lock.acquire(0):
+            self.stats['contended'] += 1
+            self._lock.acquire()
+        return util.ticks_us()
+
+    def _release(self, t_start, n_read, n_written):
+        self.stats['transactions'] += 1
+        self.stats['bytes_read'] += n_read
+        self.stats['bytes_written'] += n_written
+        self.stats['busy_us'] += util.ticks_diff(util.ticks_us(), t_start)
+        self._lock.release()
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        t_start = self._acquire()
+        try:
+            self._i2c.readfrom_mem_into(addr, memaddr, buf)
+        except OSError:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self._release(t_start, len(buf), 0)
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        t_start = self._acquire()
+        try:
+            return self._i2c.readfrom_mem(addr, memaddr, nbytes)
+        except OSError:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self._release(t_start, nbytes, 0)
+
+    def writeto_mem(self, addr, memaddr, buf):
+        t_start = self._acquire()
+        try:
+            self._i2c.writeto_mem(addr, memaddr, buf)
+        except OSError:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self._release(t_start, 0, len(buf))
+
+    def scan(self):
+        t_start = self._acquire()
+        try:
+            return self._i2c.scan()
+        finally:
+            self._release(t_start, 0, 0)
+
+
+def get(id, scl, sda, freq):
+    """
+    Returns the shared bus for these settings, creating it on first use.
+    Raises ValueError if the peripheral is already in use with other pins or freq,
+    since reinitializing it would break the bus for its other users.
+    """
+    key = (id, scl, sda, freq)
+    bus = _buses.get(key)
+    if bus is not None:
+        return bus
+    for other in _buses:
+        if other[0] == id:
+            raise ValueError(f"I2C {id} is already in use as {other}, can't also use it as {key}")
+    bus = I2c_bus(id, scl, sda, freq)
+    _buses[key] = bus
+    return bus
+
+
+def reset_stats():
+    """
+    Zero the counters of every bus
+    """
+    for bus in _buses.values():
+        for k in bus.stats:
+            bus.stats[k] = 0
+
+
+def report_stats(reset=False):
+    """
+    Print a one-line summary of each bus's counters
+    """
+    for key, bus in _buses.items():
+        s = bus.stats
+        print(
+            f"i2c {key[0]} (scl {key[1]}, sda {key[2]}, {key[3] // 1000} kHz): {s['transactions']} transactions, "
+            f"{s['bytes_read']} B read / {s['bytes_written']} B written in {s['busy_us']} us, "
+            f"{s['errors']} errors, {s['contended']} contended"
+        )
+    if reset:
+        reset_stats()
@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Burst-oversampled sensor reads.
+
+Each sensor is read n times in quick succession into a preallocated buffer,
+and the raw values are filtered (median by default, or mean) before being
+converted once. A single noisy reading no longer becomes a sample.
+
+The sensors are read together at each step of the burst, and the burst
+steps at the slowest sensor's refresh period. So the tmp102's read happens
+within the veml7700's integration window instead of after it, and a burst
+takes n integration windows, not n of each sensor's.
+
+read() sleeps between steps. Under the async runtime, use read_async()
+instead, which yields to the event loop while waiting.
+"""
+
+import array
+import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+import mpy.util.util as util
+
+FILTER_MEDIAN = 'median'
+FILTER_MEAN = 'mean'
+
+# Reads per sensor per burst
+BURST_LEN = 5
+
+
+def median(buf, n):
+    """
+    Median of buf[:n]. Sorts it in place, so it doesn't allocate.
+    """
+    for i in range(1, n):
+        v = buf[i]
+        j = i - 1
+        while j >= 0 and buf[j] > v:
+            buf[j + 1] = buf[j]
+            j -= 1
+        buf[j + 1] = v
+    mid = n // 2
+    if n % 2:
+        return buf[mid]
+    return (buf[mid - 1] + buf[mid]) / 2
+
+
+def mean(buf, n):
+    """
+    Mean of buf[:n]
+    """
+    total = 0
+    for i in range(n):
+        total += buf[i]
+    return total / n
+
+
+class Sensor_burst:
+    """
+    Reads a set of sensor adapters in bursts, returning one filtered, converted value per sensor
+    """
+    def __init__(self, sensors, n=BURST_LEN, filter=FILTER_MEDIAN):
+        if filter == FILTER_MEDIAN:
+            self.filter = median
+        elif filter == FILTER_MEAN:
+            self.filter = mean
+        else:
+            raise ValueError(f"Unknown filter {filter}")
+        self.sensors = sensors
+        self.n = n
+
+        # One raw buffer per sensor, and a reused result list
+        self.bufs = [array.array('l', [0] * n) for _ in sensors]
+        self.values = [0.0] * len(sensors)
+
+        self._update_period()
+
+    def _update_period(self):
+        # Step no faster than the slowest sensor refreshes, so every read is fresh
+        self.period_ms = 0
+        for sensor in self.sensors:
+            self.period_ms = max(self.period_ms, sensor.period_ms)
+
+    def read(self):
+        """
+        Run a burst. Returns a list of values in the order of the sensors.
+        The list is reused by the next burst.
+        """
+        self._prepare()
+        for i in range(self.n):
+            wait_ms = self._step(i)
+            if wait_ms > 0:
+                time.sleep(wait_ms / 1000)
+        return self._finish()
+
+    async def read_async(self):
+        """
+        Run a burst like read(), but yield to the event loop between steps rather than sleeping.
+        Sensors may still block briefly to range, when the light changes enough to need a new setting.
+        """
+        self._prepare()
+        for i in range(self.n):
+            wait_ms = self._step(i)
+            if wait_ms > 0:
+                await asyncio.sleep(wait_ms / 1000)
+        return self._finish()
+
+    def _prepare(self):
+        # Let sensors range first, which may change how fast they refresh
+        for sensor in self.sensors:
+            sensor.prepare()
+        self._update_period()
+
+    def _step(self, i):
+        """
+        Read every sensor into slot i. Returns how long to wait before the next step, in ms.
+        """
+        t_start = util.ticks_ms()
+        for k in range(len(self.sensors)):
+            self.sensors[k].read_raw_into(self.bufs[k], i)
+
+        # Wait out the rest of this step's window before the next reads
+        if not self.period_ms or i == self.n - 1:
+            return 0
+        return self.period_ms - util.ticks_diff(util.ticks_ms(), t_start)
+
+    def _finish(self):
+        for k in range(len(self.sensors)):
+            self.values[k] = self.sensors[k].convert(self.filter(self.bufs[k], self.n))
+        return self.values
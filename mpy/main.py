@@ -4,26 +4,57 @@
 
 import sys
 import os
+import gc
 import micropython
 
-import mpy.app.fermentation_tracker as fermentation_tracker
-import mpy.app.coldcrash_tracker as coldcrash_tracker
-
-import mpy.util.simple_asana_handler as asana_handler
 import mpy.util.util as util
 
-
-import mpy.test.asana_tester as asana_tester
-import mpy.test.google_sheets_tester as google_sheets_tester
-import mpy.test.sensor_tester as sensor_tester
+# Boot timing starts as early as we can measure it
+BOOT_TICKS_MS = util.ticks_ms()
 
 IS_LINUX = (sys.platform == 'linux')
 
-if not IS_LINUX:
-    import mpy.networking.wifi as wifi
+# Import path of each app. Only the selected app is imported, along with its
+# dependencies, so the rest never cost boot time or heap.
+APP_REGISTRY = {
+    'fermentation_tracker': 'mpy.app.fermentation_tracker',
+    'coldcrash_tracker': 'mpy.app.coldcrash_tracker',
+    'asana_tester': 'mpy.test.asana_tester',
+    'google_sheets_tester': 'mpy.test.google_sheets_tester',
+    'sensor_tester': 'mpy.test.sensor_tester',
+    'stream_json_tester': 'mpy.test.stream_json_tester',
+    'async_runtime_tester': 'mpy.test.async_runtime_tester',
+    'radio_tester': 'mpy.test.radio_tester',
+    'time_service_tester': 'mpy.test.time_service_tester',
+    'boot_tester': 'mpy.test.boot_tester',
+    'exception_digest_tester': 'mpy.test.exception_digest_tester',
+    'outbox_tester': 'mpy.test.outbox_tester',
+    'diag_log_tester': 'mpy.test.diag_log_tester',
+    'fermentation_tracker_tester': 'mpy.test.fermentation_tracker_tester',
+}
+
+def load_app(app):
+    """
+    Import the named app's module on demand and return it
+    """
+    path = APP_REGISTRY.get(app)
+    if path is None:
+        raise Exception("No app selected!")
+    __import__(path)
+    return sys.modules[path]
+
+def report_boot(app):
+    """
+    Print how long it took and how much heap is in use by the time the app is about to start
+    """
+    import mpy.util.diag_log as diag_log
 
-    from machine import Pin
-    pin = Pin("LED", Pin.OUT)
+    gc.collect()
+    boot_ms = util.ticks_diff(util.ticks_ms(), BOOT_TICKS_MS)
+    print(f"Boot: {app} loaded {boot_ms} ms after main import, "
+          f"heap used {util.mem_alloc()}, free {util.mem_free()}")
+    diag_log.get_shared().event(f"boot {app} in {boot_ms} ms")
+    diag_log.get_shared().memory()
 
 
 def main():
@@ -37,32 +68,66 @@ def main():
         # app = 'asana_tester'
         app = 'google_sheets_tester'
         # app = 'sensor_tester'
+        # app = 'stream_json_tester'
+        # app = 'async_runtime_tester'
+        # app = 'radio_tester'
+        # app = 'time_service_tester'
+        # app = 'boot_tester'
+        # app = 'exception_digest_tester'
+        # app = 'outbox_tester'
+        # app = 'diag_log_tester'
+        # app = 'fermentation_tracker_tester'
         mode = None
         subtask_gid = None
+        task_gid = None
         task_name = None
+        resume = None
     else:
+        # Only needed to decide on an app, so imported here rather than at boot
+        import mpy.util.simple_asana_handler as asana_handler
+
         backoff_duration_min = 1
         while True:
             try:
                 if not IS_LINUX:
+                    import mpy.networking.wifi as wifi
                     wifi.connect_with_retry()
+                asana = asana_handler.Simple_asana_handler()
+
+                # After a reset, resume the app we were running if it's still current
+                resume = try_resume(asana)
+                if resume is not None:
+                    app = resume['app']
+                    mode = resume['mode']
+                    subtask_gid = resume['subtask_gid']
+                    task_gid = resume['task_gid']
+                    task_name = resume['task_name']
+                    break
+
                 print("Trying to decide on app...")
-                app, mode, subtask_gid, task_gid, task_name = decide_on_app()
+                app, mode, subtask_gid, task_gid, task_name = decide_on_app(asana)
                 print("Breaking out from decision loop")
                 break
 
             except ValueError as e:
                 print("Error deciding on app. Details:")
                 print(e)
+                import mpy.util.diag_log as diag_log
+                import mpy.util.exception_digest as exception_digest
+                diag_log.get_shared().exception(e)
+                # Posted with the selected app's next digest
+                exception_digest.get_shared().capture(e)
                 print(f"Sleeping for {backoff_duration_min} minutes before retrying")
                 util.prepare_and_sleep(backoff_duration_min)
                 # Exponentially increase backoff duration
                 backoff_duration_min *= 2
 
     print("Starting", app)
+    module = load_app(app)
+    report_boot(app)
 
     if app == 'fermentation_tracker':
-        ft = fermentation_tracker.Fermentation_tracker(
+        ft = module.Fermentation_tracker(
             mode=mode,
             active_task_gid=task_gid,
             active_subtask_gid=subtask_gid,
@@ -70,37 +135,87 @@ def main():
             warning_thresh_lux=50.0,
             warning_thresh_temp=26.0,
             sample_period_sec=3000,
-            upload_buf_quota=1
+            min_sample_period_sec=300,
+            max_sample_period_sec=3000,
+            upload_buf_quota=1,
+            resume=resume
         )
         ft.run_blocking()
 
     elif app == 'coldcrash_tracker':
-        ct = coldcrash_tracker.Coldcrash_tracker(
+        ct = module.Coldcrash_tracker(
             active_task_gid=task_gid,
             active_subtask_gid=subtask_gid,
             active_parent_task_name=task_name,
             sample_period_sec=1,
-            target_temp=20
+            max_sample_period_sec=10,
+            target_temp=20,
+            rollup_window_sec=60,
+            resume=resume
         )
-        ct.run_blocking()
+        # At 1 Hz we stay awake anyway, so sample and upload concurrently.
+        # Roll samples up into one row per minute to spare the Sheets quota.
+        ct.run_async()
 
     elif app == 'asana_tester':
-        at = asana_tester.Asana_tester()
+        at = module.Asana_tester()
 
     elif app == 'google_sheets_tester':
-        gst = google_sheets_tester.Google_sheets_tester()
+        gst = module.Google_sheets_tester()
 
     elif app == 'sensor_tester':
-        at = sensor_tester.Sensor_tester()
+        at = module.Sensor_tester()
 
-    else:
-        raise Exception("No app selected!")
+    elif app == 'stream_json_tester':
+        sjt = module.Stream_json_tester()
 
-def decide_on_app():
-    asana = asana_handler.Simple_asana_handler()
+    elif app == 'async_runtime_tester':
+        art = module.Async_runtime_tester()
+
+    elif app == 'radio_tester':
+        rt = module.Radio_tester()
+
+    elif app == 'time_service_tester':
+        tst = module.Time_service_tester()
+
+    elif app == 'boot_tester':
+        bt = module.Boot_tester()
+
+    elif app == 'exception_digest_tester':
+        edt = module.Exception_digest_tester()
+
+    elif app == 'outbox_tester':
+        ot = module.Outbox_tester()
+
+    elif app == 'diag_log_tester':
+        dlt = module.Diag_log_tester()
+
+    elif app == 'fermentation_tracker_tester':
+        ftt = module.Fermentation_tracker_tester()
+
+def decide_on_app(asana=None):
+    if asana is None:
+        import mpy.util.simple_asana_handler as asana_handler
+        asana = asana_handler.Simple_asana_handler()
     r = asana.decide_on_app()
     return r
 
+def try_resume(asana):
+    """
+    Returns the resume checkpoint if there is one and Asana says it's still current.
+    Otherwise clears it and returns None.
+    """
+    import mpy.util.checkpoint as checkpoint
+
+    state = checkpoint.load()
+    if state is None:
+        return None
+    if asana.validate_checkpoint(state):
+        print(f"Resuming {state['app']} ({state['mode']}) from checkpoint")
+        return state
+    checkpoint.clear()
+    return None
+
 if __name__ == '__main__':
     """
     Main entry point to micropython program.
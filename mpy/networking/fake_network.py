@@ -0,0 +1,70 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Stand-in for micropython's network module when running on linux.
+Implements just enough of network.WLAN for the radio manager and its tests,
+and counts how often the radio is brought up.
+"""
+
+import time
+
+STA_IF = 0
+AP_IF = 1
+
+# Connection status codes, as on the Pico W
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+
+
+class WLAN:
+    """
+    Fake station interface that always connects
+    """
+    # Power management modes, as on the Pico W
+    PM_NONE = 0xa11140
+    PM_PERFORMANCE = 0x111022
+    PM_POWERSAVE = 0xa11142
+
+    # Simulated association time
+    connect_delay_sec = 0
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connected = False
+        self._pm = self.PM_POWERSAVE
+        self.n_connects = 0
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self._connected = False
+
+    def connect(self, ssid=None, key=None):
+        if not self._active:
+            raise OSError('WLAN not active')
+        time.sleep(self.connect_delay_sec)
+        self._connected = True
+        self.n_connects += 1
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self):
+        return self._connected
+
+    def status(self):
+        return STAT_GOT_IP if self._connected else STAT_IDLE
+
+    def config(self, *args, **kwargs):
+        if 'pm' in kwargs:
+            self._pm = kwargs['pm']
+        if args == ('mac',):
+            return b'\x00\x00\x00\x00\x00\x00'
+        if args == ('pm',):
+            return self._pm
@@ -0,0 +1,221 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Radio duty-cycle manager.
+Wi-Fi is only brought up when there's network work to do, kept up across
+back-to-back network operations, put in power-save mode between them, and
+powered down once it has been idle for a while. Tracks radio-on time per hour.
+
+Backed by networking.wifi on micropython hardware, and by fake_network on linux.
+"""
+
+import sys
+import time
+
+import mpy.util.util as util
+import mpy.util.profiler as profiler
+import mpy.networking.time_service as time_service
+
+IS_LINUX = (sys.platform == 'linux')
+
+if IS_LINUX:
+    import mpy.networking.fake_network as network
+else:
+    import network
+
+# Power the radio down after it's been unused for this long
+IDLE_TIMEOUT_SEC = 30
+
+# Radio-on time is reported over windows of this length
+REPORT_WINDOW_SEC = 60 * 60
+
+# Power management modes, from the Pico W firmware
+PM_PERFORMANCE = getattr(network.WLAN, 'PM_PERFORMANCE', 0x111022)
+PM_POWERSAVE = getattr(network.WLAN, 'PM_POWERSAVE', 0xa11142)
+
+_shared = None
+
+
+class Radio_manager:
+    """
+    Reference-counted holder of the Wi-Fi radio.
+    Wrap network work in acquire()/release(), or use() as a context manager.
+    """
+    def __init__(self, wlan, connect=None, disconnect=None,
+        idle_timeout_sec=IDLE_TIMEOUT_SEC
+        ):
+        self.wlan = wlan
+        self._connect = connect
+        self._disconnect = disconnect
+        self.idle_timeout_sec = idle_timeout_sec
+
+        self.users = 0
+        self.on_since_ms = None
+        self.last_used_ms = util.ticks_ms()
+        self.n_connects = 0
+
+        # Radio-on accounting
+        self.window_start = time.time()
+        self.on_ms_this_window = 0
+        self.on_ms_last_window = None
+
+    def is_on(self):
+        return self.on_since_ms is not None
+
+    def acquire(self):
+        """
+        Bring the radio up if it isn't already, and hold it up until release().
+        Returns True if connected.
+        """
+        if not self.is_on():
+            self.on_since_ms = util.ticks_ms()
+
+        if not self.wlan.isconnected():
+            print("Radio: connecting")
+            with profiler.get_shared().span('wifi'):
+                connected = self._connect_radio()
+            if not connected:
+                print("Radio: couldn't connect")
+                self.power_down()
+                return False
+            self.n_connects += 1
+
+        # Catch up on a clock resync if one came due while we were already connected
+        time_service.get_shared().sync_if_needed()
+
+        self.users += 1
+        self._set_pm(PM_PERFORMANCE)
+        return True
+
+    def release(self):
+        """
+        Done with the radio for now. It stays up in power-save mode until idle() powers it down.
+        """
+        self.users = max(0, self.users - 1)
+        self.last_used_ms = util.ticks_ms()
+        if not self.users and self.is_on():
+            self._set_pm(PM_POWERSAVE)
+
+    def use(self):
+        """
+        Context manager that holds the radio. Raises RuntimeError if it can't connect.
+        """
+        return _Radio_use(self)
+
+    def idle(self):
+        """
+        Power the radio down if nothing has used it for idle_timeout_sec.
+        Call periodically, e.g. once per sample.
+        """
+        self._roll_window()
+        if self.users or not self.is_on():
+            return
+        if util.ticks_diff(util.ticks_ms(), self.last_used_ms) >= self.idle_timeout_sec * 1000:
+            print("Radio: idle, powering down")
+            self.power_down()
+
+    def sleep_hint(self, duration_sec, deep=False):
+        """
+        Called before sleeping for duration_sec. Keeps the radio up in power-save
+        if we'll be back before the idle timeout, otherwise powers it down.
+        Deep sleep always powers it down.
+        """
+        self._roll_window()
+        if deep or duration_sec >= self.idle_timeout_sec:
+            self.power_down()
+        elif self.is_on():
+            self._set_pm(PM_POWERSAVE)
+
+    def power_down(self):
+        """
+        Disconnect and turn off the radio
+        """
+        if self.is_on():
+            self.on_ms_this_window += util.ticks_diff(util.ticks_ms(), self.on_since_ms)
+            self.on_since_ms = None
+        self.users = 0
+        if self._disconnect is not None:
+            self._disconnect()
+        else:
+            # Pooled http connections won't survive the radio going down
+            import mpy.util.simple_http_session as session
+            session.close_all()
+            self.wlan.disconnect()
+            self.wlan.active(False)
+
+    def sync_due(self):
+        """
+        Returns True if the time service wants an NTP resync, which needs the radio
+        """
+        return time_service.get_shared().sync_due()
+
+    def on_ms(self):
+        """
+        Radio-on time so far in the current report window
+        """
+        on_ms = self.on_ms_this_window
+        if self.is_on():
+            on_ms += util.ticks_diff(util.ticks_ms(), self.on_since_ms)
+        return on_ms
+
+    def report(self):
+        if self.on_ms_last_window is not None:
+            print(f"Radio: on for {self.on_ms_last_window / 1000} s in the last hour, {self.n_connects} connects total")
+        print(f"Radio: on for {self.on_ms() / 1000} s so far this hour")
+
+    def _roll_window(self):
+        """
+        Start a new report window once the current one has run its length
+        """
+        now = time.time()
+        if now - self.window_start < REPORT_WINDOW_SEC:
+            return
+        self.on_ms_last_window = self.on_ms()
+        self.on_ms_this_window = 0
+        if self.is_on():
+            self.on_since_ms = util.ticks_ms()
+        self.window_start = now
+        self.report()
+
+    def _connect_radio(self):
+        if self._connect is not None:
+            return self._connect() != False
+        self.wlan.active(True)
+        self.wlan.connect()
+        return self.wlan.isconnected()
+
+    def _set_pm(self, mode):
+        try:
+            self.wlan.config(pm=mode)
+        except (ValueError, TypeError, OSError):
+            # Firmware without power management support
+            pass
+
+
+class _Radio_use:
+    def __init__(self, radio):
+        self.radio = radio
+
+    def __enter__(self):
+        if not self.radio.acquire():
+            raise RuntimeError('radio connection failed')
+        return self.radio
+
+    def __exit__(self, exc_type, exc, tb):
+        self.radio.release()
+
+
+def get_shared():
+    """
+    Returns the process-wide radio manager
+    """
+    global _shared
+    if _shared is None:
+        if IS_LINUX:
+            _shared = Radio_manager(network.WLAN(network.STA_IF))
+        else:
+            import mpy.networking.wifi as wifi
+            _shared = Radio_manager(wifi.get_wlan(), wifi.connect_with_retry, wifi.disconnect)
+    return _shared
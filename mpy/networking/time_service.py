@@ -0,0 +1,197 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Time service with an RTC drift model, so NTP isn't needed on every connect.
+
+Each NTP sync records how far the RTC had drifted since the previous one.
+The drift rate is estimated from the recent history of corrections and
+applied to timestamps between syncs. A resync is only asked for once the
+predicted error of the corrected time exceeds max_error_sec.
+"""
+
+import sys
+import time
+import json
+
+IS_LINUX = (sys.platform == 'linux')
+
+# File the drift history is persisted to on flash
+STATE_FILE_NAME = 'time_sync.json'
+
+# Resync once the predicted error of the corrected time exceeds this
+MAX_ERROR_SEC = 3
+
+# Resync at least this often, whatever the model says
+MAX_SYNC_INTERVAL_SEC = 7 * 24 * 60 * 60
+
+# Assumed drift rate bound before there's history to estimate it from
+DEFAULT_DRIFT_PPM = 100
+
+# Resolution of the RTC and of NTP times as read here
+RESOLUTION_SEC = 1
+
+# Number of recent corrections the drift rate is estimated from
+HISTORY_LEN = 8
+
+_shared = None
+
+
+class Time_service:
+    """
+    Drift-corrected clock on top of the RTC.
+    ntp_time returns the current time from NTP, in the same epoch as time.time().
+    set_rtc sets the RTC to a given time, and rtc_time reads it.
+    Without ntp_time, syncing is disabled.
+    """
+    def __init__(self, ntp_time=None, set_rtc=None, rtc_time=time.time,
+        file_name=STATE_FILE_NAME,
+        max_error_sec=MAX_ERROR_SEC,
+        max_sync_interval_sec=MAX_SYNC_INTERVAL_SEC
+        ):
+        self.ntp_time = ntp_time
+        self.set_rtc = set_rtc
+        self.rtc_time = rtc_time
+        self.file_name = file_name
+        self.max_error_sec = max_error_sec
+        self.max_sync_interval_sec = max_sync_interval_sec
+
+        # RTC time at the last sync, and [elapsed_sec, correction_sec] for recent syncs
+        self.last_sync_rtc = None
+        self.history = []
+        self.n_syncs = 0
+        self.n_sync_failures = 0
+        self._load()
+        self._update_rate()
+
+    def _load(self):
+        try:
+            with open(self.file_name, 'r') as f:
+                state = json.load(f)
+            self.last_sync_rtc = state['last_sync_rtc']
+            self.history = state['history'][-HISTORY_LEN:]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        try:
+            with open(self.file_name, 'w') as f:
+                json.dump({'last_sync_rtc': self.last_sync_rtc, 'history': self.history}, f)
+        except OSError as e:
+            print(f"Couldn't save time sync state: {e}")
+
+    def _update_rate(self):
+        """
+        Estimate the drift rate and its uncertainty from the corrections over the whole history.
+        drift_rate is the correction needed per second of RTC time, i.e. negative if the RTC runs fast.
+        """
+        total_elapsed = sum(h[0] for h in self.history)
+        total_correction = sum(h[1] for h in self.history)
+        default_uncertainty = DEFAULT_DRIFT_PPM / 1e6
+        if total_elapsed > 0:
+            self.drift_rate = total_correction / total_elapsed
+            # Each correction is only known to the clock resolution, at both ends
+            self.drift_uncertainty = min(default_uncertainty, 2 * RESOLUTION_SEC / total_elapsed)
+        else:
+            self.drift_rate = 0
+            self.drift_uncertainty = default_uncertainty
+
+    def _elapsed(self, rtc):
+        """
+        Seconds since the last sync, or None if there's no valid sync, e.g. the RTC was reset
+        """
+        if self.last_sync_rtc is None or rtc < self.last_sync_rtc:
+            return None
+        return rtc - self.last_sync_rtc
+
+    def predicted_error_sec(self):
+        """
+        Predicted error of now(), or None if the RTC hasn't been synced
+        """
+        elapsed = self._elapsed(self.rtc_time())
+        if elapsed is None:
+            return None
+        # Sub-second parts are lost both when the RTC is set and when it's read
+        return 2 * RESOLUTION_SEC + self.drift_uncertainty * elapsed
+
+    def sync_due(self):
+        """
+        Returns True if the drift model says now() is no longer accurate enough
+        """
+        if self.ntp_time is None:
+            return False
+        elapsed = self._elapsed(self.rtc_time())
+        if elapsed is None or elapsed >= self.max_sync_interval_sec:
+            return True
+        return self.predicted_error_sec() > self.max_error_sec
+
+    def now(self):
+        """
+        Current time from the RTC, corrected for the drift since the last sync
+        """
+        rtc = self.rtc_time()
+        elapsed = self._elapsed(rtc)
+        if elapsed is None or not self.drift_rate:
+            return rtc
+        return rtc + int(round(self.drift_rate * elapsed))
+
+    def sync(self):
+        """
+        Set the RTC from NTP and record the correction. Returns True on success.
+        Doesn't raise on network failure, so a flaky NTP server can't fail a connect.
+        """
+        if self.ntp_time is None:
+            return False
+        try:
+            ntp = self.ntp_time()
+        except Exception as e:
+            self.n_sync_failures += 1
+            print(f"NTP sync failed: {e}")
+            return False
+
+        rtc = self.rtc_time()
+        elapsed = self._elapsed(rtc)
+        if elapsed:
+            self.history.append([elapsed, ntp - rtc])
+            self.history = self.history[-HISTORY_LEN:]
+            self._update_rate()
+
+        self.set_rtc(ntp)
+        self.last_sync_rtc = ntp
+        self.n_syncs += 1
+        self._save()
+        print(f"NTP synced. Corrected {ntp - rtc} sec, RTC drift estimate {-self.drift_rate * 1e6:.1f} ppm")
+        return True
+
+    def sync_if_needed(self):
+        """
+        Sync only if the drift model says it's due. Returns True if the clock is usable.
+        """
+        if self.sync_due():
+            return self.sync() or self.last_sync_rtc is not None
+        return True
+
+
+def _set_rtc(t):
+    """
+    Set the RTC from seconds since the epoch, as ntptime.settime does
+    """
+    import machine
+    tm = time.gmtime(t)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+
+def get_shared():
+    """
+    Returns the process-wide time service. Syncing is disabled on linux,
+    where the system clock is already disciplined.
+    """
+    global _shared
+    if _shared is None:
+        if IS_LINUX:
+            _shared = Time_service()
+        else:
+            import ntptime
+            _shared = Time_service(ntptime.time, _set_rtc)
+    return _shared
@@ -6,33 +6,59 @@
 File containing methods for handling wifi connection.
 All methods are idempotent.
 
+The WLAN interface, LED pin and credentials are only set up on first use,
+so importing this module is cheap.
+
 Depends on secrets.py being properly populated
 """
 
 import time
-import ntptime
 import network
 import ubinascii
 
 from machine import Pin
 
 import mpy.secrets
+import mpy.networking.time_service as time_service
 
-"""
-Establish context for wifi connection
-"""
-# Grab ssid and PASSWORD from user-populated secrets
-SECRETS = mpy.secrets.get_secrets()
-SSID = SECRETS['ssid']
-PASSWORD = SECRETS['password']
-WLAN = network.WLAN(network.STA_IF)
 UTC_OFFSET = -7 * 60 * 60
-PIN = Pin("LED", Pin.OUT)
-MAC = ubinascii.hexlify(WLAN.config('mac'),':').decode()
+
+# Hardware singletons, created on first use
+_wlan = None
+_pin = None
+_mac = None
+
+def get_wlan():
+    """
+    Returns the station interface, creating it on first use
+    """
+    global _wlan
+    if _wlan is None:
+        _wlan = network.WLAN(network.STA_IF)
+    return _wlan
+
+def get_pin():
+    """
+    Returns the LED pin, creating it on first use
+    """
+    global _pin
+    if _pin is None:
+        _pin = Pin("LED", Pin.OUT)
+    return _pin
+
+def get_mac():
+    """
+    Returns the MAC address as a colon-separated hex string
+    """
+    global _mac
+    if _mac is None:
+        _mac = ubinascii.hexlify(get_wlan().config('mac'),':').decode()
+    return _mac
 
 def connect_with_retry():
     max_retries = 5
     retry = 0
+    pin = get_pin()
 
     while retry < max_retries:
         try:
@@ -42,9 +68,9 @@ def connect_with_retry():
             retry += 1
             disconnect()
         for i in range(30):
-            PIN.toggle()
+            pin.toggle()
             time.sleep(0.5)
-        PIN.on()
+        pin.on()
 
     return False
 
@@ -52,49 +78,61 @@ def connect():
     """
     Connect to wifi.
     """
-    print(f"Trying to connect to {SSID}")
-
-    if WLAN.isconnected():
+    # Grab ssid and password from user-populated secrets
+    secrets = mpy.secrets.get_secrets()
+    ssid = secrets['ssid']
+    wlan = get_wlan()
+    pin = get_pin()
+    print(f"Trying to connect to {ssid}")
+
+    if wlan.isconnected():
         print("Success - Already connected")
         return
 
-    WLAN.active(True)
-    WLAN.connect(SSID, PASSWORD)
+    wlan.active(True)
+    wlan.connect(ssid, secrets['password'])
     time.sleep(5)
 
     # Wait for connect or fail
     max_wait = 10
     while max_wait > 0:
         print('.')
-        if WLAN.status() < 0 or WLAN.status() >= 3:
+        if wlan.status() < 0 or wlan.status() >= 3:
             break
         max_wait -= 1
         time.sleep(1)
 
     # Handle connection error
-    if WLAN.status() != 3:
+    if wlan.status() != 3:
         raise RuntimeError('network connection failed')
     else:
-        print(f'Connected to {SSID}')
+        print(f'Connected to {ssid}')
         for i in range(100):
             time.sleep(0.1)
-            PIN.toggle()
-        PIN.on()
-        ntp_sync()
+            pin.toggle()
+        pin.on()
+
+        # Only resync the clock if the drift model says it's off by too much
+        time_service.get_shared().sync_if_needed()
 
 def disconnect():
     """
     Disconnect from wifi
     """
+    # Pooled http connections won't survive the radio going down
+    import mpy.util.simple_http_session as session
+    session.close_all()
+
     # if connected:
-    WLAN.disconnect()
-    WLAN.active(False)
+    wlan = get_wlan()
+    wlan.disconnect()
+    wlan.active(False)
 
 def ntp_sync():
     """
-    Sync up to current time in Pacific timezone
+    Sync up to current time in Pacific timezone, regardless of the drift model
     """
-    ntptime.settime()
+    time_service.get_shared().sync()
     actual_time = time.localtime(time.time() + UTC_OFFSET)
     print("NTP synced. Actual time:")
     print(actual_time)
@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for load testing async_runtime with the configured sensors
+and a fake network that is much slower than the sample period
+"""
+
+import time
+
+import mpy.hal.adapter.temp_sensor
+import mpy.hal.adapter.ambient_light_sensor
+import mpy.util.async_runtime as async_runtime
+import mpy.util.sample_store as sample_store
+
+class Fake_tracker:
+    """
+    Tracker whose warnings and uploads just block for a while
+    """
+    def __init__(self, upload_delay_sec, warning_delay_sec):
+        self.upload_delay_sec = upload_delay_sec
+        self.warning_delay_sec = warning_delay_sec
+        self.temp_sensor = mpy.hal.adapter.temp_sensor.Temp_sensor()
+        self.ambient_light_sensor = mpy.hal.adapter.ambient_light_sensor.Ambient_light_sensor()
+        self.upload_buf_quota = 3
+        self.buf = sample_store.Sample_store(
+            (sample_store.COLUMN_TIMESTAMP, sample_store.COLUMN_TEMP, sample_store.COLUMN_FLOAT),
+            capacity=64
+        )
+        self.uploaded = 0
+        self.acked = 0
+
+    def sample(self):
+        temp = self.temp_sensor.read()
+        lux = self.ambient_light_sensor.read_lux()
+        self.buf.append([time.time(), temp, lux])
+        return (temp, lux)
+
+    def report_warning(self, snapshot):
+        time.sleep(self.warning_delay_sec)
+
+    def upload_batch(self, batch):
+        time.sleep(self.upload_delay_sec)
+        for row in batch:
+            self.uploaded += 1
+        return True
+
+    def ack_batch(self, batch):
+        # Counted on the event loop, unlike uploaded, so an upload cut off by the end of the run doesn't count
+        self.acked += len(batch)
+        self.buf.drop(len(batch))
+
+class Flaky_radio_tracker(Fake_tracker):
+    """
+    Tracker whose radio won't connect for outage_sec, starting outage_start_sec in.
+    Timed rather than every nth connect, so the outage can't fall on warnings only.
+    """
+    def __init__(self, upload_delay_sec, warning_delay_sec, outage_start_sec, outage_sec):
+        super().__init__(upload_delay_sec, warning_delay_sec)
+        self.outage_start = time.time() + outage_start_sec
+        self.outage_end = self.outage_start + outage_sec
+        self.users = 0
+
+    def connect(self):
+        if self.outage_start <= time.time() < self.outage_end:
+            return False
+        self.users += 1
+        return True
+
+    def release(self):
+        assert self.users > 0, "Released a radio that wasn't acquired"
+        self.users -= 1
+
+    def upload_batch(self, batch):
+        assert self.users > 0, "Uploading without the radio"
+        return super().upload_batch(batch)
+
+class Async_runtime_tester:
+    def __init__(self, sample_period_sec=0.1, duration_sec=3, upload_delay_sec=0.5, warning_delay_sec=0.2):
+        tracker = Fake_tracker(upload_delay_sec, warning_delay_sec)
+        runtime = async_runtime.Tracker_runtime(tracker, sample_period_sec)
+        stats = runtime.run(duration_sec)
+        print(stats)
+
+        expected = int(duration_sec / sample_period_sec)
+        assert stats['samples'] >= expected - 1, f"Only {stats['samples']} of {expected} samples taken"
+        # Slow uploads and warnings mustn't hold up sampling. Exact timing depends on the
+        # scheduler, so only check no sample was anywhere near a whole period late.
+        max_lateness_ms = sample_period_sec * 1000 / 2
+        assert stats['max_lateness_ms'] < max_lateness_ms, f"A sample was {stats['max_lateness_ms']} ms late"
+        assert stats['uploads'] > 0
+        assert tracker.acked + len(tracker.buf) == stats['samples']
+
+        # Stopping waits for an upload in flight, so everything uploaded is acked, not uploaded again later
+        assert tracker.uploaded == tracker.acked, f"{tracker.uploaded - tracker.acked} rows uploaded but not acked"
+
+        # Network calls are skipped, not made offline, when the radio won't connect.
+        # Only successful connects are released, and failed ones count as upload errors.
+        tracker = Flaky_radio_tracker(upload_delay_sec / 5, 0, duration_sec / 3, duration_sec / 3)
+        runtime = async_runtime.Tracker_runtime(tracker, sample_period_sec)
+        stats = runtime.run(duration_sec)
+        print(stats)
+        assert tracker.users == 0, f"{tracker.users} radio claims left after the run"
+        assert stats['uploads'] > 0 and stats['upload_errors'] > 0
+        assert tracker.acked + len(tracker.buf) == stats['samples']
+        print("Async_runtime_tester: pass")
@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for measuring what each app in main's registry costs to import.
+Only the selected app gets imported at boot, so this is the time and heap
+the lazy registry saves for every app that isn't selected.
+"""
+
+import sys
+import gc
+
+import mpy.util.util as util
+import mpy.main as main
+
+IS_LINUX = (sys.platform == 'linux')
+
+class Boot_tester:
+    def __init__(self):
+        total_ms = 0
+        total_bytes = 0
+        for app, path in main.APP_REGISTRY.items():
+            if path in sys.modules or app == 'boot_tester':
+                print(f"{app}: already imported, skipping")
+                continue
+            ms, n_bytes = self.measure_import(path)
+            total_ms += ms
+            total_bytes += n_bytes
+            print(f"{app}: {ms} ms, {n_bytes} bytes")
+
+        print(f"Importing every app up front would cost {total_ms} ms and {total_bytes} bytes of heap")
+        print("Boot_tester: pass")
+
+    def measure_import(self, path):
+        """
+        Import the module at path, returning the time taken and heap it and its new dependencies hold on to
+        """
+        gc.collect()
+        if IS_LINUX:
+            import tracemalloc
+            tracemalloc.start()
+        else:
+            before = gc.mem_alloc()
+
+        start = util.ticks_ms()
+        __import__(path)
+        ms = util.ticks_diff(util.ticks_ms(), start)
+
+        gc.collect()
+        if IS_LINUX:
+            n_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        else:
+            n_bytes = gc.mem_alloc() - before
+        return ms, n_bytes
@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for running tests against the diagnostics log.
+Simulates a boot loop and a long run, and checks flash use stays capped
+and the newest records survive.
+"""
+
+import os
+
+import mpy.util.diag_log as diag_log
+
+class Diag_log_tester:
+    DIR_NAME = 'diag_test'
+
+    def __init__(self, n_boots=10, max_segments=4):
+        self.clear()
+
+        # Every boot starts a fresh segment. Old ones must still be deleted.
+        for boot in range(n_boots):
+            log = diag_log.Diag_log(dir=self.DIR_NAME, max_segments=max_segments)
+            log.event(f"boot {boot}")
+            log.flush()
+        seqs = diag_log._segment_seqs(self.DIR_NAME)
+        assert len(seqs) == max_segments, f"{len(seqs)} segments after {n_boots} boots"
+        events = [value for name, t, value in diag_log.read_records(self.DIR_NAME)]
+        assert events == [f"boot {boot}" for boot in range(n_boots - max_segments, n_boots)], f"Kept {events}"
+
+        # Within one boot, segments rotate as they fill
+        log = diag_log.Diag_log(dir=self.DIR_NAME, segment_size=256, max_segments=max_segments)
+        for i in range(100):
+            log.event(f"event {i:03d}")
+            log.memory()
+        log.exception(ValueError("last"))
+        seqs = diag_log._segment_seqs(self.DIR_NAME)
+        assert len(seqs) == max_segments, f"{len(seqs)} segments after rotating"
+        records = list(diag_log.read_records(self.DIR_NAME))
+        assert records[-1][0] == 'exception', f"Last record is {records[-1]}"
+
+        self.clear()
+        print("Diag_log_tester: pass")
+
+    def clear(self):
+        try:
+            for name in os.listdir(self.DIR_NAME):
+                os.remove(f'{self.DIR_NAME}/{name}')
+            os.rmdir(self.DIR_NAME)
+        except OSError:
+            pass
@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for running tests against the exception digest.
+Raises the same faults repeatedly, with changing messages, and checks they're
+counted under one fingerprint each, bounded, persisted and reported on schedule.
+"""
+
+import os
+
+import mpy.util.exception_digest as exception_digest
+
+def divide(n):
+    return n / 0
+
+def lookup(key):
+    return {}[key]
+
+def capture(digest, func, arg, now):
+    try:
+        func(arg)
+    except Exception as e:
+        digest.capture(e, now)
+
+class Exception_digest_tester:
+    FILE_NAME = 'exception_digest_test.json'
+
+    def __init__(self, interval_sec=60 * 60):
+        try:
+            os.remove(self.FILE_NAME)
+        except OSError:
+            pass
+
+        now = 1_000_000
+        digest = exception_digest.Exception_digest(file_name=self.FILE_NAME, max_entries=2, report_interval_sec=interval_sec)
+        assert not digest.report_due(now), "Nothing to report yet"
+
+        # Same fault with a different message each time is one fingerprint
+        for i in range(50):
+            capture(digest, divide, i, now + i)
+            capture(digest, lookup, f'key{i}', now + i)
+        assert len(digest) == 2, f"{len(digest)} fingerprints, expected 2"
+        counts = sorted(entry[0] for entry in digest.entries.values())
+        assert counts == [50, 50], f"Counts {counts}"
+
+        # A third fault evicts the rarest
+        capture(digest, lookup, 'key', now + 100)
+        try:
+            int('x')
+        except ValueError as e:
+            digest.capture(e, now + 100)
+        assert len(digest) == 2 and digest.n_evicted == 1, "Table isn't bounded"
+
+        # Survives a reset
+        digest._save(now + 100)
+        digest = exception_digest.Exception_digest(file_name=self.FILE_NAME, max_entries=2, report_interval_sec=interval_sec)
+        assert len(digest) == 2 and digest.n_evicted == 1, "Table didn't survive a reset"
+
+        text = digest.format('Tester')
+        print(text)
+        assert '51x KeyError' in text, "Digest is missing the KeyError count"
+        assert digest.report_due(now + 100), "First digest should be due"
+        digest.reported(now + 100)
+        assert not digest.report_due(now + 100), "Nothing left to report"
+
+        capture(digest, divide, 0, now + 200)
+        assert not digest.report_due(now + 200), "Digest posted again before the interval"
+        assert digest.report_due(now + 100 + interval_sec), "Digest not due after the interval"
+
+        print("Exception_digest_tester: pass")
+        os.remove(self.FILE_NAME)
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for running tests against the priority outbox.
+Handlers stand in for Asana and Sheets, and count the bytes a real request would.
+"""
+
+import os
+
+import mpy.util.outbox as outbox
+import mpy.util.simple_http_session as session
+
+class Outbox_tester:
+    FILE_NAME = 'outbox_test.json'
+
+    def __init__(self):
+        try:
+            os.remove(self.FILE_NAME)
+        except OSError:
+            pass
+
+        self.sent = []
+        self.failing = False
+        now = 1_000_000
+
+        ob = self.make_outbox(budget_bytes=3500)
+        ob.enqueue('send', outbox.PRIORITY_HOUSEKEEPING, {'name': 'on_it', 'bytes': 1000})
+        ob.enqueue('send', outbox.PRIORITY_DATA, {'name': 'rows', 'bytes': 2000}, key='upload', durable=False)
+        ob.enqueue('send', outbox.PRIORITY_HOUSEKEEPING, {'name': 'description', 'bytes': 1000})
+        ob.enqueue('send', outbox.PRIORITY_WARNING, {'name': 'warning', 'bytes': 1000}, key='warning_temp')
+
+        # Priority order, and housekeeping waits once the budget is spent
+        assert ob.drain(now) == 3, f"Sent {self.sent}"
+        assert self.sent == ['warning', 'rows', 'on_it'], f"Sent {self.sent} out of order"
+        assert len(ob) == 1, "Description should wait for the next wake"
+
+        # Warnings go regardless of the budget
+        ob.enqueue('send', outbox.PRIORITY_DATA, {'name': 'big rows', 'bytes': 5000}, key='upload', durable=False)
+        ob.enqueue('send', outbox.PRIORITY_WARNING, {'name': 'warning 2', 'bytes': 1000}, key='warning_lux')
+        self.sent = []
+        ob.drain(now)
+        assert self.sent == ['warning 2', 'big rows'], f"Sent {self.sent}"
+
+        # A failure backs off and stops the drain. Retry state survives a reset, and
+        # non-durable operations don't.
+        self.failing = True
+        ob.enqueue('send', outbox.PRIORITY_WARNING, {'name': 'warning 3', 'bytes': 100}, key='warning_temp')
+        ob.enqueue('send', outbox.PRIORITY_DATA, {'name': 'rows', 'bytes': 100}, key='upload', durable=False)
+        assert ob.drain(now) == 0
+        assert not ob.has_due(now, outbox.PRIORITY_WARNING), "Failed warning should back off"
+        ob = self.make_outbox()
+        assert len(ob) == 2, f"{len(ob)} operations recovered, expected warning 3 and description"
+        assert not ob.has_due(now, outbox.PRIORITY_WARNING), "Backoff didn't survive a reset"
+
+        # Re-queueing under the same key keeps one operation and its retry state
+        ob.enqueue('send', outbox.PRIORITY_WARNING, {'name': 'warning 3', 'bytes': 100}, key='warning_temp')
+        assert len(ob) == 2 and not ob.has_due(now, outbox.PRIORITY_WARNING)
+
+        self.failing = False
+        self.sent = []
+        ob.drain(now + outbox.RETRY_BASE_SEC)
+        assert self.sent == ['warning 3', 'description'], f"Sent {self.sent}"
+        assert not len(ob) and not len(self.make_outbox()), "Outbox should be empty"
+
+        # Bounded, dropping the oldest housekeeping first
+        for i in range(outbox.MAX_OPS + 2):
+            ob.enqueue('send', outbox.PRIORITY_HOUSEKEEPING, {'name': i, 'bytes': 0})
+        assert len(ob) == outbox.MAX_OPS
+        self.sent = []
+        ob.drain(now)
+        assert self.sent[0] == 2, f"Oldest kept is {self.sent[0]}"
+
+        # Never drops a more urgent operation to make room for a less urgent one
+        ob = outbox.Outbox(file_name=self.FILE_NAME, max_ops=3)
+        ob.register('send', self.send)
+        for i in range(3):
+            ob.enqueue('send', outbox.PRIORITY_WARNING, {'name': f'warning {i}', 'bytes': 0})
+        assert not ob.enqueue('send', outbox.PRIORITY_HOUSEKEEPING, {'name': 'on_it', 'bytes': 0}), "Housekeeping should be refused"
+        assert not ob.enqueue('send', outbox.PRIORITY_DATA, {'name': 'rows', 'bytes': 0}), "Data should be refused"
+        assert ob.enqueue('send', outbox.PRIORITY_WARNING, {'name': 'warning 3', 'bytes': 0})
+        self.sent = []
+        ob.drain(now)
+        assert self.sent == ['warning 1', 'warning 2', 'warning 3'], f"Sent {self.sent}"
+
+        # A last attempt can skip the backoff
+        self.failing = True
+        ob.enqueue('send', outbox.PRIORITY_DATA, {'name': 'final rows', 'bytes': 0}, key='upload', durable=False)
+        ob.drain(now)
+        assert not ob.has_due(now), "Failed upload should back off"
+        self.failing = False
+        ob.retry_now('upload')
+        self.sent = []
+        ob.drain(now)
+        assert self.sent == ['final rows'], f"Sent {self.sent}"
+
+        print("Outbox_tester: pass")
+        os.remove(self.FILE_NAME)
+
+    def make_outbox(self, budget_bytes=outbox.BUDGET_BYTES):
+        ob = outbox.Outbox(file_name=self.FILE_NAME, budget_bytes=budget_bytes)
+        ob.register('send', self.send)
+        return ob
+
+    def send(self, args):
+        if self.failing:
+            raise OSError("Network is down")
+        session.stats['bytes_sent'] += args['bytes']
+        self.sent.append(args['name'])
+        return True
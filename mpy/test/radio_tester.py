@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for running tests against the radio manager.
+Always runs against fake_network, so it never touches the real radio.
+"""
+
+import time
+
+import mpy.networking.fake_network as fake_network
+import mpy.networking.radio as radio
+
+class Radio_tester:
+    def __init__(self, idle_timeout_sec=0.2):
+        self.idle_timeout_sec = idle_timeout_sec
+
+        self.test_back_to_back_ops_share_connection()
+        self.test_idle_powers_down()
+        self.test_short_sleep_keeps_radio_up()
+        self.test_on_time_is_tracked()
+
+    def _new_radio(self):
+        wlan = fake_network.WLAN(fake_network.STA_IF)
+        return wlan, radio.Radio_manager(wlan, idle_timeout_sec=self.idle_timeout_sec)
+
+    def test_back_to_back_ops_share_connection(self):
+        wlan, r = self._new_radio()
+        for _ in range(5):
+            with r.use():
+                assert wlan.isconnected()
+                assert wlan.config('pm') == radio.PM_PERFORMANCE
+        assert wlan.n_connects == 1, f"{wlan.n_connects} connects for back-to-back ops"
+        assert wlan.config('pm') == radio.PM_POWERSAVE
+        print("test_back_to_back_ops_share_connection: pass")
+
+    def test_idle_powers_down(self):
+        wlan, r = self._new_radio()
+        with r.use():
+            pass
+        r.idle()
+        assert wlan.isconnected(), "Powered down before the idle timeout"
+        time.sleep(self.idle_timeout_sec * 1.5)
+        r.idle()
+        assert not wlan.active() and not r.is_on()
+        with r.use():
+            pass
+        assert wlan.n_connects == 2
+        print("test_idle_powers_down: pass")
+
+    def test_short_sleep_keeps_radio_up(self):
+        wlan, r = self._new_radio()
+        with r.use():
+            pass
+        r.sleep_hint(self.idle_timeout_sec / 2)
+        assert wlan.isconnected()
+        r.sleep_hint(self.idle_timeout_sec * 2)
+        assert not wlan.isconnected()
+        with r.use():
+            pass
+        r.sleep_hint(0, deep=True)
+        assert not wlan.isconnected()
+        print("test_short_sleep_keeps_radio_up: pass")
+
+    def test_on_time_is_tracked(self):
+        wlan, r = self._new_radio()
+        with r.use():
+            time.sleep(0.1)
+        r.power_down()
+        time.sleep(0.1)
+        on_ms = r.on_ms()
+        assert 80 <= on_ms < 200, f"Radio on for {on_ms} ms, expected ~100"
+        r.report()
+        print("test_on_time_is_tracked: pass")
@@ -11,6 +11,9 @@ import time
 
 import mpy.hal.adapter.temp_sensor
 import mpy.hal.adapter.ambient_light_sensor
+import mpy.hal.sensor_burst as sensor_burst
+import mpy.hal.i2c_bus as i2c_bus
+import mpy.util.util as util
 
 IS_LINUX = (sys.platform == 'linux')
 
@@ -27,6 +30,10 @@ class Sensor_tester:
         self.ambient_light_sensor = mpy.hal.adapter.ambient_light_sensor.Ambient_light_sensor()
         print("Done init")
 
+        sensors = (self.temp_sensor, self.ambient_light_sensor)
+        self.median_burst = sensor_burst.Sensor_burst(sensors, filter=sensor_burst.FILTER_MEDIAN)
+        self.mean_burst = sensor_burst.Sensor_burst(sensors, filter=sensor_burst.FILTER_MEAN)
+
         while True:
             self.pin.toggle()
 
@@ -39,6 +46,16 @@ class Sensor_tester:
             lux = self.ambient_light_sensor.read_lux()
             print("Done light read")
             print(f"{lux=}")
+
+            for name, burst in (('median', self.median_burst), ('mean', self.mean_burst)):
+                alloc_start = util.mem_alloc()
+                t_start = util.ticks_ms()
+                temp, lux = burst.read()
+                print(f"Burst of {burst.n} ({name}): {temp=} {lux=} in "
+                      f"{util.ticks_diff(util.ticks_ms(), t_start)} ms, {util.mem_alloc() - alloc_start} B allocated")
+            # Auto-ranging may have changed the integration time, which sets the burst's pace
+            print(f"Light sensor integration time {self.ambient_light_sensor.period_ms} ms")
+            i2c_bus.report_stats(reset=True)
             print('')
 
             time.sleep(period_sec)
\ No newline at end of file
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for running tests against stream_json.
+Compares allocation of stream_json.select against json.loads for a large response.
+"""
+
+import sys
+import gc
+import io
+import json
+
+import mpy.util.stream_json as stream_json
+
+IS_LINUX = (sys.platform == 'linux')
+
+if IS_LINUX:
+    import tracemalloc
+
+class Stream_json_tester:
+    def __init__(self, n_tasks=200):
+        # Fake Asana task response with a lot of payload we don't care about
+        self.raw = json.dumps({
+            'data': {
+                'gid': '1234',
+                'notes': 'header.payload.signature',
+                'followers': [{'gid': str(i), 'name': f'Follower {i}'} for i in range(n_tasks)],
+                'memberships': [{'project': {'gid': str(i)}, 'section': {'name': 'In Primary'}} for i in range(n_tasks)],
+            },
+            'sheets': [{'properties': {'sheetId': i, 'title': f'Sheet{i}'}} for i in range(5)],
+        }).encode()
+
+        self.test_select_matches_loads()
+        self.test_select_allocates_less()
+
+    def _measure(self, func):
+        """
+        Returns bytes allocated by func. Peak on linux, total with gc disabled on micropython.
+        """
+        gc.collect()
+        if IS_LINUX:
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak
+        gc.disable()
+        before = gc.mem_alloc()
+        func()
+        used = gc.mem_alloc() - before
+        gc.enable()
+        return used
+
+    def test_select_matches_loads(self):
+        full = json.loads(self.raw)
+        r = stream_json.select(io.BytesIO(self.raw), ['data.notes', 'sheets[].properties.sheetId', 'missing.path'])
+        assert r['data.notes'] == full['data']['notes']
+        assert r['sheets[].properties.sheetId'] == [s['properties']['sheetId'] for s in full['sheets']]
+        assert 'missing.path' not in r
+        print("test_select_matches_loads: pass")
+
+    def test_select_allocates_less(self):
+        loads_bytes = self._measure(lambda: json.loads(io.BytesIO(self.raw).read())['data']['notes'])
+        select_bytes = self._measure(lambda: stream_json.select(io.BytesIO(self.raw), ['data.notes']))
+        print(f"Response {len(self.raw)} bytes: json.loads allocated {loads_bytes}, select allocated {select_bytes}")
+        assert select_bytes < loads_bytes
+        print("test_select_allocates_less: pass")
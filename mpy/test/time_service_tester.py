@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Dummy app for running tests against the time service's drift model.
+Simulates an RTC that drifts against NTP, with hourly wakes, and no real network.
+"""
+
+import os
+
+import mpy.networking.time_service as time_service
+
+class Fake_rtc:
+    """
+    RTC that gains drift_ppm against true time, read at whole seconds like the real one
+    """
+    def __init__(self, drift_ppm):
+        self.true_time = 1_000_000_000.0
+        self.offset = 0.0
+        self.drift_ppm = drift_ppm
+
+    def advance(self, sec):
+        self.true_time += sec
+        self.offset += sec * self.drift_ppm / 1e6
+
+    def time(self):
+        return int(self.true_time + self.offset)
+
+    def ntp_time(self):
+        return int(self.true_time)
+
+    def set(self, t):
+        self.offset = t - self.true_time
+
+class Time_service_tester:
+    FILE_NAME = 'time_sync_test.json'
+
+    def __init__(self, drift_ppm=40, wake_period_sec=60 * 60, n_days=30):
+        try:
+            os.remove(self.FILE_NAME)
+        except OSError:
+            pass
+
+        rtc = Fake_rtc(drift_ppm)
+        ts = time_service.Time_service(rtc.ntp_time, rtc.set, rtc.time, file_name=self.FILE_NAME)
+
+        n_wakes = n_days * 24 * 60 * 60 // wake_period_sec
+        max_error = 0
+        for _ in range(n_wakes):
+            rtc.advance(wake_period_sec)
+            ts.sync_if_needed()
+            max_error = max(max_error, abs(ts.now() - rtc.true_time))
+
+        print(f"{ts.n_syncs} NTP syncs over {n_wakes} wakes, max error {max_error:.2f} sec, "
+              f"drift estimate {-ts.drift_rate * 1e6:.1f} ppm vs actual {drift_ppm} ppm")
+        assert ts.n_syncs < n_wakes // 10, f"{ts.n_syncs} syncs is too many"
+        assert max_error <= ts.max_error_sec, f"Max error {max_error} sec exceeds bound"
+        print("Time_service_tester: pass")
+
+        os.remove(self.FILE_NAME)
@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Adaptive sampling period driven by how fast readings are changing.
+The period is shortened as soon as any channel's slope exceeds its threshold,
+and stretched back toward the ceiling once readings have been stable for a while.
+"""
+
+# Multipliers applied to the period when readings move fast or stay stable
+SHRINK_FACTOR = 0.5
+STRETCH_FACTOR = 1.5
+
+# Consecutive stable samples needed before the period is stretched
+STABLE_SAMPLES = 3
+
+# A channel counts as stable while its slope is below this fraction of its threshold
+STABLE_FRACTION = 0.25
+
+
+class Adaptive_period:
+    """
+    Picks the next sample period from the slope of each channel since the last sample.
+    Slope thresholds are in channel units per minute.
+    noise_floors optionally gives a per-channel change that's ignored as sensor noise,
+    e.g. one TMP102 LSB, so a flickering reading doesn't look like a fast move.
+    """
+    def __init__(self, period_sec, min_period_sec, max_period_sec, slope_thresholds, noise_floors=None):
+        self.min_period_sec = min_period_sec
+        self.max_period_sec = max_period_sec
+        self.period_sec = min(max(period_sec, min_period_sec), max_period_sec)
+        self.slope_thresholds = slope_thresholds
+        self.noise_floors = noise_floors or [0] * len(slope_thresholds)
+
+        self.prev_timestamp = None
+        self.prev_values = [0] * len(slope_thresholds)
+        self.n_stable = 0
+        self.changed = False
+
+    def update(self, timestamp, values):
+        """
+        Feed the latest readings. Returns the period to wait before the next sample.
+        Sets changed if the period differs from the one returned last time.
+        """
+        old_period_sec = self.period_sec
+        prev_timestamp = self.prev_timestamp
+        self.prev_timestamp = timestamp
+
+        fast = False
+        stable = True
+        for i in range(len(self.slope_thresholds)):
+            value = values[i]
+            if prev_timestamp is not None and timestamp > prev_timestamp:
+                delta = abs(value - self.prev_values[i]) - self.noise_floors[i]
+                slope = max(0, delta) * 60 / (timestamp - prev_timestamp)
+                if slope > self.slope_thresholds[i]:
+                    fast = True
+                if slope > self.slope_thresholds[i] * STABLE_FRACTION:
+                    stable = False
+            else:
+                stable = False
+            self.prev_values[i] = value
+
+        if fast:
+            self.n_stable = 0
+            self.period_sec = max(self.min_period_sec, self.period_sec * SHRINK_FACTOR)
+        elif stable:
+            self.n_stable += 1
+            if self.n_stable >= STABLE_SAMPLES:
+                self.n_stable = 0
+                self.period_sec = min(self.max_period_sec, self.period_sec * STRETCH_FACTOR)
+        else:
+            self.n_stable = 0
+
+        self.changed = self.period_sec != old_period_sec
+        return self.period_sec
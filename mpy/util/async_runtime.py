@@ -0,0 +1,357 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+asyncio-based runtime for the trackers.
+Sensor sampling runs as its own task at a fixed cadence, while warnings and
+uploads drain from queues in separate tasks. Blocking network calls run in a
+worker thread, so a slow HTTP request never delays or skips a sample.
+
+Runs under uasyncio on micropython and under asyncio on CPython.
+
+A tracker plugged into the runtime provides:
+    sample()                  Read sensors and log a sample. Returns a warning snapshot or None.
+    sample_async()            Optional. Coroutine used instead of sample(), so waits within a sample yield.
+    report_warning(snapshot)  Send or queue warnings for the snapshot. Blocking, may hit the network.
+    buf                       Sample_store of samples awaiting upload. Only appended to from the event loop.
+    upload_batch(batch)       Upload a Sample_batch, returning True on success. Blocking, may hit the network.
+    take_batch()              Optional. Returns the Sample_batch to upload. buf.batch() if not given.
+    ack_batch(batch)          Drop an uploaded batch from buf. Called on the event loop.
+    should_upload()           Optional. Returning True triggers an upload, e.g. from a Flush_policy.
+    upload_buf_quota          Optional. Number of buffered samples that triggers an upload, without should_upload.
+    sample_period_sec         Optional. Read before every sample, so the tracker can adapt it.
+    is_done()                 Optional. Returning True stops the runtime.
+    connect()                 Optional. Blocking. Called before each batch of network work. Returning False skips it.
+    release()                 Optional. Called after each batch of network work, if connect() succeeded.
+    idle()                    Optional. Called after each sample, e.g. to power down an unused radio.
+    drain_outbox()            Optional. Blocking. Sends queued operations, after each warning and upload.
+    log_exception(e)          Optional. Reports an exception caught by the runtime. Printed if not given.
+"""
+
+import gc
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+import mpy.util.util as util
+
+# Poll interval while waiting for a worker thread, or for work in flight when stopping
+WORKER_POLL_SEC = 0.02
+
+
+class Not_connected(Exception):
+    """
+    The tracker couldn't connect for a network call, so it wasn't made
+    """
+    pass
+
+
+class Async_queue:
+    """
+    Minimal bounded queue for uasyncio, which doesn't ship one.
+    When full, the oldest item is dropped and counted.
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.items = []
+        self.dropped = 0
+        self._event = asyncio.Event()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put_nowait(self, item):
+        if len(self.items) >= self.maxsize:
+            self.items.pop(0)
+            self.dropped += 1
+        self.items.append(item)
+        self._event.set()
+
+    async def get(self):
+        while not self.items:
+            self._event.clear()
+            await self._event.wait()
+        return self.items.pop(0)
+
+
+async def run_in_thread(func, *args):
+    """
+    Run a blocking function without blocking the event loop.
+    Uses the default executor on CPython and _thread on micropython.
+    Falls back to running inline if threads aren't available.
+    """
+    if hasattr(asyncio, 'get_running_loop'):
+        loop = asyncio.get_running_loop()
+        if hasattr(loop, 'run_in_executor'):
+            return await loop.run_in_executor(None, func, *args)
+
+    if _thread is None:
+        return func(*args)
+
+    result = {}
+
+    def worker():
+        try:
+            result['value'] = func(*args)
+        except BaseException as e:
+            result['error'] = e
+        result['done'] = True
+
+    _thread.start_new_thread(worker, ())
+    while 'done' not in result:
+        await asyncio.sleep(WORKER_POLL_SEC)
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+
+class Tracker_runtime:
+    """
+    Drives a tracker with separate sampling, warning and upload tasks
+    """
+    def __init__(self, tracker, sample_period_sec, upload_buf_quota=None, warning_queue_size=8):
+        self.tracker = tracker
+        self.sample_period_sec = sample_period_sec
+        if upload_buf_quota is None:
+            upload_buf_quota = getattr(tracker, 'upload_buf_quota', 1)
+        self.upload_buf_quota = upload_buf_quota
+
+        self.warning_queue = Async_queue(warning_queue_size)
+        self.upload_queue = Async_queue(1)
+
+        # Only one blocking network call at a time, since the http session isn't thread safe
+        self._network_lock = asyncio.Lock()
+        self._stopped = False
+
+        # Warnings and uploads being handled. Stopping waits for them, so a batch that was
+        # uploaded is also acked, and no worker thread is left using the http session.
+        self._busy = 0
+
+        # Load-testing counters
+        self.stats = {
+            'samples': 0,
+            'late_samples': 0,
+            'max_lateness_ms': 0,
+            'sample_errors': 0,
+            'warnings': 0,
+            'uploads': 0,
+            'upload_errors': 0,
+            'max_upload_ms': 0,
+        }
+
+    def _is_done(self):
+        is_done = getattr(self.tracker, 'is_done', None)
+        return self._stopped or (is_done is not None and is_done())
+
+    def _should_upload(self):
+        should_upload = getattr(self.tracker, 'should_upload', None)
+        if should_upload is not None:
+            return should_upload()
+        return len(self.tracker.buf) >= self.upload_buf_quota
+
+    def _period_ms(self):
+        return int(getattr(self.tracker, 'sample_period_sec', self.sample_period_sec) * 1000)
+
+    def _log_exception(self, e):
+        log_exception = getattr(self.tracker, 'log_exception', None)
+        if log_exception is not None:
+            log_exception(e)
+        else:
+            util.print_exception(e)
+
+    async def _network(self, func, *args):
+        """
+        Run a blocking network call in the worker, connecting first if the tracker needs it.
+        Raises Not_connected without making the call if connect() fails.
+        """
+        async with self._network_lock:
+            connect = getattr(self.tracker, 'connect', None)
+            release = getattr(self.tracker, 'release', None)
+            if connect is not None:
+                if await run_in_thread(connect) is False:
+                    # Nothing was claimed, so there's nothing to release
+                    raise Not_connected("Couldn't connect")
+            try:
+                return await run_in_thread(func, *args)
+            finally:
+                if release is not None:
+                    release()
+
+    async def _sampler(self):
+        """
+        Sample at the tracker's cadence, scheduled from absolute deadlines so it doesn't drift.
+        The period is re-read every sample, since adaptive trackers change it as they go.
+        """
+        deadline = util.ticks_ms()
+        while not self._is_done():
+            period_ms = self._period_ms()
+            lateness = util.ticks_diff(util.ticks_ms(), deadline)
+            if lateness > period_ms // 10:
+                self.stats['late_samples'] += 1
+            self.stats['max_lateness_ms'] = max(self.stats['max_lateness_ms'], lateness)
+
+            try:
+                sample_async = getattr(self.tracker, 'sample_async', None)
+                if sample_async is not None:
+                    snapshot = await sample_async()
+                else:
+                    snapshot = self.tracker.sample()
+                self.stats['samples'] += 1
+                if snapshot is not None:
+                    self.warning_queue.put_nowait(snapshot)
+                if self._should_upload():
+                    # One pending upload request is enough, the upload takes the whole buffer
+                    if not len(self.upload_queue):
+                        self.upload_queue.put_nowait(True)
+                idle = getattr(self.tracker, 'idle', None)
+                if idle is not None and not self._network_lock.locked():
+                    idle()
+            except Exception as e:
+                self.stats['sample_errors'] += 1
+                print("Hit exception while sampling. Continuing.")
+                self._log_exception(e)
+
+            deadline += self._period_ms()
+            delay = util.ticks_diff(deadline, util.ticks_ms())
+            if delay < 0:
+                # We're more than a whole period behind. Skip ahead rather than bursting.
+                deadline = util.ticks_ms()
+                delay = 0
+            await asyncio.sleep(delay / 1000)
+
+    async def _warner(self):
+        """
+        Drain the warning queue until stopped
+        """
+        while not self._stopped:
+            snapshot = await self.warning_queue.get()
+            if self._stopped:
+                break
+            self._busy += 1
+            try:
+                await self._warn(snapshot)
+            finally:
+                self._busy -= 1
+
+    async def _warn(self, snapshot):
+        """
+        Report one warning, then send what's queued in the outbox
+        """
+        try:
+            await self._network(self.tracker.report_warning, snapshot)
+            self.stats['warnings'] += 1
+        except Not_connected:
+            # Still let the tracker queue the warning, e.g. in an outbox, to send once it can.
+            # If it needs the network to do that, it fails like any other warning.
+            print("Couldn't connect to warn. Reporting the warning offline.")
+            try:
+                await run_in_thread(self.tracker.report_warning, snapshot)
+                self.stats['warnings'] += 1
+            except Exception as e:
+                self._log_exception(e)
+        except Exception as e:
+            print("Hit exception while warning. Continuing.")
+            self._log_exception(e)
+        await self._drain_outbox()
+
+    async def _uploader(self):
+        """
+        Drain the upload queue until stopped
+        """
+        while not self._stopped:
+            await self.upload_queue.get()
+            if self._stopped:
+                break
+            self._busy += 1
+            try:
+                await self._upload()
+            finally:
+                self._busy -= 1
+
+    async def _upload(self):
+        """
+        Upload and ack one batch, then send what's queued in the outbox
+        """
+        t_start = util.ticks_ms()
+
+        # The batch is a fixed view of the oldest rows. The sampler keeps
+        # appending behind it, and it's only dropped here on the event loop.
+        take_batch = getattr(self.tracker, 'take_batch', None)
+        batch = take_batch() if take_batch is not None else self.tracker.buf.batch()
+        upload_success = False
+        try:
+            upload_success = await self._network(self.tracker.upload_batch, batch)
+        except Not_connected:
+            print("Couldn't connect to upload. Will try again next upload.")
+        except Exception as e:
+            print("Hit exception while uploading. Continuing.")
+            self._log_exception(e)
+
+        if upload_success:
+            self.stats['uploads'] += 1
+            self.tracker.ack_batch(batch)
+        else:
+            self.stats['upload_errors'] += 1
+        self.stats['max_upload_ms'] = max(self.stats['max_upload_ms'], util.ticks_diff(util.ticks_ms(), t_start))
+        await self._drain_outbox()
+        gc.collect()
+
+    async def _drain_outbox(self):
+        """
+        Send what the tracker has queued in its outbox, if it has one, e.g. a warning
+        or housekeeping that's come due. The outbox keeps each drain within its budget.
+        """
+        drain_outbox = getattr(self.tracker, 'drain_outbox', None)
+        if drain_outbox is None:
+            return
+        try:
+            await self._network(drain_outbox)
+        except Not_connected:
+            print("Couldn't connect to drain outbox. Will try again later.")
+        except Exception as e:
+            print("Hit exception while draining outbox. Continuing.")
+            self._log_exception(e)
+
+    async def run_async(self, duration_sec=None):
+        """
+        Run until the tracker is done, or for duration_sec if given
+        """
+        self._stopped = False
+        tasks = [
+            asyncio.create_task(self._warner()),
+            asyncio.create_task(self._uploader()),
+        ]
+        sampler = asyncio.create_task(self._sampler())
+        if duration_sec is None:
+            await sampler
+        else:
+            await asyncio.sleep(duration_sec)
+            self._stopped = True
+            await sampler
+        self._stopped = True
+
+        # Let a warning or upload in flight finish before cancelling. Cancelling would leave
+        # its network call running in the worker thread, and an uploaded batch unacked,
+        # to be uploaded again by whatever the tracker does next.
+        while self._busy:
+            await asyncio.sleep(WORKER_POLL_SEC)
+
+        # The tasks are idle, waiting on their queues. Cancellation is a BaseException,
+        # so it isn't swallowed by the task loops.
+        for task in tasks:
+            task.cancel()
+        return self.stats
+
+    def run(self, duration_sec=None):
+        """
+        Blocking entry point
+        """
+        return asyncio.run(self.run_async(duration_sec))
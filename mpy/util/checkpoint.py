@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Warm-resume checkpoint.
+Once an app has been decided on and its resources set up, what it needs to
+pick up where it left off is written to flash: the app, mode, task and subtask
+GIDs, task name, sheet id, sample count and app-specific state such as warnings.
+On boot main validates it with a single Asana request and resumes straight
+into the app, skipping app discovery and sheet setup.
+"""
+
+import os
+import json
+
+# File the checkpoint is persisted to on flash
+CHECKPOINT_FILE_NAME = 'checkpoint.json'
+
+# Bumped whenever the layout changes, so an old checkpoint is ignored rather than misread
+VERSION = 1
+
+# Fields every checkpoint must have to be resumable
+REQUIRED_FIELDS = ('app', 'mode', 'task_gid', 'subtask_gid', 'task_name', 'sheet_id')
+
+
+def load(file_name=CHECKPOINT_FILE_NAME):
+    """
+    Returns the checkpoint as a dict, or None if there's no usable one
+    """
+    try:
+        with open(file_name, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('version') != VERSION:
+        return None
+    for field in REQUIRED_FIELDS:
+        if field not in state:
+            return None
+    return state
+
+
+def save(state, file_name=CHECKPOINT_FILE_NAME):
+    """
+    Write the checkpoint by writing a temp file and renaming it over the old one,
+    so a reset mid-write leaves the previous checkpoint intact
+    """
+    state['version'] = VERSION
+    with open(file_name + '.tmp', 'w') as f:
+        json.dump(state, f)
+    try:
+        os.rename(file_name + '.tmp', file_name)
+    except OSError:
+        # Some filesystems won't rename over an existing file
+        os.remove(file_name)
+        os.rename(file_name + '.tmp', file_name)
+
+
+def update(file_name=CHECKPOINT_FILE_NAME, **fields):
+    """
+    Merge fields into the existing checkpoint, if there is one
+    """
+    state = load(file_name)
+    if state is None:
+        return
+    state.update(fields)
+    save(state, file_name)
+
+
+def clear(file_name=CHECKPOINT_FILE_NAME):
+    """
+    Remove the checkpoint, e.g. once an app finishes, so the next boot decides afresh
+    """
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
@@ -0,0 +1,208 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Append-only, size-capped diagnostics log on flash.
+
+Typed records (memory, exception, event) are packed into a RAM buffer and
+written out a page at a time, so logging in the hot path doesn't open a
+file or rewrite flash on every step. Exceptions flush straight away, since
+they're the records most likely to be followed by a reset.
+
+Records go into segment files of up to SEGMENT_SIZE bytes in DIR_NAME. Only
+the newest MAX_SEGMENTS are kept, so flash use is capped. Writing always
+resumes in a fresh segment after a reset, in case the last one ends in a torn record.
+
+Record layout: <type:u8><length:u8><unix_time:u32><payload>
+    memory      <mem_free:i32><mem_alloc:i32>
+    exception   UTF-8 traceback, truncated to its last MAX_TEXT_BYTES
+    event       UTF-8 text, truncated to MAX_TEXT_BYTES
+
+Decode a copy of the log on the host with tools/decode_diag_log.py.
+"""
+
+import os
+import struct
+
+import mpy.util.util as util
+
+DIR_NAME = 'diag'
+
+# Size a segment grows to before a new one is started, and how many are kept
+SEGMENT_SIZE = 4096
+MAX_SEGMENTS = 4
+
+# Size of the RAM buffer, written out in one go once full
+PAGE_SIZE = 256
+
+# Longest text kept in an exception or event record
+MAX_TEXT_BYTES = 240
+
+# Record types
+RECORD_MEMORY = 1
+RECORD_EXCEPTION = 2
+RECORD_EVENT = 3
+
+RECORD_NAMES = {
+    RECORD_MEMORY: 'memory',
+    RECORD_EXCEPTION: 'exception',
+    RECORD_EVENT: 'event',
+}
+
+_HEADER_FMT = '<BBI'
+_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
+_MEMORY_FMT = '<ii'
+_SEGMENT_SUFFIX = '.log'
+
+_shared = None
+
+
+def _segment_seqs(dir):
+    """
+    Returns the sequence numbers of all segments in dir, oldest first
+    """
+    seqs = []
+    try:
+        names = os.listdir(dir)
+    except OSError:
+        return seqs
+    for name in names:
+        if name.endswith(_SEGMENT_SUFFIX):
+            seqs.append(int(name[:-len(_SEGMENT_SUFFIX)]))
+    seqs.sort()
+    return seqs
+
+
+def _segment_path(dir, seq):
+    return f'{dir}/{seq:08d}{_SEGMENT_SUFFIX}'
+
+
+class Diag_log:
+    """
+    Buffered writer of typed diagnostics records to rotating segments on flash
+    """
+    def __init__(self, dir=DIR_NAME, segment_size=SEGMENT_SIZE, max_segments=MAX_SEGMENTS):
+        self.dir = dir
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+
+        try:
+            os.mkdir(self.dir)
+        except OSError:
+            pass
+
+        seqs = _segment_seqs(self.dir)
+        self.seq = (seqs[-1] + 1) if seqs else 0
+        self.seq_size = 0
+
+        # Preallocated page buffer. [0, fill) is waiting to be written.
+        self.buf = bytearray(PAGE_SIZE)
+        self.mv = memoryview(self.buf)
+        self.fill = 0
+        self.n_dropped = 0
+
+    def _append(self, record_type, payload):
+        n = _HEADER_SIZE + len(payload)
+        if self.fill + n > PAGE_SIZE:
+            self.flush()
+        struct.pack_into(_HEADER_FMT, self.buf, self.fill, record_type, len(payload), int(util.unix_time()))
+        self.buf[self.fill + _HEADER_SIZE:self.fill + n] = payload
+        self.fill += n
+
+    def memory(self, mem_free=None, mem_alloc=None):
+        """
+        Log free and allocated heap, measuring them now if not given
+        """
+        if mem_free is None:
+            mem_free = util.mem_free()
+        if mem_alloc is None:
+            mem_alloc = util.mem_alloc()
+        self._append(RECORD_MEMORY, struct.pack(_MEMORY_FMT, mem_free, mem_alloc))
+
+    def exception(self, e):
+        """
+        Log an exception with its traceback, and flush right away
+        """
+        # The end of a traceback, with the innermost frame and the message, matters most
+        self._append(RECORD_EXCEPTION, util.format_exception(e).encode()[-MAX_TEXT_BYTES:])
+        self.flush()
+
+    def event(self, text):
+        """
+        Log a short free-form event, e.g. a failed upload
+        """
+        self._append(RECORD_EVENT, text.encode()[:MAX_TEXT_BYTES])
+
+    def flush(self):
+        """
+        Write the buffered records out to the current segment, rotating to a new one when it's full
+        """
+        if not self.fill:
+            return
+        if self.seq_size and self.seq_size + self.fill > self.segment_size:
+            self.seq += 1
+            self.seq_size = 0
+        if not self.seq_size:
+            # Starting a segment, either because the last one filled or after a reset.
+            # Make room first, so a boot loop can't pile up segments.
+            self._rotate()
+        try:
+            with open(_segment_path(self.dir, self.seq), 'ab') as f:
+                f.write(self.mv[:self.fill])
+            self.seq_size += self.fill
+        except OSError as e:
+            # Diagnostics must never take the app down. Count what's lost.
+            self.n_dropped += 1
+            print(f"WARNING: Couldn't write diagnostics log: {e}")
+        self.fill = 0
+
+    def _rotate(self):
+        """
+        Delete the oldest segments so only max_segments remain, counting the one about to be written
+        """
+        seqs = _segment_seqs(self.dir)
+        for seq in seqs[:max(0, len(seqs) + 1 - self.max_segments)]:
+            os.remove(_segment_path(self.dir, seq))
+
+
+def decode(data):
+    """
+    Yields (type name, unix time, value) for each record in the bytes of one segment.
+    value is (mem_free, mem_alloc) for memory records, and text otherwise.
+    Stops at the first torn or unknown record.
+    """
+    pos = 0
+    while pos + _HEADER_SIZE <= len(data):
+        record_type, length, t = struct.unpack_from(_HEADER_FMT, data, pos)
+        pos += _HEADER_SIZE
+        payload = data[pos:pos + length]
+        pos += length
+        if record_type not in RECORD_NAMES or len(payload) < length:
+            return
+        if record_type == RECORD_MEMORY:
+            value = struct.unpack(_MEMORY_FMT, payload)
+        else:
+            value = str(payload, 'utf-8', 'replace')
+        yield RECORD_NAMES[record_type], t, value
+
+
+def read_records(dir=DIR_NAME):
+    """
+    Yields the records of every segment in dir, oldest first
+    """
+    for seq in _segment_seqs(dir):
+        with open(_segment_path(dir, seq), 'rb') as f:
+            data = f.read()
+        for record in decode(data):
+            yield record
+
+
+def get_shared():
+    """
+    Returns the process-wide diagnostics log
+    """
+    global _shared
+    if _shared is None:
+        _shared = Diag_log()
+    return _shared
@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Batched, deduplicated exception reporting.
+
+Each captured exception is fingerprinted from its type and the frames of its
+traceback, so the same fault on every step counts up a single entry rather
+than adding new ones. The table holds at most MAX_ENTRIES fingerprints, with
+counts and first/last-seen times, and is persisted on flash so a reset
+doesn't lose it.
+
+Once per REPORT_INTERVAL_SEC, the trackers post the table as a single digest
+comment on the Hydra exception log task, then start a fresh one.
+"""
+
+import os
+import time
+import json
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+
+import mpy.util.util as util
+
+FILE_NAME = 'exception_digest.json'
+
+# Distinct fingerprints kept between digests. Once full, the least frequent is evicted.
+MAX_ENTRIES = 8
+
+# Post a digest at most this often
+REPORT_INTERVAL_SEC = 6 * 60 * 60
+
+# Repeats of known fingerprints are only persisted this often, to spare flash
+SAVE_INTERVAL_SEC = 10 * 60
+
+# Longest summary line kept per fingerprint
+MAX_SUMMARY_LEN = 120
+
+_shared = None
+
+
+def fingerprint(text):
+    """
+    Fingerprint a formatted traceback by its exception type and frames, ignoring
+    the message, which often holds values that change from one occurrence to the next
+    """
+    lines = [line.strip() for line in text.strip().split('\n')]
+    frames = [line for line in lines if line.startswith('File ')]
+    exc_type = lines[-1].split(':')[0] if lines else ''
+    key = '\n'.join(frames + [exc_type]).encode()
+    return '%08x' % (binascii.crc32(key) & 0xFFFFFFFF)
+
+
+def _format_time(t):
+    tm = time.gmtime(int(t))
+    return '%04d-%02d-%02d %02d:%02d:%02d' % tm[:6]
+
+
+class Exception_digest:
+    """
+    Bounded table of exception fingerprints, with counts and first/last-seen times
+    """
+    def __init__(self, file_name=FILE_NAME, max_entries=MAX_ENTRIES, report_interval_sec=REPORT_INTERVAL_SEC):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.report_interval_sec = report_interval_sec
+
+        # fingerprint -> [count, first_seen, last_seen, summary, innermost frame]
+        self.entries = {}
+        self.n_evicted = 0
+        self.since = None
+        self.last_report = None
+        self.last_save = None
+        self._load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+        try:
+            with open(self.file_name, 'r') as f:
+                state = json.load(f)
+            self.entries = state['entries']
+            self.n_evicted = state['n_evicted']
+            self.since = state['since']
+            self.last_report = state['last_report']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self, now):
+        """
+        Persist the table by writing a temp file and renaming it over the old one
+        """
+        state = {
+            'entries': self.entries,
+            'n_evicted': self.n_evicted,
+            'since': self.since,
+            'last_report': self.last_report,
+        }
+        try:
+            with open(self.file_name + '.tmp', 'w') as f:
+                json.dump(state, f)
+            try:
+                os.rename(self.file_name + '.tmp', self.file_name)
+            except OSError:
+                # Some filesystems won't rename over an existing file
+                os.remove(self.file_name)
+                os.rename(self.file_name + '.tmp', self.file_name)
+            self.last_save = now
+        except OSError as e:
+            print(f"WARNING: Couldn't save exception digest: {e}")
+
+    def capture(self, e, now=None):
+        """
+        Count an exception towards the next digest
+        """
+        if now is None:
+            now = time.time()
+        text = util.format_exception(e)
+        fp = fingerprint(text)
+        if self.since is None:
+            self.since = now
+
+        entry = self.entries.get(fp)
+        if entry is not None:
+            entry[0] += 1
+            entry[2] = now
+            if self.last_save is None or now - self.last_save >= SAVE_INTERVAL_SEC:
+                self._save(now)
+            return
+
+        if len(self.entries) >= self.max_entries:
+            rarest = min(self.entries, key=lambda k: (self.entries[k][0], self.entries[k][2]))
+            del self.entries[rarest]
+            self.n_evicted += 1
+
+        lines = [line.strip() for line in text.strip().split('\n')]
+        frames = [line for line in lines if line.startswith('File ')]
+        self.entries[fp] = [1, now, now, lines[-1][:MAX_SUMMARY_LEN], frames[-1] if frames else '']
+        self._save(now)
+
+    def report_due(self, now=None):
+        """
+        Returns True if there's something to report and the last digest was long enough ago
+        """
+        if not self.entries:
+            return False
+        if now is None:
+            now = time.time()
+        return self.last_report is None or now - self.last_report >= self.report_interval_sec
+
+    def format(self, name=''):
+        """
+        Text of the digest comment, most frequent first
+        """
+        total = sum(entry[0] for entry in self.entries.values())
+        lines = [f"{name} exception digest: {total} exceptions of {len(self.entries)} kinds since {_format_time(self.since)} UTC"]
+        for fp, entry in sorted(self.entries.items(), key=lambda item: -item[1][0]):
+            count, first_seen, last_seen, summary, frame = entry
+            lines.append(f"{count}x {summary}")
+            lines.append(f"    {frame}")
+            lines.append(f"    first {_format_time(first_seen)}, last {_format_time(last_seen)}, id {fp}")
+        if self.n_evicted:
+            lines.append(f"{self.n_evicted} rarer kinds were dropped from the table")
+        return '\n'.join(lines)
+
+    def reported(self, now=None):
+        """
+        Call once a digest has been posted. Starts a fresh table.
+        """
+        if now is None:
+            now = time.time()
+        self.entries = {}
+        self.n_evicted = 0
+        self.since = None
+        self.last_report = now
+        self._save(now)
+
+
+def get_shared():
+    """
+    Returns the process-wide exception digest
+    """
+    global _shared
+    if _shared is None:
+        _shared = Exception_digest()
+    return _shared
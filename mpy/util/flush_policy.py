@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Decides when a tracker's buffered samples are worth an upload.
+Every HTTPS request costs a TLS handshake and radio time, so samples are
+batched until one of the triggers fires:
+    rows     The buffer holds max_rows samples
+    age      The oldest buffered sample is max_age_sec old
+    bytes    The estimated upload payload reaches max_payload_bytes
+    urgent   Something worth reporting right away happened, e.g. a threshold was crossed
+Triggers left as None are disabled.
+"""
+
+# Rough size of one JSON encoded value in an upload, including its separator
+VALUE_BYTES = 12
+
+# Rough per-row overhead of an upload, for the brackets and separator
+ROW_OVERHEAD_BYTES = 3
+
+
+def estimate_row_bytes(columns):
+    """
+    Estimated upload payload bytes for a row laid out by a Sample_store column spec
+    """
+    return len(columns) * VALUE_BYTES + ROW_OVERHEAD_BYTES
+
+
+class Flush_policy:
+    """
+    Size, age and urgency triggers for uploading a Sample_store
+    """
+    def __init__(self, max_rows=None, max_age_sec=None, max_payload_bytes=None):
+        self.max_rows = max_rows
+        self.max_age_sec = max_age_sec
+        self.max_payload_bytes = max_payload_bytes
+        self.urgent = False
+
+        # Urgent marks so far, and as of the batch being uploaded. An upload
+        # only settles the marks made before its batch was taken.
+        self.n_marks = 0
+        self.n_marks_at_batch = 0
+
+    def mark_urgent(self):
+        """
+        Flush at the next check, whatever the size or age of the buffer
+        """
+        self.urgent = True
+        self.n_marks += 1
+
+    def batch_taken(self):
+        """
+        Call when taking a batch for upload
+        """
+        self.n_marks_at_batch = self.n_marks
+
+    def flushed(self):
+        """
+        Call once an upload succeeds. Stays urgent if marked again while the upload was in flight,
+        since what was marked may not be in the batch.
+        """
+        if self.n_marks == self.n_marks_at_batch:
+            self.urgent = False
+
+    def reason(self, buf, now):
+        """
+        Returns the name of the trigger that says buf should be uploaded, or None.
+        now must be on the same clock as the timestamps in buf's first column.
+        """
+        n = len(buf)
+        if not n:
+            return None
+        if self.urgent:
+            return 'urgent'
+        if self.max_rows is not None and n >= self.max_rows:
+            return 'rows'
+        if self.max_payload_bytes is not None and n * estimate_row_bytes(buf.columns) >= self.max_payload_bytes:
+            return 'bytes'
+        if self.max_age_sec is not None and now - buf.row(0)[0] >= self.max_age_sec:
+            return 'age'
+        return None
+
+    def should_flush(self, buf, now):
+        return self.reason(buf, now) is not None
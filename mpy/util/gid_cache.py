@@ -0,0 +1,138 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Small flash-backed key/value cache with per-entry TTL and a size cap.
+Used to remember Asana GIDs (workspace, projects, tasks) across boots,
+since they almost never change and each lookup costs a network round trip.
+"""
+
+import json
+import time
+
+# File the cache is persisted to on flash
+CACHE_FILE_NAME = 'gid_cache.json'
+
+# Default lifetime of a cached entry
+DEFAULT_TTL_SEC = 7 * 24 * 60 * 60
+
+# Maximum number of entries kept before evicting the least recently used
+MAX_ENTRIES = 32
+
+# Index of each field in a stored entry
+_VALUE = 0
+_EXPIRES_AT = 1
+_LAST_USED = 2
+
+
+class Gid_cache:
+    """
+    Flash-backed cache. Each entry is stored as [value, expires_at, last_used].
+    """
+    def __init__(self, file_name=CACHE_FILE_NAME, max_entries=MAX_ENTRIES, default_ttl_sec=DEFAULT_TTL_SEC):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.default_ttl_sec = default_ttl_sec
+        self.hits = 0
+        self.misses = 0
+        self._entries = self._load()
+
+    def _load(self):
+        """
+        Read the cache from flash. A missing or corrupt file is treated as empty.
+        """
+        try:
+            with open(self.file_name, 'r') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                return entries
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _save(self):
+        """
+        Write the cache to flash
+        """
+        try:
+            with open(self.file_name, 'w') as f:
+                json.dump(self._entries, f)
+        except OSError as e:
+            print(f"WARNING: Failed to persist {self.file_name}. Details:")
+            print(e)
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if absent or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        # If the clock went backwards (e.g. RTC reset before NTP sync) we can't
+        # judge the age of the entry, so keep trusting it. A 404 will still evict it.
+        if now > entry[_EXPIRES_AT] and now >= entry[_LAST_USED]:
+            del self._entries[key]
+            self._save()
+            self.misses += 1
+            return None
+
+        entry[_LAST_USED] = now
+        self.hits += 1
+        return entry[_VALUE]
+
+    def put(self, key, value, ttl_sec=None):
+        """
+        Cache value under key for ttl_sec seconds (or the default TTL)
+        """
+        if ttl_sec is None:
+            ttl_sec = self.default_ttl_sec
+        now = time.time()
+        self._entries[key] = [value, now + ttl_sec, now]
+
+        # Evict least recently used entries if we're over the cap
+        while len(self._entries) > self.max_entries:
+            oldest = min(self._entries, key=lambda k: self._entries[k][_LAST_USED])
+            del self._entries[oldest]
+
+        self._save()
+
+    def invalidate(self, key):
+        """
+        Drop the entry for key, if any
+        """
+        if self._entries.pop(key, None) is not None:
+            self._save()
+
+    def invalidate_value(self, value):
+        """
+        Drop every entry that maps to value. Used when a cached GID returns 404.
+        """
+        stale = [k for k, entry in self._entries.items() if entry[_VALUE] == value]
+        for k in stale:
+            del self._entries[k]
+        if stale:
+            self._save()
+
+    def clear(self):
+        """
+        Drop all entries
+        """
+        self._entries = {}
+        self._save()
+
+
+# Cache instance shared by every handler in this process
+_shared = None
+
+def get_shared():
+    """
+    Returns the process-wide cache instance, loading it from flash on first use
+    """
+    global _shared
+    if _shared is None:
+        _shared = Gid_cache()
+    return _shared
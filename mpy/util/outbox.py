@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Priority outbox for outgoing Asana and Sheets operations.
+
+Apps queue operations instead of sending them inline, and drain the outbox
+once the radio is up. Operations go out in priority order: warnings, then
+data, then housekeeping (acknowledgements, task descriptions, diagnostics).
+
+Each drain gets a byte and time budget. Once either is spent, whatever's
+left waits for the next wake, so low-priority writes never hold up a step.
+Warnings are sent regardless of the budget.
+
+A failed operation is retried with exponential backoff, and draining stops
+for this wake, since the network is likely down. Durable operations and
+their retry state are persisted on flash, so they survive a reset or deep
+sleep. Operations that can be rebuilt after a reset, such as a data upload
+whose rows are already in the sample WAL, are queued as not durable.
+
+Operations are (kind, args), args being a JSON-serializable dict. Apps
+register a handler per kind, which returns True once the operation is done.
+"""
+
+import os
+import json
+
+import mpy.util.simple_http_session as session
+import mpy.util.util as util
+
+FILE_NAME = 'outbox.json'
+
+# Priority classes, most urgent first
+PRIORITY_WARNING = 0
+PRIORITY_DATA = 1
+PRIORITY_HOUSEKEEPING = 2
+
+# Bytes sent and received, and milliseconds spent, per drain
+BUDGET_BYTES = 16 * 1024
+BUDGET_MS = 15 * 1000
+
+# Most operations kept. Once full, the oldest of the lowest priority is dropped,
+# unless everything queued is more urgent than the new operation, which is then refused.
+# So a burst of housekeeping can never push out a warning.
+MAX_OPS = 16
+
+# Backoff after a failure doubles from RETRY_BASE_SEC, up to RETRY_MAX_SEC
+RETRY_BASE_SEC = 60
+RETRY_MAX_SEC = 6 * 60 * 60
+
+# Indices into an operation
+_SEQ = 0
+_PRIORITY = 1
+_KIND = 2
+_ARGS = 3
+_KEY = 4
+_DURABLE = 5
+_ATTEMPTS = 6
+_NEXT_TRY = 7
+
+
+class Outbox:
+    """
+    Persistent queue of outgoing operations, drained in priority order within a budget
+    """
+    def __init__(self, file_name=FILE_NAME, budget_bytes=BUDGET_BYTES, budget_ms=BUDGET_MS,
+            max_ops=MAX_OPS, log_exception=util.print_exception):
+        self.file_name = file_name
+        self.budget_bytes = budget_bytes
+        self.budget_ms = budget_ms
+        self.max_ops = max_ops
+        self.log_exception = log_exception
+        self.handlers = {}
+
+        # [seq, priority, kind, args, key, durable, attempts, next_try]
+        self.ops = []
+        self.seq = 0
+        self._load()
+
+    def __len__(self):
+        return len(self.ops)
+
+    def _load(self):
+        try:
+            with open(self.file_name, 'r') as f:
+                self.ops = json.load(f)
+        except (OSError, ValueError):
+            self.ops = []
+        for op in self.ops:
+            self.seq = max(self.seq, op[_SEQ] + 1)
+        if self.ops:
+            print(f"Outbox: recovered {len(self.ops)} unsent operations from flash")
+
+    def _save(self):
+        """
+        Persist the durable operations by writing a temp file and renaming it over the old one
+        """
+        try:
+            with open(self.file_name + '.tmp', 'w') as f:
+                json.dump([op for op in self.ops if op[_DURABLE]], f)
+            try:
+                os.rename(self.file_name + '.tmp', self.file_name)
+            except OSError:
+                # Some filesystems won't rename over an existing file
+                os.remove(self.file_name)
+                os.rename(self.file_name + '.tmp', self.file_name)
+        except OSError as e:
+            print(f"WARNING: Couldn't save outbox: {e}")
+
+    def register(self, kind, handler):
+        """
+        Send operations of this kind with handler(args), which returns True once done
+        """
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind, priority, args=None, key=None, durable=True):
+        """
+        Queue an operation. If key is given, it replaces any queued operation with
+        the same key, keeping its place and retry state.
+        Returns False if the outbox is full of more urgent operations, so this one was refused.
+        """
+        if key is not None:
+            for op in self.ops:
+                if op[_KEY] == key:
+                    op[_PRIORITY] = priority
+                    op[_KIND] = kind
+                    op[_ARGS] = args
+                    if op[_DURABLE]:
+                        self._save()
+                    return True
+
+        dirty = durable
+        if len(self.ops) >= self.max_ops:
+            victim = max(self.ops, key=lambda op: (op[_PRIORITY], -op[_SEQ]))
+            if victim[_PRIORITY] < priority:
+                print(f"Outbox full of more urgent operations. Refusing {kind}")
+                return False
+            print(f"Outbox full. Dropping {victim[_KIND]}")
+            self.ops.remove(victim)
+            dirty = dirty or victim[_DURABLE]
+
+        self.ops.append([self.seq, priority, kind, args, key, durable, 0, 0])
+        self.seq += 1
+        if dirty:
+            self._save()
+        return True
+
+    def pending(self, key):
+        """
+        Returns True if an operation with this key is queued
+        """
+        for op in self.ops:
+            if op[_KEY] == key:
+                return True
+        return False
+
+    def is_due(self, key, now):
+        """
+        Returns True if an operation with this key is queued and not backing off
+        """
+        for op in self.ops:
+            if op[_KEY] == key:
+                return op[_NEXT_TRY] <= now
+        return False
+
+    def retry_now(self, key):
+        """
+        Make a queued operation due now, even if it's backing off, e.g. for a last attempt before exiting
+        """
+        for op in self.ops:
+            if op[_KEY] == key:
+                op[_NEXT_TRY] = 0
+                if op[_DURABLE]:
+                    self._save()
+
+    def _next_due(self, now, max_priority):
+        best = None
+        for op in self.ops:
+            if op[_PRIORITY] > max_priority or op[_NEXT_TRY] > now:
+                continue
+            if best is None or (op[_PRIORITY], op[_SEQ]) < (best[_PRIORITY], best[_SEQ]):
+                best = op
+        return best
+
+    def has_due(self, now, max_priority=PRIORITY_HOUSEKEEPING):
+        """
+        Returns True if an operation of at least this priority is ready to send
+        """
+        return self._next_due(now, max_priority) is not None
+
+    def drain(self, now, max_priority=PRIORITY_HOUSEKEEPING):
+        """
+        Send due operations in priority order until the outbox is empty, the
+        budget is spent or one fails. Needs the radio up. Returns the number sent.
+        """
+        t_start = util.ticks_ms()
+        bytes_start = session.stats['bytes_sent'] + session.stats['bytes_received']
+        n_sent = 0
+        while True:
+            op = self._next_due(now, max_priority)
+            if op is None:
+                break
+
+            if op[_PRIORITY] > PRIORITY_WARNING:
+                spent_bytes = session.stats['bytes_sent'] + session.stats['bytes_received'] - bytes_start
+                spent_ms = util.ticks_diff(util.ticks_ms(), t_start)
+                if spent_bytes >= self.budget_bytes or spent_ms >= self.budget_ms:
+                    print(f"Outbox: budget spent ({spent_bytes} B, {spent_ms} ms). {len(self.ops)} operations wait for the next wake")
+                    break
+
+            handler = self.handlers.get(op[_KIND])
+            if handler is None:
+                print(f"Outbox: no handler for {op[_KIND]}. Dropping it")
+                self._remove(op)
+                continue
+
+            done = False
+            try:
+                done = handler(op[_ARGS])
+            except Exception as e:
+                self.log_exception(e)
+
+            if done:
+                self._remove(op)
+                n_sent += 1
+                continue
+
+            # Back off this operation, and leave the rest for the next wake
+            op[_ATTEMPTS] += 1
+            op[_NEXT_TRY] = now + min(RETRY_BASE_SEC << min(op[_ATTEMPTS] - 1, 16), RETRY_MAX_SEC)
+            print(f"Outbox: {op[_KIND]} failed {op[_ATTEMPTS]} times. Retrying in {op[_NEXT_TRY] - now} sec")
+            if op[_DURABLE]:
+                self._save()
+            break
+
+        return n_sent
+
+    def _remove(self, op):
+        self.ops.remove(op)
+        if op[_DURABLE]:
+            self._save()
@@ -0,0 +1,168 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Lightweight step profiler.
+Wrap a phase of work in a span to record how long it took (ticks_us) and how
+much it allocated (gc.mem_alloc delta):
+
+    with profiler.get_shared().span('append'):
+        ...
+
+The most recent HISTORY_LEN spans of each phase are kept in a fixed-size
+table in RAM. summary_row() condenses the table into a single diagnostics
+row of percentiles, which the trackers upload every REPORT_PERIOD_SEC.
+"""
+
+import array
+
+import mpy.util.util as util
+
+# Phases that are profiled, in the order they appear in a diagnostics row
+PHASES = ('wifi', 'sensor', 'warning', 'jwt', 'append', 'gc')
+
+# Number of recent spans kept per phase
+HISTORY_LEN = 32
+
+# Percentiles summarized per phase in a diagnostics row
+PERCENTILES = (50, 90)
+
+# Upload a diagnostics row at most this often
+REPORT_PERIOD_SEC = 6 * 60 * 60
+
+_shared = None
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a sorted sequence
+    """
+    if not values:
+        return 0
+    k = (len(values) * p + 99) // 100
+    return values[max(0, k - 1)]
+
+
+class Profiler:
+    """
+    Fixed-size table of recent span durations and allocation deltas, per phase
+    """
+    def __init__(self, phases=PHASES, history_len=HISTORY_LEN, report_period_sec=REPORT_PERIOD_SEC):
+        self.phases = phases
+        self.history_len = history_len
+        self.report_period_sec = report_period_sec
+        self.last_report = None
+
+        # Preallocated, so recording a span never allocates
+        self.us = {}
+        self.alloc = {}
+        self.count = {}
+        for phase in phases:
+            self.us[phase] = array.array('l', [0] * history_len)
+            self.alloc[phase] = array.array('l', [0] * history_len)
+            self.count[phase] = 0
+
+    def span(self, phase):
+        """
+        Context manager that records the enclosed work under phase
+        """
+        return _Span(self, phase)
+
+    def record(self, phase, us, alloc):
+        """
+        Record one span. Unknown phases are ignored.
+        """
+        n = self.count.get(phase)
+        if n is None:
+            return
+        i = n % self.history_len
+        self.us[phase][i] = us
+        self.alloc[phase][i] = alloc
+        self.count[phase] = n + 1
+
+    def _recent(self, table, phase):
+        n = min(self.count[phase], self.history_len)
+        return sorted(table[phase][:n])
+
+    def summary(self, phase):
+        """
+        Returns (count, percentiles of us..., max us, max alloc) for phase
+        """
+        us = self._recent(self.us, phase)
+        alloc = self._recent(self.alloc, phase)
+        row = [self.count[phase]]
+        for p in PERCENTILES:
+            row.append(percentile(us, p))
+        row.append(us[-1] if us else 0)
+        row.append(alloc[-1] if alloc else 0)
+        return row
+
+    def header(self, first='POSIX Time'):
+        """
+        Column names matching summary_row()
+        """
+        columns = [first]
+        for phase in self.phases:
+            columns.append(f'{phase} n')
+            for p in PERCENTILES:
+                columns.append(f'{phase} p{p} us')
+            columns.append(f'{phase} max us')
+            columns.append(f'{phase} max alloc')
+        return columns
+
+    def summary_row(self, timestamp):
+        """
+        One diagnostics row: timestamp, then the summary of each phase
+        """
+        row = [timestamp]
+        for phase in self.phases:
+            row.extend(self.summary(phase))
+        return row
+
+    def report_due(self, now):
+        """
+        Returns True if a diagnostics row hasn't been uploaded for report_period_sec.
+        The first period starts at the first check, so there's some history to summarize.
+        """
+        if self.last_report is None:
+            self.last_report = now
+        return now - self.last_report >= self.report_period_sec
+
+    def reported(self, now):
+        """
+        Call once a diagnostics row has been uploaded
+        """
+        self.last_report = now
+
+    def report(self):
+        for phase in self.phases:
+            summary = self.summary(phase)
+            if summary[0]:
+                print(f"Profile {phase}: {summary[0]} spans, p50 {summary[1]} us, p90 {summary[2]} us, "
+                      f"max {summary[3]} us, max alloc {summary[4]} B")
+
+
+class _Span:
+    def __init__(self, profiler, phase):
+        self.profiler = profiler
+        self.phase = phase
+
+    def __enter__(self):
+        self.alloc_start = util.mem_alloc()
+        self.t_start = util.ticks_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        us = util.ticks_diff(util.ticks_us(), self.t_start)
+        self.profiler.record(self.phase, us, util.mem_alloc() - self.alloc_start)
+
+
+def get_shared():
+    """
+    Returns the process-wide profiler
+    """
+    global _shared
+    if _shared is None:
+        _shared = Profiler()
+    return _shared
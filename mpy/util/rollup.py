@@ -0,0 +1,123 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Rollup stage between sampling and upload.
+Raw samples are folded into fixed time windows, and only one row per window
+is logged for upload: the window start, the sample count, then min/max/mean/last
+for each channel. The most recent raw samples are kept in a small ring so they
+can still be reported when a warning fires.
+
+Raw rows are (timestamp, channel, channel, ...), laid out by a Sample_store column spec.
+"""
+
+import mpy.util.sample_store as sample_store
+
+# Aggregates emitted per channel, in column order
+AGGREGATES = ('min', 'max', 'mean', 'last')
+
+# Default number of raw samples kept for warnings
+RAW_HISTORY_ROWS = 16
+
+
+def rollup_columns(columns):
+    """
+    Returns the Sample_store column spec of rollup rows for raw rows laid out as columns
+    """
+    rolled = [sample_store.COLUMN_TIMESTAMP, sample_store.COLUMN_INT]
+    for column in columns[1:]:
+        rolled.extend([column] * len(AGGREGATES))
+    return tuple(rolled)
+
+
+def rollup_header(header):
+    """
+    Returns the sheet header of rollup rows for raw rows labelled by header
+    """
+    rolled = [header[0], 'Samples']
+    for name in header[1:]:
+        rolled.extend([f'{name} {aggregate}' for aggregate in AGGREGATES])
+    return rolled
+
+
+class Rollup:
+    """
+    Folds raw samples into one min/max/mean/last/count row per window
+    """
+    def __init__(self, columns, window_sec, raw_history_rows=RAW_HISTORY_ROWS):
+        self.window_sec = window_sec
+        self.n_channels = len(columns) - 1
+        self.columns = rollup_columns(columns)
+
+        # Running aggregates, reused across windows so adding a sample doesn't allocate
+        self.mins = [0] * self.n_channels
+        self.maxs = [0] * self.n_channels
+        self.sums = [0] * self.n_channels
+        self.lasts = [0] * self.n_channels
+        self.count = 0
+        self.window_start = 0
+
+        self.raw = None
+        if raw_history_rows:
+            self.raw = sample_store.Sample_store(columns, raw_history_rows)
+
+    def add(self, row):
+        """
+        Fold in a raw row. Returns the rollup row of the window it closed, or None.
+        """
+        if self.raw is not None:
+            if self.raw.is_full():
+                self.raw.drop(1)
+            self.raw.append(row)
+
+        timestamp = row[0]
+        window_start = timestamp - timestamp % self.window_sec
+        closed = None
+        if self.count and window_start != self.window_start:
+            closed = self.flush()
+        if not self.count:
+            self.window_start = window_start
+
+        for i in range(self.n_channels):
+            value = row[i + 1]
+            if not self.count:
+                self.mins[i] = value
+                self.maxs[i] = value
+                self.sums[i] = value
+            else:
+                if value < self.mins[i]:
+                    self.mins[i] = value
+                if value > self.maxs[i]:
+                    self.maxs[i] = value
+                self.sums[i] += value
+            self.lasts[i] = value
+        self.count += 1
+
+        return closed
+
+    def flush(self):
+        """
+        Close the current window early. Returns its rollup row, or None if it's empty.
+        """
+        if not self.count:
+            return None
+        row = [self.window_start, self.count]
+        for i in range(self.n_channels):
+            row.append(self.mins[i])
+            row.append(self.maxs[i])
+            row.append(self.sums[i] / self.count)
+            row.append(self.lasts[i])
+        self.count = 0
+        return row
+
+    def recent_raw(self, n=None):
+        """
+        Returns up to n of the most recent raw rows (all kept rows by default), oldest first
+        """
+        if self.raw is None:
+            return []
+        count = len(self.raw)
+        if n is None or n > count:
+            n = count
+        return [self.raw.row(k) for k in range(count - n, count)]
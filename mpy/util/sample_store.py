@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Fixed-capacity, columnar sample buffer.
+
+Each column is a preallocated array, so buffering a sample doesn't allocate
+a fresh list per row and fragment the heap over days of sampling. Samples are
+stored in a ring: new rows go in at the tail, uploaded rows are dropped from the head.
+
+Columns are declared as (typecode, scale) pairs. Values are stored as round(value * scale)
+when scale isn't 1, e.g. ('h', 16) stores temperatures as int16 fixed-point at the
+TMP102's 0.0625 C resolution.
+"""
+
+from array import array
+
+# Column layout shared by trackers
+COLUMN_TIMESTAMP = ('l', 1)
+COLUMN_TEMP = ('h', 16)
+COLUMN_FLOAT = ('f', 1)
+COLUMN_INT = ('l', 1)
+
+
+class Sample_batch:
+    """
+    View of the oldest n rows of a store, as handed to an upload.
+    Iterating yields one row tuple at a time.
+    """
+    def __init__(self, store, n):
+        self.store = store
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        return self.store.iter_rows(self.n)
+
+
+class Sample_store:
+    """
+    Ring buffer of samples with one preallocated array per column
+    """
+    def __init__(self, columns, capacity):
+        self.columns = columns
+        self.capacity = capacity
+        self._data = [array(typecode, [0] * capacity) for typecode, _ in columns]
+        self._scales = [scale for _, scale in columns]
+        self._is_int = [typecode not in 'fd' for typecode, _ in columns]
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def append(self, row):
+        """
+        Store a row of values, one per column. Raises IndexError if full.
+        """
+        if self.count >= self.capacity:
+            raise IndexError('sample store full')
+        i = (self.head + self.count) % self.capacity
+        for col, scale, is_int, value in zip(self._data, self._scales, self._is_int, row):
+            if scale != 1:
+                value = round(value * scale)
+            if is_int:
+                value = int(value)
+            col[i] = value
+        self.count += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def row(self, k):
+        """
+        Returns the k-th oldest row as a tuple of decoded values
+        """
+        i = (self.head + k) % self.capacity
+        return tuple(
+            col[i] / scale if scale != 1 else col[i]
+            for col, scale in zip(self._data, self._scales)
+        )
+
+    def iter_rows(self, n=None):
+        """
+        Yields the n oldest rows (all rows by default), oldest first
+        """
+        if n is None or n > self.count:
+            n = self.count
+        for k in range(n):
+            yield self.row(k)
+
+    def __iter__(self):
+        return self.iter_rows()
+
+    def batch(self, n=None):
+        """
+        Returns a view of the n oldest rows (all rows by default) for upload.
+        Appending more rows doesn't disturb the view.
+        """
+        if n is None or n > self.count:
+            n = self.count
+        return Sample_batch(self, n)
+
+    def drop(self, n):
+        """
+        Drop the n oldest rows, e.g. once they've been uploaded
+        """
+        n = min(n, self.count)
+        self.head = (self.head + n) % self.capacity
+        self.count -= n
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
@@ -0,0 +1,208 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Durable on-flash write-ahead queue for samples that haven't been uploaded yet.
+
+Samples are appended to segment files as CRC-protected records before any upload
+is attempted, and only acknowledged once the upload succeeds. The read position
+of the oldest unacknowledged record is kept in a small ack file. Segments that
+are fully acknowledged are deleted, so flash use tracks the upload backlog.
+
+Record layout: <length:u16><crc32:u32><payload>, payload being the JSON encoded sample.
+A record that is truncated or fails its CRC (e.g. power lost mid-write) marks the
+end of its segment, and writing always resumes in a fresh segment after a reset.
+"""
+
+import os
+import json
+import struct
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+
+# Default size a segment grows to before a new one is started
+SEGMENT_SIZE = 4096
+
+_HEADER_FMT = '<HI'
+_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
+_SEGMENT_SUFFIX = '.seg'
+_ACK_FILE_NAME = 'ack'
+
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+class Sample_wal:
+    """
+    Segment-based, append-only queue of samples on flash
+    """
+    def __init__(self, name, segment_size=SEGMENT_SIZE):
+        self.dir = f'wal_{name}'
+        self.segment_size = segment_size
+
+        if not _exists(self.dir):
+            os.mkdir(self.dir)
+
+        # Position of the oldest unacknowledged record
+        self.ack_seq, self.ack_offset = self._load_ack()
+
+        # Always append to a fresh segment, in case the last one ends in a torn record
+        seqs = self._segment_seqs()
+        self.seq = (seqs[-1] + 1) if seqs else self.ack_seq
+        if self.seq < self.ack_seq:
+            self.seq = self.ack_seq
+        self.seq_size = 0
+
+        # Count what survived from before the reset
+        self.pending = 0
+        for _ in self._iter_records(self.ack_seq, self.ack_offset):
+            self.pending += 1
+
+    def __len__(self):
+        return self.pending
+
+    def _segment_path(self, seq):
+        return f'{self.dir}/{seq:08d}{_SEGMENT_SUFFIX}'
+
+    def _segment_seqs(self):
+        """
+        Returns the sequence numbers of all segments on flash, oldest first
+        """
+        seqs = []
+        for name in os.listdir(self.dir):
+            if name.endswith(_SEGMENT_SUFFIX):
+                seqs.append(int(name[:-len(_SEGMENT_SUFFIX)]))
+        seqs.sort()
+        return seqs
+
+    def _load_ack(self):
+        try:
+            with open(f'{self.dir}/{_ACK_FILE_NAME}', 'r') as f:
+                seq, offset = json.load(f)
+            return seq, offset
+        except (OSError, ValueError):
+            seqs = self._segment_seqs()
+            return (seqs[0] if seqs else 0), 0
+
+    def _save_ack(self):
+        """
+        Persist the ack position by writing a temp file and renaming it over the old one
+        """
+        path = f'{self.dir}/{_ACK_FILE_NAME}'
+        with open(path + '.tmp', 'w') as f:
+            json.dump([self.ack_seq, self.ack_offset], f)
+        try:
+            os.rename(path + '.tmp', path)
+        except OSError:
+            # Some filesystems won't rename over an existing file
+            os.remove(path)
+            os.rename(path + '.tmp', path)
+
+    def _iter_records(self, seq, offset, with_positions=False):
+        """
+        Yields valid records from position (seq, offset) onwards, across segments.
+        With with_positions, yields (record, seq, next_offset) instead.
+        """
+        for s in self._segment_seqs():
+            if s < seq:
+                continue
+            start = offset if s == seq else 0
+            try:
+                f = open(self._segment_path(s), 'rb')
+            except OSError:
+                continue
+            try:
+                f.seek(start)
+                pos = start
+                while True:
+                    header = f.read(_HEADER_SIZE)
+                    if len(header) < _HEADER_SIZE:
+                        break
+                    length, crc = struct.unpack(_HEADER_FMT, header)
+                    payload = f.read(length)
+                    if len(payload) < length or (binascii.crc32(payload) & 0xFFFFFFFF) != crc:
+                        # Torn or corrupt write. Nothing after it in this segment is trusted.
+                        print(f"WARNING: Corrupt record in {self._segment_path(s)} at {pos}")
+                        break
+                    pos += _HEADER_SIZE + length
+                    record = json.loads(payload)
+                    if with_positions:
+                        yield record, s, pos
+                    else:
+                        yield record
+            finally:
+                f.close()
+
+    def append(self, record):
+        """
+        Durably append a record. Returns once it has been written to flash.
+        """
+        payload = json.dumps(record).encode()
+        header = struct.pack(_HEADER_FMT, len(payload), binascii.crc32(payload) & 0xFFFFFFFF)
+
+        if self.seq_size and self.seq_size + len(header) + len(payload) > self.segment_size:
+            self.seq += 1
+            self.seq_size = 0
+
+        with open(self._segment_path(self.seq), 'ab') as f:
+            f.write(header)
+            f.write(payload)
+        self.seq_size += len(header) + len(payload)
+        self.pending += 1
+
+    def read(self, skip=0, limit=None):
+        """
+        Returns up to limit unacknowledged records, oldest first, after skipping the first skip
+        """
+        records = []
+        for i, record in enumerate(self._iter_records(self.ack_seq, self.ack_offset)):
+            if i < skip:
+                continue
+            if limit is not None and len(records) >= limit:
+                break
+            records.append(record)
+        return records
+
+    def ack(self, n):
+        """
+        Acknowledge the n oldest records, then delete segments that are fully acknowledged
+        """
+        if n <= 0:
+            return
+        acked = 0
+        for _, seq, offset in self._iter_records(self.ack_seq, self.ack_offset, with_positions=True):
+            self.ack_seq = seq
+            self.ack_offset = offset
+            acked += 1
+            if acked >= n:
+                break
+        self.pending = max(0, self.pending - acked)
+
+        # Once everything is acknowledged, roll to a new segment so the current one can go too
+        if self.pending == 0 and self.seq_size:
+            self.seq += 1
+            self.seq_size = 0
+        if self.pending == 0:
+            self.ack_seq = self.seq
+            self.ack_offset = 0
+
+        self._save_ack()
+        self.compact()
+
+    def compact(self):
+        """
+        Delete segments that only hold acknowledged records
+        """
+        for seq in self._segment_seqs():
+            if seq >= self.ack_seq:
+                break
+            os.remove(self._segment_path(seq))
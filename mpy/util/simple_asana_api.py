@@ -8,22 +8,33 @@ Exposes only the endpoints required for hydra's applications.
 Only supports personal access token authentication, not client authentication.
 """
 
-try:
-    import urequests as requests
-except:
-    import requests
+import mpy.util.simple_http_session as session
+import mpy.util.stream_json as stream_json
 
 ENDPOINT_BASE = "https://app.asana.com/api/1.0"
 ENDPOINT_ME = "https://app.asana.com/api/1.0/users/me"
 
+# Number of records requested per page by the iter_* functions.
+# Keeps the size of each response, and so peak heap, bounded.
+PAGE_SIZE = 20
+
+class Not_found_error(Exception):
+    """
+    Raised when Asana responds 404, i.e. the requested GID no longer exists
+    """
+    pass
+
 def exception_wrapper(func):
     """
-    Decorator to prevent us from hanging when an exception is raised by urequests
+    Decorator to prevent us from hanging when an exception is raised by the http session.
+    Not_found_error is let through so callers can drop stale GIDs.
     """
     def wrapper(*args, **kwargs):
         try:
             rv = func(*args, **kwargs)
             return rv
+        except Not_found_error:
+            raise
         except BaseException as e:
             print(f"WARNING: Ignoring exception thrown by {func.__name__}. Details:")
             print(e)
@@ -43,41 +54,103 @@ def _build_header(token, content_type=None, accept=None):
 
     return headers
 
+def _fields_params(fields):
+    """
+    Builds the query params that ask Asana to only return the given fields (opt_fields).
+    gid is always returned.
+    """
+    if fields:
+        return {'opt_fields': fields}
+    return None
+
+def _get_data(r, endpoint):
+    """
+    Returns the data field of the response, raising Not_found_error on 404
+    """
+    if r.status_code == 404:
+        r.close()
+        raise Not_found_error(f"404 from {endpoint}")
+    return r.json()['data']
+
+def _select_data(r, endpoint, fields):
+    """
+    Streams the response, materializing only the named fields of its data object.
+    Returns a dict of field name to value, raising Not_found_error on 404.
+    """
+    if r.status_code == 404:
+        r.close()
+        raise Not_found_error(f"404 from {endpoint}")
+    selected = stream_json.select(r, [f'data.{field}' for field in fields])
+    r.close()
+    return {field: selected.get(f'data.{field}') for field in fields}
+
+def _iter_pages(endpoint, token, params=None, page_size=PAGE_SIZE):
+    """
+    Generator that requests endpoint one page at a time using limit/offset,
+    and yields one record at a time. Stops requesting as soon as the caller stops iterating.
+    """
+    headers = _build_header(token)
+    params = dict(params) if params else {}
+    params['limit'] = page_size
+
+    while True:
+        r = session.get(endpoint, headers=headers, params=params)
+        if r.status_code == 404:
+            r.close()
+            raise Not_found_error(f"404 from {endpoint}")
+        page = r.json()
+        r = None
+
+        for record in page['data']:
+            yield record
+
+        next_page = page.get('next_page')
+        page = None
+        if not next_page:
+            return
+        params['offset'] = next_page['offset']
+
 @exception_wrapper
-def get_me(token):
+def get_me(token, fields=None):
     """
     Makes a get request for the personal access token owner's user info and prints the response
     """
-    data = {}
     headers = _build_header(token)
 
-    return requests.get(ENDPOINT_ME, data=data, headers=headers).json()['data']
+    return _get_data(session.get(ENDPOINT_ME, headers=headers, params=_fields_params(fields)), ENDPOINT_ME)
+
+def iter_projects_for_workspace(workspace_gid, token, fields=None):
+    """
+    Yields the projects in the specified workspace one at a time, fetching a page at a time
+    """
+    endpoint = ENDPOINT_BASE + f"/workspaces/{workspace_gid}/projects"
+    return _iter_pages(endpoint, token, _fields_params(fields))
 
 @exception_wrapper
-def get_projects_for_workspace(workspace_gid, token):
+def get_projects_for_workspace(workspace_gid, token, fields=None):
     """
     Makes a get request for the list of projects in the specified workspace
     """
-    endpoint = ENDPOINT_BASE + f"/workspaces/{workspace_gid}/projects"
-    data = {}
-    headers = _build_header(token)
+    return list(iter_projects_for_workspace(workspace_gid, token, fields))
 
-    return requests.get(endpoint, data=data, headers=headers).json()['data']
+def iter_tasks_for_project(project_gid, token, fields=None):
+    """
+    Yields the tasks in the specified project one at a time, fetching a page at a time
+    """
+    endpoint = ENDPOINT_BASE + f"/projects/{project_gid}/tasks"
+    return _iter_pages(endpoint, token, _fields_params(fields))
 
 @exception_wrapper
-def get_tasks_for_project(project_gid, token):
+def get_tasks_for_project(project_gid, token, fields=None):
     """
     Makes a get request for the list of tasks in the specified project
     """
-    endpoint = ENDPOINT_BASE + f"/projects/{project_gid}/tasks"
-    data = {}
-    headers = _build_header(token)
-
-    return requests.get(endpoint, data=data, headers=headers).json()['data']
+    return list(iter_tasks_for_project(project_gid, token, fields))
 
-def update_task(task_gid, token, params):
+def update_task(task_gid, token, params, fields=None):
     """
-    Makes a put request to update the parameters of the specified task
+    Makes a put request to update the parameters of the specified task.
+    Only the requested fields of the updated task are returned.
     """
     endpoint = ENDPOINT_BASE + f"/tasks/{task_gid}"
     data = {
@@ -89,11 +162,13 @@ def update_task(task_gid, token, params):
         accept='application/json'
     )
 
-    return requests.put(endpoint, json=data, headers=headers).json()['data']
+    return _get_data(session.put(endpoint, json=data, headers=headers, params=_fields_params(fields)), endpoint)
 
-def get_task(task_gid, token, fields=None):
+def get_task(task_gid, token, fields=None, paths=None):
     """
-    Makes a get request to get the parameters of the specified task
+    Makes a get request to get the parameters of the specified task.
+    paths optionally selects different key paths of the data object than fields,
+    e.g. 'parent.memberships' to get the whole list that nested fields were requested in.
     """
     endpoint = ENDPOINT_BASE + f"/tasks/{task_gid}"
     headers = _build_header(
@@ -102,16 +177,15 @@ def get_task(task_gid, token, fields=None):
         accept='application/json'
     )
     if fields:
-        data = {
-            'fields': fields
-        }
-        return requests.get(endpoint, json=data, headers=headers).json()['data']
+        r = session.get(endpoint, headers=headers, params=_fields_params(fields))
+        return _select_data(r, endpoint, paths or fields)
     else:
-        return requests.get(endpoint, headers=headers).json()['data']
+        return _get_data(session.get(endpoint, headers=headers), endpoint)
 
-def add_comment_on_task(task_gid, token, params):
+def add_comment_on_task(task_gid, token, params, fields=None):
     """
     Adds a comment to the task. It will be authored by the authenticated user.
+    Only the requested fields of the new story are returned.
     """
     endpoint = ENDPOINT_BASE + f"/tasks/{task_gid}/stories"
     data = {
@@ -122,34 +196,65 @@ def add_comment_on_task(task_gid, token, params):
         content_type='application/json',
         accept='application/json'
     )
-    return requests.post(endpoint, json=data, headers=headers).json()['data']
+    return _get_data(session.post(endpoint, json=data, headers=headers, params=_fields_params(fields)), endpoint)
 
-def get_sections_for_project(project_gid, token):
+def iter_sections_for_project(project_gid, token, fields=None):
     """
-    Gets the list of sections in the specified project
+    Yields the sections in the specified project one at a time, fetching a page at a time
     """
     endpoint = ENDPOINT_BASE + f"/projects/{project_gid}/sections"
-    data = {}
-    headers = _build_header(token)
+    return _iter_pages(endpoint, token, _fields_params(fields))
 
-    return requests.get(endpoint, data=data, headers=headers).json()['data']
+def get_sections_for_project(project_gid, token, fields=None):
+    """
+    Gets the list of sections in the specified project
+    """
+    return list(iter_sections_for_project(project_gid, token, fields))
 
-def get_tasks_for_section(section_gid, token):
+def iter_tasks_for_section(section_gid, token, fields=None):
     """
-    Gets the list of tasks in the specified section
+    Yields the tasks in the specified section one at a time, fetching a page at a time
     """
     endpoint = ENDPOINT_BASE + f"/sections/{section_gid}/tasks"
-    data = {}
-    headers = _build_header(token)
+    return _iter_pages(endpoint, token, _fields_params(fields))
+
+def get_tasks_for_section(section_gid, token, fields=None):
+    """
+    Gets the list of tasks in the specified section
+    """
+    return list(iter_tasks_for_section(section_gid, token, fields))
 
-    return requests.get(endpoint, data=data, headers=headers).json()['data']
+def iter_subtasks_for_task(task_gid, token, fields=None):
+    """
+    Yields the subtasks of the specified task one at a time, fetching a page at a time
+    """
+    endpoint = ENDPOINT_BASE + f"/tasks/{task_gid}/subtasks"
+    return _iter_pages(endpoint, token, _fields_params(fields))
 
-def get_subtasks_for_task(task_gid, token):
+def get_subtasks_for_task(task_gid, token, fields=None):
     """
     Gets the list of subtasks in the specified task
     """
-    endpoint = ENDPOINT_BASE + f"/tasks/{task_gid}/subtasks"
-    data = {}
-    headers = _build_header(token)
+    return list(iter_subtasks_for_task(task_gid, token, fields))
+
+def iter_tasks_for_assignee(workspace_gid, token, assignee='me', fields=None, completed_since='now'):
+    """
+    Yields the incomplete tasks (including subtasks) assigned to assignee in the specified workspace.
+    Filtering happens server side, so the number of requests doesn't grow with project size.
+    """
+    endpoint = ENDPOINT_BASE + "/tasks"
+    params = {
+        'assignee': assignee,
+        'workspace': workspace_gid,
+        'completed_since': completed_since,
+    }
+    if fields:
+        params.update(_fields_params(fields))
+    return _iter_pages(endpoint, token, params)
 
-    return requests.get(endpoint, data=data, headers=headers).json()['data']
+@exception_wrapper
+def get_tasks_for_assignee(workspace_gid, token, assignee='me', fields=None, completed_since='now'):
+    """
+    Gets the list of incomplete tasks (including subtasks) assigned to assignee in the specified workspace.
+    """
+    return list(iter_tasks_for_assignee(workspace_gid, token, assignee, fields, completed_since))
@@ -12,6 +12,7 @@ import sys
 
 import mpy.secrets as secrets
 import mpy.util.simple_asana_api as api
+import mpy.util.gid_cache as gid_cache
 import mpy.hal.config as cfg
 
 IS_LINUX = (sys.platform == 'linux')
@@ -24,6 +25,7 @@ class Simple_asana_handler:
     Simple wrapper for sending HTTP requests to Asana API
     """
     token = ''
+    workspace_gid = ''
     brew_project_gid = ''
     active_task_gid = ''
     jwt_task_gid = ''
@@ -36,6 +38,28 @@ class Simple_asana_handler:
     TASK_NAME_JWT_STORE = 'Hydra Gsheets JWT Store'
     TASK_NAME_EXCEPTION_LOG = 'Hydra exception log'
 
+    # Fields each request actually consumes, passed as opt_fields so
+    # Asana only sends (and we only parse) what we need
+    FIELDS_ME = ['workspaces.name']
+    FIELDS_NAME = ['name']
+    FIELDS_NOTES = ['notes']
+    # Writes only need an acknowledgement, gid is always returned
+    FIELDS_ACK = ['gid']
+    # Needed to place an assigned subtask in a section of the brew project
+    FIELDS_ASSIGNED_SUBTASK = [
+        'name',
+        'parent.name',
+        'parent.memberships.project.gid',
+        'parent.memberships.section.name',
+    ]
+    # Needed to check a resume checkpoint's subtask is still open and in the same section
+    FIELDS_CHECKPOINT = [
+        'completed',
+        'parent.memberships.project.gid',
+        'parent.memberships.section.name',
+    ]
+    PATHS_CHECKPOINT = ['completed', 'parent.memberships']
+
     # Mapping between Asana section names and app that should handle them
     app_map = {
         'Planned': 'coldcrash_tracker',
@@ -48,18 +72,22 @@ class Simple_asana_handler:
         if IS_LINUX:
             self.name = cfg.HYDRA_NAME_MAP['unix']
         else:
-            self.name = cfg.HYDRA_NAME_MAP[wifi.MAC]
+            self.name = cfg.NAME
 
             # Make sure we're connected
             wifi.connect_with_retry()
 
+        # GIDs rarely change, so resolve them through the flash-backed cache
+        self.cache = gid_cache.get_shared()
+
         # Store personal access token
         if token:
             self.token = token
         else:
             self.token = secrets.get_secrets()[f'asana_personal_access_token_{self.name}']
 
-        # Fetch and store brewing project GID
+        # Fetch and store workspace and brewing project GID
+        self.workspace_gid = self.get_personal_projects_gid()
         self.brew_project_gid = self.get_personal_project_gid_by_name(self.PROJECT_NAME_BREW)
 
         # Fetch and store relevant task GIDs
@@ -75,13 +103,39 @@ class Simple_asana_handler:
         self.jwt_task_gid = self.get_task_gid_by_name(self.TASK_NAME_JWT_STORE)
         self.exception_log_task_gid = self.get_task_gid_by_name(self.TASK_NAME_EXCEPTION_LOG)
 
+    def _cache_key(self, *parts):
+        """
+        Builds a gid cache key scoped to this device
+        """
+        return '|'.join((self.name,) + parts)
+
+    def _with_cached_gid(self, attr, resolve, func):
+        """
+        Calls func with the gid stored in self.<attr>.
+        If Asana no longer knows that gid, drops it from the cache,
+        re-resolves it with resolve() and tries once more.
+        """
+        try:
+            return func(getattr(self, attr))
+        except api.Not_found_error:
+            print(f"Cached {attr} is stale. Re-resolving.")
+            self.cache.invalidate_value(getattr(self, attr))
+            setattr(self, attr, resolve())
+            return func(getattr(self, attr))
+
     def get_personal_projects_gid(self):
         """
         Returns the gid for the personal projects workspace of the authenticated user
         """
+        key = self._cache_key('workspace', self.WORKSPACE_NAME)
+        gid = self.cache.get(key)
+        if gid:
+            return gid
+
         gc.collect()
-        me = api.get_me(self.token)
+        me = api.get_me(self.token, fields=self.FIELDS_ME)
         personal_projects = next(workspace for workspace in me['workspaces'] if workspace['name'] == self.WORKSPACE_NAME)
+        self.cache.put(key, personal_projects['gid'])
         return personal_projects['gid']
 
     def get_personal_project_gid_by_name(self, name):
@@ -89,34 +143,64 @@ class Simple_asana_handler:
         Returns the gid for the personal project specified by name (string).
         Returns False if failed to fetch it
         """
+        key = self._cache_key('project', name)
+        gid = self.cache.get(key)
+        if gid:
+            return gid
+
         # Get personal projects workspace
         pp_gid = self.get_personal_projects_gid()
 
-        # Get all the projects in that workspace
+        # Page through the projects in that workspace until we find it
         gc.collect()
-        projects = api.get_projects_for_workspace(workspace_gid=pp_gid, token=self.token)
-
-        if not projects:
-            return False
-
-        # Get and return the specified project
-        target_project = next(project for project in projects if project['name'] == name)
-        return target_project['gid']
+        try:
+            gid = self._find_gid_by_name(api.iter_projects_for_workspace(pp_gid, self.token, self.FIELDS_NAME), name)
+        except api.Not_found_error:
+            self.cache.invalidate_value(pp_gid)
+            pp_gid = self.get_personal_projects_gid()
+            gid = self._find_gid_by_name(api.iter_projects_for_workspace(pp_gid, self.token, self.FIELDS_NAME), name)
+
+        if gid:
+            self.cache.put(key, gid)
+        return gid
+
+    def _find_gid_by_name(self, records, name):
+        """
+        Returns the gid of the first record named name, without pulling any
+        more pages than needed. Returns False if there is no match or the fetch fails.
+        """
+        try:
+            for record in records:
+                if record['name'] == name:
+                    return record['gid']
+        except api.Not_found_error:
+            raise
+        except BaseException as e:
+            print(f"WARNING: Failed to look up {name}. Details:")
+            print(e)
+        return False
 
     def get_task_gid_by_name(self, name):
         """
         Returns the gid for the named task
         Returns False if failed to fetch it
         """
-        gc.collect()
-        tasks = api.get_tasks_for_project(project_gid=self.brew_project_gid, token=self.token)
+        key = self._cache_key('task', str(self.brew_project_gid), name)
+        gid = self.cache.get(key)
+        if gid:
+            return gid
 
-        if not tasks:
-            return False
+        # Page through the project's tasks, stopping at the first match
+        gc.collect()
+        gid = self._with_cached_gid(
+            'brew_project_gid',
+            lambda: self.get_personal_project_gid_by_name(self.PROJECT_NAME_BREW),
+            lambda project_gid: self._find_gid_by_name(api.iter_tasks_for_project(project_gid, self.token, self.FIELDS_NAME), name)
+        )
 
-        # Get and return specified task
-        named_task = next(task for task in tasks if task['name'] == name)
-        return named_task['gid']
+        if gid:
+            self.cache.put(self._cache_key('task', str(self.brew_project_gid), name), gid)
+        return gid
 
     def get_sandbox_task_gid(self):
         """
@@ -132,7 +216,7 @@ class Simple_asana_handler:
         Returns the description on the active task
         """
         gc.collect()
-        return api.get_task(task_gid=self.active_task_gid, token=self.token, fields=['notes'])['notes']
+        return api.get_task(task_gid=self.active_task_gid, token=self.token, fields=self.FIELDS_NOTES)['notes']
 
     def update_active_task_description(self, desc):
         """
@@ -145,7 +229,25 @@ class Simple_asana_handler:
             self.active_task_gid = self.get_sandbox_task_gid()
 
         gc.collect()
-        return api.update_task(task_gid=self.active_task_gid, token=self.token, params=params)
+        return api.update_task(task_gid=self.active_task_gid, token=self.token, params=params, fields=self.FIELDS_ACK)
+
+    def update_task_description(self, task_gid, desc):
+        """
+        Updates the description on the given task, or the sandbox task if None
+        """
+        if not task_gid:
+            task_gid = self.get_sandbox_task_gid()
+        gc.collect()
+        return api.update_task(task_gid=task_gid, token=self.token, params={'notes': desc}, fields=self.FIELDS_ACK)
+
+    def add_comment_on_task(self, task_gid, text):
+        """
+        Adds a comment on the given task, or the sandbox task if None
+        """
+        if not task_gid:
+            task_gid = self.get_sandbox_task_gid()
+        gc.collect()
+        return api.add_comment_on_task(task_gid=task_gid, token=self.token, params={'text': text}, fields=self.FIELDS_ACK)
 
     def add_comment_on_active_task(self, text, is_pinned=False):
         """
@@ -159,7 +261,7 @@ class Simple_asana_handler:
         if not self.active_task_gid:
             self.active_task_gid = self.get_sandbox_task_gid()
         gc.collect()
-        return api.add_comment_on_task(task_gid=self.active_task_gid, token=self.token, params=params)
+        return api.add_comment_on_task(task_gid=self.active_task_gid, token=self.token, params=params, fields=self.FIELDS_ACK)
 
     def add_comment_on_active_subtask(self, text, is_pinned=False):
         """
@@ -173,7 +275,7 @@ class Simple_asana_handler:
         if not self.active_subtask_gid:
             self.active_subtask_gid = self.get_sandbox_subtask_gid()
         gc.collect()
-        return api.add_comment_on_task(task_gid=self.active_subtask_gid, token=self.token, params=params)
+        return api.add_comment_on_task(task_gid=self.active_subtask_gid, token=self.token, params=params, fields=self.FIELDS_ACK)
 
     def get_jwt(self):
         """
@@ -183,7 +285,11 @@ class Simple_asana_handler:
             self.jwt_task_gid = self.get_task_gid_by_name(self.TASK_NAME_JWT_STORE)
 
         gc.collect()
-        r = api.get_task(task_gid=self.jwt_task_gid, token=self.token)
+        r = self._with_cached_gid(
+            'jwt_task_gid',
+            lambda: self.get_task_gid_by_name(self.TASK_NAME_JWT_STORE),
+            lambda gid: api.get_task(task_gid=gid, token=self.token, fields=self.FIELDS_NOTES)
+        )
 
         return r['notes']
 
@@ -197,7 +303,11 @@ class Simple_asana_handler:
         if not self.jwt_task_gid:
             self.jwt_task_gid = self.get_task_gid_by_name(self.TASK_NAME_JWT_STORE)
         gc.collect()
-        return api.update_task(task_gid=self.jwt_task_gid, token=self.token, params=params)
+        return self._with_cached_gid(
+            'jwt_task_gid',
+            lambda: self.get_task_gid_by_name(self.TASK_NAME_JWT_STORE),
+            lambda gid: api.update_task(task_gid=gid, token=self.token, params=params, fields=self.FIELDS_ACK)
+        )
 
     def update_exception_log(self, msg):
         """
@@ -209,7 +319,11 @@ class Simple_asana_handler:
         if not self.exception_log_task_gid:
             self.exception_log_task_gid = self.get_sandbox_task_gid()
         gc.collect()
-        return api.add_comment_on_task(task_gid=self.exception_log_task_gid, token=self.token, params=params)
+        return self._with_cached_gid(
+            'exception_log_task_gid',
+            lambda: self.get_task_gid_by_name(self.TASK_NAME_EXCEPTION_LOG),
+            lambda gid: api.add_comment_on_task(task_gid=gid, token=self.token, params=params, fields=self.FIELDS_ACK)
+        )
 
     def get_section_gid_by_name(self, name):
         """
@@ -217,51 +331,112 @@ class Simple_asana_handler:
         Returns False if failed to fetch it
         """
         gc.collect()
-        tasks = api.get_sections_for_project(project_gid=self.brew_project_gid, token=self.token)
-
-        if not tasks:
-            return False
-
-        # Get and return specified task
-        active_task = next(task for task in tasks if task['name'] == name)
-        return active_task['gid']
+        return self._with_cached_gid(
+            'brew_project_gid',
+            lambda: self.get_personal_project_gid_by_name(self.PROJECT_NAME_BREW),
+            lambda gid: self._find_gid_by_name(api.iter_sections_for_project(gid, self.token, self.FIELDS_NAME), name)
+        )
 
     def get_tasks_for_section(self, section_gid):
         """
         Returns a list of tasks in the specified section
         """
         gc.collect()
-        return api.get_tasks_for_section(section_gid, self.token)
+        return api.get_tasks_for_section(section_gid, self.token, self.FIELDS_NAME)
 
     def get_subtasks_for_task(self, task_gid):
         """
         Returns a list of subtasks in the specified task
         """
         gc.collect()
-        return api.get_subtasks_for_task(task_gid, self.token)
+        return api.get_subtasks_for_task(task_gid, self.token, self.FIELDS_NAME)
+
+    def get_assigned_subtasks(self):
+        """
+        Returns a dict mapping section name to a list of (subtask_gid, task_gid, task_name)
+        for every incomplete subtask assigned to the authenticated user, whose parent
+        task lives in the brew project. Uses a single server-filtered query.
+        """
+        gc.collect()
+        return self._with_cached_gid(
+            'workspace_gid',
+            self.get_personal_projects_gid,
+            lambda gid: self._group_assigned_subtasks(
+                api.iter_tasks_for_assignee(gid, self.token, fields=self.FIELDS_ASSIGNED_SUBTASK)
+            )
+        )
+
+    def _group_assigned_subtasks(self, subtasks):
+        """
+        Groups an iterable of assigned tasks by the brew project section of their parent
+        """
+        assigned = {}
+        for subtask in subtasks:
+            parent = subtask.get('parent')
+            if not parent:
+                continue
+            for membership in parent.get('memberships') or []:
+                project = membership.get('project') or {}
+                section = membership.get('section') or {}
+                if project.get('gid') == self.brew_project_gid and section.get('name'):
+                    assigned.setdefault(section['name'], []).append(
+                        (subtask['gid'], parent['gid'], parent.get('name'))
+                    )
+
+        return assigned
 
     def find_assigned_subtask_in_section(self, section_name):
         """
         Finds a subtask assigned to authenticated user in the named section.
         Returns the first match, or None if no matches
         """
-        section_gid = self.get_section_gid_by_name(section_name)
-        tasks = self.get_tasks_for_section(section_gid)
+        matches = self.get_assigned_subtasks().get(section_name)
+        if matches:
+            return matches[0]
+        return None
 
-        for task in tasks:
-            subtasks = self.get_subtasks_for_task(task['gid'])
+    def _app_for_section(self, section):
+        """
+        Returns the (app, mode) that handles the named section, or None
+        """
+        app = self.app_map.get(section)
+        if app is None:
+            return None
+        if app == 'fermentation_tracker':
+            mode = section.split('In ')[1]
+        else:
+            mode = section
+        return (app, mode)
 
-            for subtask in subtasks:
-                gc.collect()
-                subtask_info = api.get_task(subtask['gid'], self.token, fields=['assignee'])
-                try:
-                    assignee = subtask_info['assignee']['name']
-                    if assignee == self.name:
-                        return (subtask['gid'], task['gid'], task['name'])
-                except TypeError:
-                    pass
+    def validate_checkpoint(self, state):
+        """
+        Checks a resume checkpoint with a single request: its subtask must still be
+        incomplete, with its parent task in a brew project section that maps to the
+        same app and mode. Returns True if it's safe to resume.
+        """
+        gc.collect()
+        try:
+            task = api.get_task(
+                task_gid=state['subtask_gid'],
+                token=self.token,
+                fields=self.FIELDS_CHECKPOINT,
+                paths=self.PATHS_CHECKPOINT
+            )
+        except api.Not_found_error:
+            print("Checkpoint subtask no longer exists")
+            return False
 
-        return None
+        if task.get('completed') != False:
+            print("Checkpoint subtask is complete")
+            return False
+        for membership in task.get('parent.memberships') or []:
+            project = membership.get('project') or {}
+            section = membership.get('section') or {}
+            if project.get('gid') == self.brew_project_gid:
+                if self._app_for_section(section.get('name')) == (state['app'], state['mode']):
+                    return True
+        print("Checkpoint subtask has moved section")
+        return False
 
     def decide_on_app(self):
         """
@@ -271,16 +446,14 @@ class Simple_asana_handler:
         If found:
             Returns tuple of app, subtask_gid, task_name
         If none found, returns None.
+        The app acknowledges the subtask itself, through its outbox.
         """
+        assigned = self.get_assigned_subtasks()
         for section, app in self.app_map.items():
-            r = self.find_assigned_subtask_in_section(section)
+            r = assigned.get(section)
             if r:
-                subtask_gid, task_gid, task_name = r
-                api.add_comment_on_task(task_gid=subtask_gid, token=self.token, params={'text': 'On it!'})
-                if app == 'fermentation_tracker':
-                    mode = section.split('In ')[1]
-                else:
-                    mode = section
+                subtask_gid, task_gid, task_name = r[0]
+                app, mode = self._app_for_section(section)
                 print(f"Decided on {app} with mode {mode}")
                 return (app, mode, subtask_gid, task_gid, task_name)
 
@@ -8,13 +8,16 @@ Exposes only the endpoints required for hydra's applications.
 Only supports personal access token authentication, not client authentication.
 """
 
-import urequests as requests
+import json
+
+import mpy.util.simple_http_session as session
+import mpy.util.stream_json as stream_json
 
 ENDPOINT_BASE = "https://sheets.googleapis.com/v4/spreadsheets"
 
 def exception_wrapper(func):
     """
-    Decorator to prevent us from hanging when an exception is raised by urequests
+    Decorator to prevent us from hanging when an exception is raised by the http session
     """
     def wrapper(*args, **kwargs):
         try:
@@ -39,38 +42,58 @@ def _build_header(token, content_type=None, accept=None):
 
     return headers
 
+def _encode_values(values):
+    """
+    Serializes any iterable of rows into a {"values": [...]} request body,
+    one row at a time, so callers don't need to build a list of lists first
+    """
+    parts = [b'{"values":[']
+    for i, row in enumerate(values):
+        if i:
+            parts.append(b',')
+        parts.append(json.dumps(row).encode())
+    parts.append(b']}')
+    return b''.join(parts)
+
+def _fields_params(fields, **params):
+    """
+    Builds query params, adding a fields mask so Google only
+    returns (and we only parse) the fields the caller consumes
+    """
+    if fields:
+        params['fields'] = fields
+    return params
+
 @exception_wrapper
-def get_range(token, sheet_id, sheet_name, cell_range):
+def get_range(token, sheet_id, sheet_name, cell_range, fields=None):
     """
     Returns content from the specified cell_range of the specified sheet
     """
     headers = _build_header(token, content_type='application/json')
     endpoint = f'{ENDPOINT_BASE}/{sheet_id}/values/{sheet_name}!{cell_range}'
-    r = requests.get(endpoint, headers=headers)
+    r = session.get(endpoint, headers=headers, params=_fields_params(fields))
     return r.json()
 
-def update_range(token, sheet_id, sheet_name, cell_range, values):
+def update_range(token, sheet_id, sheet_name, cell_range, values, fields=None):
     """
-    Updates the specified cell_range of the specified sheet
+    Updates the specified cell_range of the specified sheet.
+    Written values are not echoed back in the response.
     """
     headers = _build_header(token, content_type='application/json')
-    endpoint = f'{ENDPOINT_BASE}/{sheet_id}/values/{sheet_name}!{cell_range}?valueInputOption=RAW'
-    body = {
-        "values": values
-    }
-    r = requests.put(endpoint, headers=headers, json=body)
+    endpoint = f'{ENDPOINT_BASE}/{sheet_id}/values/{sheet_name}!{cell_range}'
+    params = _fields_params(fields, valueInputOption='RAW', includeValuesInResponse=False)
+    r = session.put(endpoint, headers=headers, data=_encode_values(values), params=params)
     return r.json()
 
-def append_range(token, sheet_id, sheet_name, cell_range, values):
+def append_range(token, sheet_id, sheet_name, cell_range, values, fields=None):
     """
-    Updates the specified cell_range of the specified sheet
+    Updates the specified cell_range of the specified sheet.
+    Appended values are not echoed back in the response.
     """
     headers = _build_header(token, content_type='application/json')
-    endpoint = f'{ENDPOINT_BASE}/{sheet_id}/values/{sheet_name}!{cell_range}:append?valueInputOption=RAW'
-    body = {
-        "values": values
-    }
-    r = requests.post(endpoint, headers=headers, json=body)
+    endpoint = f'{ENDPOINT_BASE}/{sheet_id}/values/{sheet_name}!{cell_range}:append'
+    params = _fields_params(fields, valueInputOption='RAW', includeValuesInResponse=False)
+    r = session.post(endpoint, headers=headers, data=_encode_values(values), params=params)
     return r.json()
 
 @exception_wrapper
@@ -93,12 +116,15 @@ def create_spreadsheet(token, title):
         "sheets": [
         ],
     }
-    r = requests.post(endpoint, headers=headers, json=body)
+    r = session.post(endpoint, headers=headers, json=body, params=_fields_params('spreadsheetId'))
 
-    return r.json()['spreadsheetId']
+    # Only the id is requested, but stream it in case the mask is ignored
+    sheet_id = stream_json.select(r, ['spreadsheetId'])['spreadsheetId']
+    r.close()
+    return sheet_id
 
 @exception_wrapper
-def copy_sheet(token, from_id, to_id, gid):
+def copy_sheet(token, from_id, to_id, gid, fields=None):
     """
     Copies a single sheet (gid) from within one spreadsheet (from_id)
     to another spreadsheet (to_id)
@@ -108,22 +134,26 @@ def copy_sheet(token, from_id, to_id, gid):
     body = {
         "destinationSpreadsheetId": to_id
     }
-    r = requests.post(endpoint, headers=headers, json=body)
+    r = session.post(endpoint, headers=headers, json=body, params=_fields_params(fields))
     return r.json()
 
-def get_spreadsheet(token, id, fields=None):
+def get_spreadsheet(token, id, fields=None, paths=None):
     """
-    Returns a spreadsheet object for the spreadsheet with the specified id
+    Returns a spreadsheet object for the spreadsheet with the specified id.
+    If paths is given, the response is streamed and only those paths are
+    materialized, returned as a dict of path to value (see stream_json).
     """
     headers = _build_header(token, content_type='application/json')
     endpoint = f"{ENDPOINT_BASE}/{id}"
-    if fields:
-        endpoint = endpoint + f'?fields={fields}'
-    r = requests.get(endpoint, headers=headers)
+    r = session.get(endpoint, headers=headers, params=_fields_params(fields))
+    if paths:
+        selected = stream_json.select(r, paths)
+        r.close()
+        return selected
     return r.json()
 
 @exception_wrapper
-def batch_update(token, id, body):
+def batch_update(token, id, body, fields=None):
     """
     Performs a batch update on the specified spreadsheet.
     Caller is responsible for building up the body.
@@ -131,5 +161,5 @@ def batch_update(token, id, body):
     """
     headers = _build_header(token, content_type='application/json')
     endpoint = f"{ENDPOINT_BASE}/{id}:batchUpdate"
-    r = requests.post(endpoint, headers=headers, json=body)
+    r = session.post(endpoint, headers=headers, json=body, params=_fields_params(fields))
     return r.json()
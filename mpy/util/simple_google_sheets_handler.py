@@ -9,12 +9,20 @@ and sending them to the simple API
 
 import time
 import gc
+import json
 
-import urequests as requests
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+
+import mpy.util.simple_http_session as session
 
 import mpy.secrets as secrets
 import mpy.util.simple_google_sheets_api as api
 import mpy.util.simple_asana_handler as asana
+import mpy.util.util as util
+import mpy.util.profiler as profiler
 
 import sys
 IS_LINUX = (sys.platform == 'linux')
@@ -26,27 +34,50 @@ class Simple_google_handler:
     Simple wrapper for sending HTTP requests to Google API
     """
 
+    # Default header row, for callers that don't pass their own column layout
     HEADER = ['POSIX Time', 'Temp (C)', 'Light (Lux)']
 
     SHEET_URI = 'https://docs.google.com/spreadsheets/d'
 
     header_uploaded = False
 
-    # Memory tracking
-    mem_tracker = []
-    mem_free_after_gc_prev = 0
-
-    def __init__(self, new_sheet_name=None, existing_sheet_name='', subsheet='Sheet1'):
+    # JWT caching. The token is kept in RAM and on flash, and only
+    # refetched from Asana shortly before it expires or after a 401.
+    JWT_CACHE_FILE_NAME = 'jwt_cache.json'
+    JWT_REFRESH_MARGIN_SEC = 5 * 60
+    # Assumed lifetime for tokens whose exp claim we can't decode
+    JWT_DEFAULT_LIFETIME_SEC = 30 * 60
+    jwt = None
+    jwt_exp = 0
+
+    # Fields mask for each request, limited to what we actually consume
+    FIELDS_UPDATE = 'updatedRows'
+    FIELDS_APPEND = 'updates.updatedRows'
+    FIELDS_COPY = 'sheetId'
+    FIELDS_BATCH_UPDATE = 'spreadsheetId'
+    FIELDS_SHEET_TITLES = 'sheets.properties.title'
+
+    # Subsheet the profiler's diagnostics rows are appended to. Created on first use.
+    DIAGNOSTICS_SHEET_NAME = 'Diagnostics'
+    diagnostics_sheet_ready = False
+
+    def __init__(self, new_sheet_name=None, existing_sheet_name='', subsheet='Sheet1', existing_sheet_id=None, header=None):
         self.sheet_name = subsheet
+        self.header = list(header) if header is not None else self.HEADER
         self.asana = asana.Simple_asana_handler()
-        self.jwt = self.asana.get_jwt()
+        self.get_jwt()
 
         _secrets = secrets.get_secrets()
 
         self.permission_updater_url = _secrets['hydra_permission_updater_url']
 
+        # If resuming, we already know which sheet to use
+        if existing_sheet_id:
+            self.sheet_id = existing_sheet_id
+            print(f'Resuming with sheet {self.sheet_id}')
+
         # If the existing sheet name is valid then use it
-        if self.SHEET_URI in existing_sheet_name:
+        elif self.SHEET_URI in existing_sheet_name:
             self.sheet_id = existing_sheet_name.split(f'{self.SHEET_URI}/')[1]
             print(f'Using existing sheet {self.sheet_id}')
 
@@ -62,10 +93,6 @@ class Simple_google_handler:
             self.sheet_id = _secrets['gsheet_id_default']
             print(f'Using default sheet {self.sheet_id}')
 
-        # Init mem tracking
-        gc.collect()
-        self.mem_free_after_gc_prev = gc.mem_free()
-
         # Get LED pin if running on mpy hardware
         if not IS_LINUX:
             self.pin = Pin("LED", Pin.OUT)
@@ -105,77 +132,187 @@ class Simple_google_handler:
 
         return label
 
-    def get_jwt(self):
+    def _decode_jwt_exp(self, jwt):
+        """
+        Returns the exp claim (unix seconds) from the payload of jwt,
+        or None if it can't be decoded
+        """
+        try:
+            payload = jwt.split('.')[1]
+            payload = payload.replace('-', '+').replace('_', '/')
+            payload += '=' * (-len(payload) % 4)
+            return int(json.loads(binascii.a2b_base64(payload))['exp'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    def _load_cached_jwt(self):
+        """
+        Populate self.jwt and self.jwt_exp from flash, if a cached token exists
+        """
+        try:
+            with open(self.JWT_CACHE_FILE_NAME, 'r') as f:
+                cached = json.load(f)
+            self.jwt = cached['jwt']
+            self.jwt_exp = cached['exp']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_cached_jwt(self):
+        """
+        Persist self.jwt and self.jwt_exp to flash
         """
-        Get a signed JWT come hell or high water
+        try:
+            with open(self.JWT_CACHE_FILE_NAME, 'w') as f:
+                json.dump({'jwt': self.jwt, 'exp': self.jwt_exp}, f)
+        except OSError as e:
+            print("WARNING: Failed to cache JWT on flash. Details:")
+            print(e)
+
+    def _jwt_is_fresh(self):
         """
-        self.jwt = self.asana.get_jwt()
+        Returns True if the cached JWT won't expire within the refresh margin
+        """
+        return bool(self.jwt) and util.unix_time() < self.jwt_exp - self.JWT_REFRESH_MARGIN_SEC
+
+    def get_jwt(self, force=False):
+        """
+        Get a signed JWT come hell or high water.
+        Uses the cached token unless it's about to expire or force is True.
+        """
+        if not force:
+            if not self.jwt:
+                self._load_cached_jwt()
+            if self._jwt_is_fresh():
+                return self.jwt
+
+        print("Fetching JWT from Asana")
+        with profiler.get_shared().span('jwt'):
+            self.jwt = self.asana.get_jwt()
+        self.jwt_exp = self._decode_jwt_exp(self.jwt)
+        if self.jwt_exp is None:
+            self.jwt_exp = util.unix_time() + self.JWT_DEFAULT_LIFETIME_SEC
+        self._save_cached_jwt()
+        return self.jwt
+
+    def _is_unauthorized(self, r):
+        """
+        Returns True if the Sheets response r is a 401 error
+        """
+        return bool(r) and 'error' in r and r['error'].get('code') == 401
 
     def upload_header(self):
         """
-        Upload the header line to the sheet
+        Upload the header line to the sheet. Returns True on success.
         """
         start = self._rowcol_to_a1(1,1)
-        end = self._rowcol_to_a1(1,len(self.HEADER))
+        end = self._rowcol_to_a1(1,len(self.header))
         range = f'{start}:{end}'
-        r = api.update_range(self.jwt, self.sheet_id, self.sheet_name, cell_range=range, values=[self.HEADER])
+
+        self.get_jwt()
+        r = api.update_range(self.jwt, self.sheet_id, self.sheet_name, cell_range=range, values=[self.header], fields=self.FIELDS_UPDATE)
+        if self._is_unauthorized(r):
+            self.get_jwt(force=True)
+            r = api.update_range(self.jwt, self.sheet_id, self.sheet_name, cell_range=range, values=[self.header], fields=self.FIELDS_UPDATE)
 
         update_succeeded = False
         if r != False:
             if not 'error' in r.keys():
                 update_succeeded = True
+                self.header_uploaded = True
 
         return update_succeeded
 
     def upload_list(self, values):
         """
-        Upload a 2D list of values to the sheet
+        Upload rows of values to the sheet. values can be a 2D list, or any
+        iterable of rows such as a Sample_batch, which is serialized row by row.
         """
         print("Trying upload_list")
+        rv = self.append_rows(self.sheet_name, values)
 
-        # If mem_free dropped by a lot, log the mem_tracker from the previous iter
-        mem_tracker = []
-        gc.collect()
-        mem_free_after_gc = gc.mem_free()
-        if self.mem_free_after_gc_prev - mem_free_after_gc > 5000:
-            print(f"Memory dropped from {self.mem_free_after_gc_prev} to {mem_free_after_gc}. Reporting to file.")
-            with open(f'mem_free_{self.mem_free_after_gc_prev}_to_{mem_free_after_gc}.txt', 'w') as f:
-                f.write(str(self.mem_tracker))
+        # TODO: We shouldn't block sensor samples on these retries
+        if rv:
+            print('upload_list: Success!')
 
-        # Remember mem_free_after_gc for next iteration
-        self.mem_free_after_gc_prev = mem_free_after_gc
+        return rv
 
+    def append_rows(self, sheet_name, values):
+        """
+        Append rows of values to the named subsheet. Returns True on success.
+        """
         # We will append after a dummy table at the first non-header cell
         start = self._rowcol_to_a1(2, 1)
         end = self._rowcol_to_a1(2, 1)
         cell_range = f'{start}:{end}'
 
         self.get_jwt()
+        prof = profiler.get_shared()
 
         print("upload_list: about to append_range")
-        r = api.append_range(self.jwt, self.sheet_id, self.sheet_name, cell_range=cell_range, values=values)
+        with prof.span('append'):
+            r = api.append_range(self.jwt, self.sheet_id, sheet_name, cell_range=cell_range, values=values, fields=self.FIELDS_APPEND)
+        if self._is_unauthorized(r):
+            # Token was revoked or rotated early. Refetch it and retry once.
+            print("upload_list: JWT rejected, refetching")
+            self.get_jwt(force=True)
+            with prof.span('append'):
+                r = api.append_range(self.jwt, self.sheet_id, sheet_name, cell_range=cell_range, values=values, fields=self.FIELDS_APPEND)
         print("upload_list: done append_range")
 
         update_succeeded = False
         if r != False:
             if not 'error' in r.keys():
                 update_succeeded = True
+                print(f"upload_list: appended {r.get('updates', {}).get('updatedRows')} rows")
 
         # Force garbage collection since r can take up a ton of RAM
-        gc.collect()
-        mem_tracker.append(gc.mem_free())
-
-        rv = False
+        with prof.span('gc'):
+            gc.collect()
 
-        # TODO: We shouldn't block sensor samples on these retries
-        if update_succeeded != False:
-            print('upload_list: Success!')
-            rv = True
-
-        self.mem_tracker = mem_tracker
-        print(mem_tracker)
+        return update_succeeded
 
-        return rv
+    def upload_diagnostics(self, row, header):
+        """
+        Append a profiler diagnostics row to the diagnostics subsheet,
+        creating it with the given header row if it doesn't exist yet
+        """
+        if not self.diagnostics_sheet_ready:
+            self.get_jwt()
+            self.diagnostics_sheet_ready = self.add_sheet(self.DIAGNOSTICS_SHEET_NAME, header)
+            if not self.diagnostics_sheet_ready:
+                return False
+        return self.append_rows(self.DIAGNOSTICS_SHEET_NAME, [row])
+
+    def add_sheet(self, title, header=None):
+        """
+        Adds a subsheet with the given title to the active spreadsheet, with
+        an optional header row. Returns True if it exists afterwards.
+        """
+        path = 'sheets[].properties.title'
+        r = api.get_spreadsheet(self.jwt, self.sheet_id, fields=self.FIELDS_SHEET_TITLES, paths=[path])
+        if title in r.get(path, []):
+            return True
+
+        body = {
+            "requests": [
+                {
+                    "addSheet": {
+                        "properties": {
+                            "title": title
+                        }
+                    }
+                }
+            ]
+        }
+        r = api.batch_update(self.jwt, self.sheet_id, body, fields=self.FIELDS_BATCH_UPDATE)
+        if r == False or 'error' in r:
+            print(f"Failed to add sheet {title}")
+            return False
+
+        if header:
+            end = self._rowcol_to_a1(1, len(header))
+            api.update_range(self.jwt, self.sheet_id, title, cell_range=f'A1:{end}', values=[header], fields=self.FIELDS_UPDATE)
+        return True
 
     def create_spreadsheet(self, title):
         """
@@ -197,7 +334,7 @@ class Simple_google_handler:
         new_id = self.create_spreadsheet(new_title)
 
         for gid in self.get_sheet_gids_in_spreadsheet(old_id):
-            api.copy_sheet(self.jwt, old_id, new_id, gid)
+            api.copy_sheet(self.jwt, old_id, new_id, gid, fields=self.FIELDS_COPY)
 
         self.sanitize_new_sheet_names(new_id)
 
@@ -207,14 +344,10 @@ class Simple_google_handler:
         """
         Returns a list of sheet gids in the given spreadsheet
         """
-        r = api.get_spreadsheet(self.jwt, sheet_id, fields='sheets.properties.sheetId')
-        sheets = r['sheets']
-
-        sheet_gids = []
-        for sheet in sheets:
-            sheet_gids.append(sheet['properties']['sheetId'])
+        path = 'sheets[].properties.sheetId'
+        r = api.get_spreadsheet(self.jwt, sheet_id, fields='sheets.properties.sheetId', paths=[path])
 
-        return sheet_gids
+        return r.get(path, [])
 
     def sanitize_new_sheet_names(self, sheet_id):
         """
@@ -222,14 +355,14 @@ class Simple_google_handler:
         Removes the default Sheet1.
         Strips "Copy of" from the names of any sheets that have that.
         """
-        r = api.get_spreadsheet(self.jwt, sheet_id, fields='sheets.properties(sheetId,title)')
-        sheets = r['sheets']
+        path = 'sheets[].properties'
+        r = api.get_spreadsheet(self.jwt, sheet_id, fields='sheets.properties(sheetId,title)', paths=[path])
 
         # Build up list of batchUpdate requests
         requests_arr = []
-        for sheet in sheets:
-            title = sheet['properties']['title']
-            id = sheet['properties']['sheetId']
+        for properties in r.get(path, []):
+            title = properties['title']
+            id = properties['sheetId']
 
             # Delete any sheets named SheetX
             if 'Sheet' in title:
@@ -266,7 +399,7 @@ class Simple_google_handler:
             }
 
             # Send the request and return the response (which will likely be unused)
-            api.batch_update(self.jwt, sheet_id, batch_update_body)
+            api.batch_update(self.jwt, sheet_id, batch_update_body, fields=self.FIELDS_BATCH_UPDATE)
 
         return
 
@@ -281,4 +414,4 @@ class Simple_google_handler:
         Sends a request to the permissions updater endpoint serving
         https://github.com/moults31/hydra-gsheet-permission-updater
         """
-        requests.get(self.permission_updater_url)
\ No newline at end of file
+        session.get(self.permission_updater_url).close()
\ No newline at end of file
@@ -0,0 +1,555 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Minimal keep-alive HTTP/1.1 session shared by the simple API wrappers.
+Keeps one persistent TLS connection per host, caches DNS results and
+reads responses through a preallocated buffer, so that back-to-back requests
+to the same host only pay for the DNS lookup, TCP connect and TLS handshake once.
+
+Exposes urequests-compatible get/put/post functions.
+"""
+
+import json
+
+try:
+    import errno
+except ImportError:
+    import uerrno as errno
+
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+
+try:
+    import ussl as ssl
+except ImportError:
+    import ssl
+
+import mpy.util.util as util
+
+# Size of the preallocated read buffer owned by each pooled connection
+READ_BUF_SIZE = 512
+
+# Socket timeout for connect, send and receive
+TIMEOUT_SEC = 20
+
+# Methods that are safe to send twice, if we can't tell whether the server got the first one
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# Cache of resolved addresses, keyed by (host, port)
+_dns_cache = {}
+
+# Pool of persistent connections, keyed by (scheme, host, port). One per host.
+_pool = {}
+
+# Counters used to measure how much wake time keep-alive saves us
+stats = {
+    'requests': 0,
+    'connections': 0,
+    'reused': 0,
+    'dns_lookups': 0,
+    'dns_cache_hits': 0,
+    'handshake_ms': 0,
+    'bytes_sent': 0,
+    'bytes_received': 0,
+}
+
+
+def _resolve(host, port):
+    """
+    Resolve host to a socket address, using the DNS cache where possible
+    """
+    key = (host, port)
+    addr = _dns_cache.get(key)
+    if addr:
+        stats['dns_cache_hits'] += 1
+        return addr
+
+    stats['dns_lookups'] += 1
+    addr = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][-1]
+    _dns_cache[key] = addr
+    return addr
+
+
+class _Connection:
+    """
+    A single persistent connection to one host, with its own read buffer
+    """
+    def __init__(self, scheme, host, port):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.response = None
+        self.n_requests = 0
+
+        # Whether the current request was fully written, and bytes read over the connection's life
+        self.sent = False
+        self.n_received = 0
+
+        # Preallocated read buffer. [start, end) is the unread region.
+        self.buf = bytearray(READ_BUF_SIZE)
+        self.mv = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def open(self):
+        """
+        Resolve, connect and (for https) perform the TLS handshake
+        """
+        t_start = util.ticks_ms()
+        addr = _resolve(self.host, self.port)
+        sock = socket.socket()
+        sock.settimeout(TIMEOUT_SEC)
+        try:
+            sock.connect(addr)
+        except OSError:
+            # The cached address may be stale, so force a fresh lookup next time
+            _dns_cache.pop((self.host, self.port), None)
+            sock.close()
+            raise
+
+        if self.scheme == 'https:':
+            if hasattr(ssl, 'create_default_context'):
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+            else:
+                sock = ssl.wrap_socket(sock, server_hostname=self.host)
+
+        self.sock = sock
+        self.start = 0
+        self.end = 0
+        self.n_requests = 0
+        stats['connections'] += 1
+        stats['handshake_ms'] += util.ticks_diff(util.ticks_ms(), t_start)
+
+    def close(self):
+        """
+        Close the underlying socket. The connection can be reopened later.
+        """
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.response = None
+        self.start = 0
+        self.end = 0
+
+    def write(self, data):
+        """
+        Write all of data to the socket
+        """
+        if hasattr(self.sock, 'sendall'):
+            self.sock.sendall(data)
+        else:
+            mv = memoryview(data)
+            while len(mv):
+                n = self.sock.write(mv)
+                mv = mv[n:]
+        stats['bytes_sent'] += len(data)
+
+    def _fill(self):
+        """
+        Refill the read buffer from the socket. Returns number of bytes read.
+        """
+        if hasattr(self.sock, 'readinto'):
+            n = self.sock.readinto(self.mv)
+        else:
+            n = self.sock.recv_into(self.mv)
+        if n is None:
+            n = 0
+        self.start = 0
+        self.end = n
+        self.n_received += n
+        stats['bytes_received'] += n
+        return n
+
+    def readline(self):
+        """
+        Read a single CRLF-terminated line, including the terminator
+        """
+        line = b''
+        while True:
+            if self.start == self.end:
+                if not self._fill():
+                    return line
+            buf = self.buf
+            i = self.start
+            end = self.end
+            while i < end and buf[i] != 10:
+                i += 1
+            if i < end:
+                line += bytes(self.mv[self.start:i + 1])
+                self.start = i + 1
+                return line
+            line += bytes(self.mv[self.start:end])
+            self.start = end
+
+    def readinto(self, mv, n):
+        """
+        Read up to n bytes into memoryview mv. Returns 0 on EOF.
+        """
+        if self.start == self.end:
+            if not self._fill():
+                return 0
+        n = min(n, len(mv), self.end - self.start)
+        mv[:n] = self.mv[self.start:self.start + n]
+        self.start += n
+        return n
+
+
+class Response:
+    """
+    urequests-compatible response whose body is read from the pooled connection on demand
+    """
+    def __init__(self, conn, status_code, reason, headers, has_body=True):
+        self._conn = conn
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self._content = None
+
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '')
+        self._chunk_left = 0
+        self._keep_alive = headers.get('connection', '').lower() != 'close'
+
+        if not has_body:
+            self._remaining = 0
+        elif self._chunked:
+            self._remaining = None
+        elif 'content-length' in headers:
+            self._remaining = int(headers['content-length'])
+        else:
+            # Body is delimited by the server closing the connection
+            self._remaining = -1
+            self._keep_alive = False
+
+        if self._remaining == 0:
+            self._finish()
+
+    def _finish(self):
+        """
+        Body fully consumed. Hand the connection back to the pool, or close it.
+        """
+        conn = self._conn
+        if conn is None:
+            return
+        self._conn = None
+        conn.response = None
+        if not self._keep_alive:
+            conn.close()
+
+    def readinto(self, mv):
+        """
+        Read the next part of the body into memoryview mv. Returns 0 once the body is done.
+        """
+        conn = self._conn
+        if conn is None:
+            return 0
+
+        if self._chunked:
+            if self._chunk_left == 0:
+                size_line = conn.readline()
+                size = int(size_line.split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # Consume optional trailers up to the terminating blank line
+                    while conn.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    self._finish()
+                    return 0
+                self._chunk_left = size
+            n = conn.readinto(mv, self._chunk_left)
+            if not n:
+                self._keep_alive = False
+                self._finish()
+                return 0
+            self._chunk_left -= n
+            if self._chunk_left == 0:
+                # Discard the CRLF after each chunk
+                conn.readline()
+            return n
+
+        if self._remaining < 0:
+            n = conn.readinto(mv, len(mv))
+            if not n:
+                self._finish()
+            return n
+
+        n = conn.readinto(mv, self._remaining)
+        if not n:
+            self._keep_alive = False
+            self._finish()
+            return 0
+        self._remaining -= n
+        if self._remaining == 0:
+            self._finish()
+        return n
+
+    def read(self, size=-1):
+        """
+        Read size bytes of the body, or all of the rest if size is negative
+        """
+        chunks = []
+        chunk = bytearray(READ_BUF_SIZE)
+        mv = memoryview(chunk)
+        total = 0
+        while size < 0 or total < size:
+            want = READ_BUF_SIZE if size < 0 else min(READ_BUF_SIZE, size - total)
+            n = self.readinto(mv[:want])
+            if not n:
+                break
+            chunks.append(bytes(mv[:n]))
+            total += n
+        return b''.join(chunks)
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.read()
+        return self._content
+
+    @property
+    def text(self):
+        return str(self.content, 'utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        """
+        Drain whatever is left of the body so the connection can be reused
+        """
+        if self._conn is None:
+            return
+        mv = memoryview(bytearray(READ_BUF_SIZE))
+        try:
+            while self.readinto(mv):
+                pass
+        except OSError:
+            conn = self._conn
+            self._keep_alive = False
+            self._finish()
+            if conn:
+                conn.close()
+
+
+def _get_connection(scheme, host, port):
+    """
+    Returns the pooled connection for the given host, creating it if needed
+    """
+    key = (scheme, host, port)
+    conn = _pool.get(key)
+    if conn is None:
+        conn = _Connection(scheme, host, port)
+        _pool[key] = conn
+    elif conn.response:
+        # Previous response was never fully read. Drain it before reusing the socket.
+        conn.response.close()
+    return conn
+
+
+def _send_and_receive(conn, method, path, headers, body):
+    """
+    Send the request on conn and parse the status line and headers
+    """
+    request = [f'{method} {path} HTTP/1.1\r\nHost: {conn.host}\r\nConnection: keep-alive\r\n']
+    for k, v in headers.items():
+        request.append(f'{k}: {v}\r\n')
+    if body is not None:
+        request.append(f'Content-Length: {len(body)}\r\n')
+    request.append('\r\n')
+    conn.write(''.join(request).encode())
+    if body is not None:
+        conn.write(body)
+    conn.sent = True
+
+    status_line = conn.readline()
+    if not status_line:
+        raise OSError('connection closed by peer')
+    parts = status_line.split(None, 2)
+    status_code = int(parts[1])
+    reason = parts[2].strip().decode() if len(parts) > 2 else ''
+
+    resp_headers = {}
+    while True:
+        line = conn.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        k, v = line.decode().split(':', 1)
+        resp_headers[k.strip().lower()] = v.strip()
+
+    has_body = method != 'HEAD' and status_code not in (204, 304)
+    response = Response(conn, status_code, reason, resp_headers, has_body=has_body)
+    if response._conn:
+        conn.response = response
+    return response
+
+
+def _is_timeout(e):
+    """
+    Returns True if e is a socket timeout. CPython raises socket.timeout, micropython OSError(ETIMEDOUT).
+    """
+    timeout = getattr(socket, 'timeout', None)
+    if timeout is not None and isinstance(e, timeout):
+        return True
+    return bool(e.args) and e.args[0] == errno.ETIMEDOUT
+
+
+def _should_retry(conn, method, n_received, e):
+    """
+    Whether a request that failed on a reused connection can be sent again on a fresh one.
+    Only if the server can't have acted on it: the request never fully went out, or the
+    connection was closed on us without a response. A timeout may mean the server is still
+    working on it, so only idempotent requests are retried after one.
+    """
+    if not conn.sent:
+        return True
+    if conn.n_received != n_received:
+        return False
+    return method in IDEMPOTENT_METHODS or not _is_timeout(e)
+
+
+_SAFE_CHARS = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.~,'
+
+def quote(s):
+    """
+    Percent-encode s for use in a query string
+    """
+    out = []
+    for b in str(s).encode():
+        if b in _SAFE_CHARS:
+            out.append(chr(b))
+        else:
+            out.append('%%%02X' % b)
+    return ''.join(out)
+
+def urlencode(params):
+    """
+    Encode a dict as a query string. List values are joined with commas.
+    """
+    parts = []
+    for k, v in params.items():
+        if isinstance(v, (list, tuple)):
+            v = ','.join(v)
+        elif v is True or v is False:
+            v = 'true' if v else 'false'
+        parts.append(f'{quote(k)}={quote(v)}')
+    return '&'.join(parts)
+
+def request(method, url, data=None, json=None, headers={}, params=None):
+    """
+    Send an HTTP request over the pooled connection for the url's host
+    """
+    if params:
+        url += ('&' if '?' in url else '?') + urlencode(params)
+    scheme, _, host, path = (url.split('/', 3) + [''])[:4]
+    path = '/' + path
+    if ':' in host:
+        host, port = host.split(':', 1)
+        port = int(port)
+    else:
+        port = 443 if scheme == 'https:' else 80
+
+    headers = dict(headers)
+    body = None
+    if json is not None:
+        body = _dumps(json)
+        headers['Content-Type'] = 'application/json'
+    elif data:
+        body = data
+    if isinstance(body, str):
+        body = body.encode()
+    if body is None and method in ('POST', 'PUT', 'PATCH'):
+        body = b''
+
+    stats['requests'] += 1
+    conn = _get_connection(scheme, host, port)
+
+    # Retry once on a fresh connection if a reused one turns out to be stale,
+    # as long as that can't send the same request twice
+    for attempt in range(2):
+        reused = conn.sock is not None
+        conn.sent = False
+        n_received = conn.n_received
+        try:
+            if not reused:
+                conn.open()
+            response = _send_and_receive(conn, method, path, headers, body)
+            if reused:
+                stats['reused'] += 1
+            conn.n_requests += 1
+            return response
+        except OSError as e:
+            conn.close()
+            if not reused or attempt or not _should_retry(conn, method, n_received, e):
+                raise
+
+
+def _dumps(obj):
+    # The json kwarg shadows the module inside request()
+    return json.dumps(obj)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def patch(url, **kwargs):
+    return request('PATCH', url, **kwargs)
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+
+def close_all():
+    """
+    Close every pooled connection, e.g. before the radio goes down
+    """
+    for conn in _pool.values():
+        conn.close()
+
+
+def get_stats():
+    """
+    Returns a copy of the session counters, plus an estimate of the
+    time saved by reusing connections instead of handshaking again
+    """
+    s = dict(stats)
+    s['handshakes_saved'] = s['reused']
+    if s['connections']:
+        s['saved_ms_estimate'] = s['reused'] * s['handshake_ms'] // s['connections']
+    else:
+        s['saved_ms_estimate'] = 0
+    return s
+
+
+def reset_stats():
+    """
+    Zero all counters, e.g. at the start of each step
+    """
+    for k in stats:
+        stats[k] = 0
+
+
+def report_stats(reset=False):
+    """
+    Print a one-line summary of the session counters
+    """
+    s = get_stats()
+    print(
+        f"http_session: {s['requests']} requests, {s['connections']} handshakes "
+        f"({s['handshake_ms']} ms), {s['handshakes_saved']} saved (~{s['saved_ms_estimate']} ms), "
+        f"dns {s['dns_lookups']} lookups / {s['dns_cache_hits']} cached"
+    )
+    if reset:
+        reset_stats()
+    return s
@@ -0,0 +1,236 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Streaming, path-selective JSON reader.
+Pulls a response body from a stream in fixed-size chunks and only materializes
+the values at the requested key paths, skipping everything else without building it.
+
+Paths are dot-separated keys, with [] meaning "every element of this array", e.g.
+    'data.notes'
+    'sheets[].properties.sheetId'
+Paths containing [] produce a list of values, others a single value.
+"""
+
+import json
+
+# Size of the chunks pulled from the stream
+CHUNK_SIZE = 256
+
+# Byte values used by the scanner
+_QUOTE = 0x22
+_BACKSLASH = 0x5C
+_COLON = 0x3A
+_COMMA = 0x2C
+_OPEN_OBJ = 0x7B
+_CLOSE_OBJ = 0x7D
+_OPEN_ARR = 0x5B
+_CLOSE_ARR = 0x5D
+_WHITESPACE = b' \t\r\n'
+
+# Marker key in the path trie for "a requested path ends here"
+_LEAF = None
+
+
+class _Reader:
+    """
+    Byte-at-a-time reader over a stream, refilled in fixed-size chunks.
+    Optionally captures consumed bytes so selected values can be decoded afterwards.
+    """
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.buf = bytearray(chunk_size)
+        self.mv = memoryview(self.buf)
+        self.pos = 0
+        self.end = 0
+        self.capture = None
+
+    def _fill(self):
+        if hasattr(self.stream, 'readinto'):
+            n = self.stream.readinto(self.mv)
+        else:
+            data = self.stream.read(len(self.buf))
+            n = len(data)
+            self.mv[:n] = data
+        self.pos = 0
+        self.end = n or 0
+        if not self.end:
+            raise ValueError('unexpected end of JSON stream')
+
+    def peek(self):
+        if self.pos == self.end:
+            self._fill()
+        return self.buf[self.pos]
+
+    def next(self):
+        if self.pos == self.end:
+            self._fill()
+        b = self.buf[self.pos]
+        self.pos += 1
+        if self.capture is not None:
+            self.capture.append(b)
+        return b
+
+    def skip_ws(self):
+        while self.peek() in _WHITESPACE:
+            self.pos += 1
+
+    def expect(self, b):
+        self.skip_ws()
+        got = self.next()
+        if got != b:
+            raise ValueError(f'expected {chr(b)!r}, got {chr(got)!r}')
+
+
+def _build_trie(paths):
+    """
+    Turns a list of paths into a nested dict keyed by path segment
+    """
+    trie = {}
+    for path in paths:
+        node = trie
+        for seg in path.replace('[]', '.[]').split('.'):
+            if seg:
+                node = node.setdefault(seg, {})
+        node[_LEAF] = path
+    return trie
+
+
+def _skip_string(r):
+    """
+    Consume the rest of a string whose opening quote was already read
+    """
+    while True:
+        b = r.next()
+        if b == _BACKSLASH:
+            r.next()
+        elif b == _QUOTE:
+            return
+
+
+def _read_key(r):
+    """
+    Read and decode an object key. The opening quote must be next.
+    """
+    r.expect(_QUOTE)
+    raw = bytearray()
+    while True:
+        b = r.next()
+        if b == _BACKSLASH:
+            raw.append(b)
+            b = r.next()
+        elif b == _QUOTE:
+            break
+        raw.append(b)
+    if _BACKSLASH in raw:
+        return json.loads(b'"' + raw + b'"')
+    return raw.decode()
+
+
+def _skip_value(r):
+    """
+    Consume a single value of any type without building it
+    """
+    r.skip_ws()
+    b = r.next()
+    if b == _QUOTE:
+        _skip_string(r)
+    elif b == _OPEN_OBJ or b == _OPEN_ARR:
+        depth = 1
+        while depth:
+            b = r.next()
+            if b == _QUOTE:
+                _skip_string(r)
+            elif b == _OPEN_OBJ or b == _OPEN_ARR:
+                depth += 1
+            elif b == _CLOSE_OBJ or b == _CLOSE_ARR:
+                depth -= 1
+    else:
+        # Number, true, false or null. Runs until a delimiter.
+        while r.peek() not in b' \t\r\n,}]':
+            r.next()
+
+
+def _capture_value(r):
+    """
+    Consume a single value and return it decoded
+    """
+    r.skip_ws()
+    r.capture = bytearray()
+    try:
+        _skip_value(r)
+        return json.loads(bytes(r.capture))
+    finally:
+        r.capture = None
+
+
+def _store(results, path, value):
+    if '[]' in path:
+        results.setdefault(path, []).append(value)
+    else:
+        results[path] = value
+
+
+def _walk(r, node, results):
+    """
+    Consume a value, descending only into the parts named in trie node
+    """
+    if _LEAF in node:
+        _store(results, node[_LEAF], _capture_value(r))
+        return
+
+    r.skip_ws()
+    b = r.peek()
+
+    if b == _OPEN_OBJ:
+        r.next()
+        r.skip_ws()
+        if r.peek() == _CLOSE_OBJ:
+            r.next()
+            return
+        while True:
+            key = _read_key(r)
+            r.expect(_COLON)
+            child = node.get(key)
+            if child is None:
+                _skip_value(r)
+            else:
+                _walk(r, child, results)
+            r.skip_ws()
+            b = r.next()
+            if b == _CLOSE_OBJ:
+                return
+            if b != _COMMA:
+                raise ValueError('malformed JSON object')
+
+    elif b == _OPEN_ARR and '[]' in node:
+        child = node['[]']
+        r.next()
+        r.skip_ws()
+        if r.peek() == _CLOSE_ARR:
+            r.next()
+            return
+        while True:
+            _walk(r, child, results)
+            r.skip_ws()
+            b = r.next()
+            if b == _CLOSE_ARR:
+                return
+            if b != _COMMA:
+                raise ValueError('malformed JSON array')
+
+    else:
+        # Shape doesn't match the requested path, so there's nothing to select here
+        _skip_value(r)
+
+
+def select(stream, paths, chunk_size=CHUNK_SIZE):
+    """
+    Parse the JSON document read from stream, returning a dict mapping each
+    requested path to its value. Paths that aren't present are left out.
+    stream may be anything with readinto(buf) or read(n), e.g. an http session Response.
+    """
+    results = {}
+    _walk(_Reader(stream, chunk_size), _build_trie(paths), results)
+    return results
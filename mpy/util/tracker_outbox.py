@@ -0,0 +1,172 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Outbox plumbing shared by the trackers.
+
+Sets up the tracker's outbox and exception digest, and provides the handlers
+for the operations every tracker queues: comments, task descriptions, sheet
+headers, data uploads, diagnostics rows and exception digests.
+
+A tracker using it provides:
+    clock             Drift-corrected clock, for outbox retry times
+    UTC_OFFSET        Offset from UTC of the timestamps logged with samples
+    radio             Shared radio, brought up to drain the outbox
+    profiler          Step profiler, reported as a diagnostics row
+    diag              Diagnostics log on flash
+    asana_handler     Simple_asana_handler, once initialized
+    gsheets_handler   Simple_google_handler, once initialized
+    buf               Sample_store of samples awaiting upload
+    take_batch()         Returns the Sample_batch of buf to upload
+    upload_batch(batch)  Upload a Sample_batch, returning True on success
+    ack_batch(batch)     Drop an uploaded batch from buf
+The sample hooks come from Tracker_samples.
+"""
+
+import mpy.util.exception_digest as exception_digest
+import mpy.util.outbox as outbox
+import mpy.util.util as util
+
+
+class Tracker_outbox:
+    """
+    Mixin giving a tracker an outbox, with handlers for the common operations
+    """
+    def init_outbox(self):
+        """
+        Set up the exception digest and the outbox. Call before anything can raise.
+        Queued housekeeping is kept on flash until sent.
+        """
+        # Exceptions counted by fingerprint, posted to the Asana exception log as a periodic digest
+        self.exception_digest = exception_digest.get_shared()
+
+        # Outgoing Asana and Sheets operations, sent in priority order within a budget per wake
+        self.outbox = outbox.Outbox(log_exception=self.log_exception)
+        self.outbox.register('comment', self.send_comment)
+        self.outbox.register('description', self.send_description)
+        self.outbox.register('header', self.send_header)
+        self.outbox.register('upload', self.send_upload)
+        self.outbox.register('diagnostics', self.send_diagnostics)
+        self.outbox.register('exception_digest', self.send_exception_digest)
+
+    def network_due(self, now):
+        """
+        Returns True if there's network work worth bringing the radio up for:
+        a warning, an upload or the exception digest. Other housekeeping only rides along.
+        Operations backing off after a failure don't count, so they don't wake the radio every step.
+        """
+        return self.outbox.has_due(now, outbox.PRIORITY_DATA) or self.outbox.is_due('exception_digest', now)
+
+    def connect(self):
+        """
+        Hold the radio up for a network operation. Returns False if it couldn't connect.
+        Pair with release() only if it returned True.
+        """
+        return self.radio.acquire()
+
+    def release(self):
+        self.radio.release()
+
+    def idle(self):
+        """
+        Power the radio down once it's gone unused for a while
+        """
+        self.radio.idle()
+
+    def connect_failed(self):
+        """
+        Called when the radio won't come up to drain the outbox
+        """
+        print("Couldn't connect to wifi. Will try again next step.")
+        self.diag.event("wifi connect failed")
+
+    def queue_housekeeping(self):
+        """
+        Queue the diagnostics row and the exception digest if they're due.
+        Re-queueing one that's already queued keeps its backoff.
+        """
+        if self.profiler.report_due(self.clock.now() + self.UTC_OFFSET):
+            self.outbox.enqueue('diagnostics', outbox.PRIORITY_HOUSEKEEPING, key='diagnostics', durable=False)
+        if self.exception_digest.report_due():
+            self.outbox.enqueue('exception_digest', outbox.PRIORITY_HOUSEKEEPING, key='exception_digest', durable=False)
+
+    def send_outbox(self):
+        """
+        Bring the radio up and drain the outbox if there's network work due.
+        Skips it if we can't connect. Call queue_housekeeping() first, so a due digest counts.
+        """
+        if not self.network_due(self.clock.now()):
+            return
+        if not self.radio.acquire():
+            self.connect_failed()
+            return
+        try:
+            self.drain_outbox()
+        finally:
+            self.radio.release()
+
+    def drain_outbox(self):
+        """
+        Queue housekeeping that's due, then send what this wake's budget allows.
+        Needs the radio up.
+        """
+        self.queue_housekeeping()
+        self.outbox.drain(self.clock.now())
+
+    def send_comment(self, args):
+        return self.asana_handler.add_comment_on_task(args['task_gid'], args['text'])
+
+    def send_description(self, args):
+        return self.asana_handler.update_task_description(args['task_gid'], args['desc'])
+
+    def send_header(self, args):
+        """
+        Label the sheet's columns. Data is appended below row 1, so this can land after it.
+        """
+        return self.gsheets_handler.upload_header()
+
+    def send_upload(self, args):
+        return self.upload_and_clear_log()
+
+    def upload_and_clear_log(self):
+        """
+        Upload buffer log to gsheets, then clear local buffer. Returns True on success.
+        """
+        if not len(self.buf):
+            return True
+        batch = self.take_batch()
+        if not self.upload_batch(batch):
+            return False
+        self.ack_batch(batch)
+        return True
+
+    def send_diagnostics(self, args):
+        """
+        Upload a row of profiler percentiles. Queued once per report period.
+        """
+        now = self.clock.now() + self.UTC_OFFSET
+        self.profiler.report()
+        if not self.gsheets_handler.upload_diagnostics(self.profiler.summary_row(now), self.profiler.header()):
+            return False
+        self.profiler.reported(now)
+        return True
+
+    def send_exception_digest(self, args):
+        """
+        Post the exception digest as a comment on the Asana exception log. Queued once per report interval.
+        """
+        if not self.exception_digest.report_due():
+            return True
+        if not self.asana_handler.update_exception_log(self.exception_digest.format(self.asana_handler.name)):
+            return False
+        self.exception_digest.reported()
+        return True
+
+    def log_exception(self, e):
+        """
+        Print an exception, keep its traceback on flash and count it towards the next digest
+        """
+        util.print_exception(e)
+        self.diag.exception(e)
+        self.exception_digest.capture(e)
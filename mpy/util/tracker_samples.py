@@ -0,0 +1,134 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Sample logging shared by the trackers.
+
+Keeps unsent samples in a WAL on flash and a RAM buffer, optionally rolled up
+into one aggregate row per window, and provides the batch hooks used to upload
+them: take_batch, upload_batch and ack_batch.
+
+A tracker using it provides:
+    SAMPLE_COLUMNS    Sample_store column spec of a raw sample
+    SAMPLE_HEADER     Sheet column labels of a raw sample, in SAMPLE_COLUMNS order
+    max_ram_rows      Rows kept in RAM for upload. The rest wait on flash.
+    flush_policy      Flush_policy deciding when the buffer is worth uploading
+    clock             Drift-corrected clock
+    UTC_OFFSET        Offset from UTC of the timestamps logged with samples
+    diag              Diagnostics log on flash
+    gsheets_handler   Simple_google_handler, once initialized
+    log_exception(e)  Report an exception
+"""
+
+import mpy.util.rollup as rollup
+import mpy.util.sample_store as sample_store
+import mpy.util.sample_wal as sample_wal
+
+
+class Tracker_samples:
+    """
+    Mixin giving a tracker a durable sample log, with optional rollup
+    """
+    def init_samples(self, wal_name, rollup_window_sec=None, raw_history_rows=rollup.RAW_HISTORY_ROWS):
+        """
+        Set up the rollup, the WAL and the RAM buffer, recovering unsent samples from
+        before the last reset. Also sets sheet_header to label the uploaded columns.
+        """
+        # Optionally upload one aggregate row per window instead of every raw sample.
+        # Rollup rows are laid out differently, so they get their own flash queue.
+        self.rollup = None
+        columns = self.SAMPLE_COLUMNS
+        self.sheet_header = self.SAMPLE_HEADER
+        if rollup_window_sec:
+            self.rollup = rollup.Rollup(self.SAMPLE_COLUMNS, rollup_window_sec, raw_history_rows)
+            columns = self.rollup.columns
+            self.sheet_header = rollup.rollup_header(self.SAMPLE_HEADER)
+            wal_name = f'{wal_name}_r{rollup_window_sec}'
+
+        # Unsent samples are kept on flash until acknowledged, so a reset doesn't lose them.
+        # Recover whatever was left from before the last reset into the RAM buffer.
+        self.wal = sample_wal.Sample_wal(wal_name)
+        self.buf = sample_store.Sample_store(columns, self.max_ram_rows)
+        self.buf.extend(self.wal.read(limit=self.max_ram_rows))
+        self.n_spilled = len(self.wal) - len(self.buf)
+        if len(self.wal):
+            print(f"Recovered {len(self.wal)} unsent samples from flash")
+
+    def record_sample(self, row):
+        """
+        Log a raw sample, or fold it into the current rollup window
+        and log the window's aggregate row once it closes
+        """
+        if self.rollup is None:
+            self.log_sample(row)
+            return
+        closed = self.rollup.add(row)
+        if closed is not None:
+            self.log_sample(closed)
+
+    def log_sample(self, row):
+        """
+        Durably log a sample to flash, and keep it in RAM for upload unless
+        the RAM buffer is full. Once full, samples spill to flash only and
+        are read back as uploads drain the buffer.
+        """
+        self.wal.append(row)
+        if self.n_spilled or self.buf.is_full():
+            self.n_spilled += 1
+        else:
+            self.buf.append(row)
+
+    def should_upload(self):
+        """
+        Returns True if the flush policy says the buffer is worth uploading now
+        """
+        reason = self.flush_policy.reason(self.buf, self.clock.now() + self.UTC_OFFSET)
+        if reason is not None:
+            print(f'Upload triggered by {reason}')
+        return reason is not None
+
+    def take_batch(self):
+        """
+        Returns the buffered rows as a batch for upload, noting which urgent marks it settles
+        """
+        self.flush_policy.batch_taken()
+        return self.buf.batch()
+
+    def upload_batch(self, batch):
+        """
+        Upload a batch of samples to gsheets. Returns True on success.
+        """
+        print("Uploading")
+        try:
+            upload_success = self.gsheets_handler.upload_list(batch) != False
+        except BaseException as e:
+            print("Hit exception in step. Continuing.")
+            self.log_exception(e)
+            return False
+
+        if upload_success:
+            self.upload_succeeded(batch)
+        else:
+            self.upload_failed(batch)
+        return upload_success
+
+    def upload_succeeded(self, batch):
+        print("Done uploading")
+
+    def upload_failed(self, batch):
+        print("Upload returned false. Will keep buffer intact and try again next sample.")
+        self.diag.event(f"upload of {len(batch)} rows failed")
+
+    def ack_batch(self, batch):
+        """
+        Acknowledge a successfully uploaded batch so it's dropped from flash,
+        then refill the RAM buffer with any samples that spilled to flash
+        """
+        self.wal.ack(len(batch))
+        self.buf.drop(len(batch))
+        self.flush_policy.flushed()
+        if self.n_spilled:
+            refill = self.wal.read(skip=len(self.buf), limit=self.max_ram_rows - len(self.buf))
+            self.buf.extend(refill)
+            self.n_spilled -= len(refill)
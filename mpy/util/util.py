@@ -8,42 +8,126 @@ Collection of misc util functions for use from anywhere in hydra
 
 import sys
 import time
+import gc
 
 IS_LINUX = (sys.platform == 'linux')
 
 if not IS_LINUX:
-    import mpy.networking.wifi as wifi
-
     import picosleep
 
     from machine import Pin, mem32
-    PIN = Pin("LED", Pin.OUT)
+
+# LED pin, created on first use
+_pin = None
+
+def get_pin():
+    """
+    Returns the LED pin, creating it on first use
+    """
+    global _pin
+    if _pin is None:
+        _pin = Pin("LED", Pin.OUT)
+    return _pin
 
 def blink(n_periods, n_blinks_per_period, period, blink_interval):
     if not IS_LINUX:
-        og = PIN.value()
+        pin = get_pin()
+        og = pin.value()
         for _ in range(n_periods):
-            PIN.off()
+            pin.off()
             time.sleep(period)
             for _ in range(n_blinks_per_period):
-                PIN.on()
+                pin.on()
                 time.sleep(blink_interval)
-                PIN.off()
+                pin.off()
                 time.sleep(blink_interval)
-        PIN.value(og)
+        pin.value(og)
+
+def ticks_ms():
+    """
+    Millisecond tick counter. Uses time.ticks_ms on micropython,
+    and a monotonic clock when running on linux.
+    """
+    if hasattr(time, 'ticks_ms'):
+        return time.ticks_ms()
+    return int(time.monotonic() * 1000)
+
+def ticks_us():
+    """
+    Microsecond tick counter. Uses time.ticks_us on micropython,
+    and a monotonic clock when running on linux.
+    """
+    if hasattr(time, 'ticks_us'):
+        return time.ticks_us()
+    return int(time.monotonic() * 1000000)
+
+def ticks_diff(end, start):
+    """
+    Signed difference between two tick values, wraparound-safe on micropython
+    """
+    if hasattr(time, 'ticks_diff'):
+        return time.ticks_diff(end, start)
+    return end - start
+
+def unix_time():
+    """
+    Seconds since the Unix epoch, regardless of the port's native epoch.
+    Some micropython ports count from 2000-01-01 instead of 1970-01-01.
+    """
+    if time.gmtime(0)[0] == 2000:
+        return time.time() + 946684800
+    return time.time()
+
+def mem_free():
+    """
+    Free heap bytes on micropython. Always 0 on CPython, which doesn't track it.
+    """
+    return gc.mem_free() if hasattr(gc, 'mem_free') else 0
+
+def mem_alloc():
+    """
+    Allocated heap bytes on micropython. Always 0 on CPython, which doesn't track it.
+    """
+    return gc.mem_alloc() if hasattr(gc, 'mem_alloc') else 0
+
+def print_exception(e):
+    """
+    Print an exception with its traceback on micropython or CPython
+    """
+    if hasattr(sys, 'print_exception'):
+        sys.print_exception(e)
+    else:
+        import traceback
+        traceback.print_exception(type(e), e, e.__traceback__)
+
+def format_exception(e):
+    """
+    Returns an exception with its traceback as a string, on micropython or CPython
+    """
+    if hasattr(sys, 'print_exception'):
+        import io
+        buf = io.StringIO()
+        sys.print_exception(e, buf)
+        return buf.getvalue()
+    import traceback
+    return ''.join(traceback.format_exception(type(e), e, e.__traceback__))
 
 def prepare_and_sleep(duration):
     """
     Prepare and sleep
     """
-    # Prepare for sleep
+    # Imported here since the radio manager depends on this module
+    import mpy.networking.radio as radio
+
+    # Prepare for sleep. The radio manager decides whether the radio stays up
+    # in power-save mode or goes down, and accounts for its on-time.
+    deep = not IS_LINUX and not get_usb_connected()
     if not IS_LINUX:
         print("Preparing to sleep")
-        wifi.disconnect()
-        time.sleep(15)
+    radio.get_shared().sleep_hint(duration, deep=deep)
 
     # Sleep
-    if IS_LINUX or (not IS_LINUX and get_usb_connected()):
+    if not deep:
         print("Entering fake sleep")
         time.sleep(duration)
     else:
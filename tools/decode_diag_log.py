@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2022 Zac Moulton
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Host tool to decode hydra's on-flash diagnostics log (mpy/util/diag_log.py).
+
+Copy the log off the device first, e.g.
+    mpremote cp -r :diag .
+then
+    python tools/decode_diag_log.py diag [--type memory|exception|event] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mpy.util.diag_log as diag_log
+
+
+def format_record(record_type, t, value):
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))
+    if record_type == 'memory':
+        value = f'free {value[0]} B, allocated {value[1]} B'
+    return f'{stamp} {record_type:<9} {value}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dir', nargs='?', default=diag_log.DIR_NAME, help='copy of the log directory')
+    parser.add_argument('--type', choices=list(diag_log.RECORD_NAMES.values()), help='only show records of this type')
+    parser.add_argument('--json', action='store_true', help='one JSON object per line')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        sys.exit(f"No diagnostics log at {args.dir}")
+
+    for record_type, t, value in diag_log.read_records(args.dir):
+        if args.type and record_type != args.type:
+            continue
+        if args.json:
+            print(json.dumps({'type': record_type, 'time': t, 'value': value}))
+        else:
+            print(format_record(record_type, t, value))
+
+
+if __name__ == '__main__':
+    main()